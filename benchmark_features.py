@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import sys
+import time
+
+from python_mods import SVMClassifier
+from python_mods import feature_extractor
+from ulm_v2 import load_lexelt
+
+
+def extract_uncompiled(lexelt, list_feature_extractors):
+    # The original loop: function lookup and option parsing for every instance
+    features_for_instance = []
+    for this_instance in lexelt:
+        list_string_features = []
+        for this_function_name, these_options in list_feature_extractors:
+            this_function = getattr(feature_extractor, this_function_name)
+            this_function(this_instance, these_options, list_string_features)
+        features_for_instance.append(list_string_features)
+    return features_for_instance
+
+
+def extract_compiled(lexelt, my_classifier):
+    features_for_instance = []
+    for this_instance in lexelt:
+        features_for_instance.append(my_classifier.extract_features(this_instance))
+    return features_for_instance
+
+
+def extract_ids(lexelt, my_classifier):
+    features_for_instance = []
+    for this_instance in lexelt:
+        features_for_instance.append(my_classifier.extract_feature_ids(this_instance))
+    return features_for_instance
+
+
+def best_time(function, repeats):
+    best = None
+    result = None
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = function()
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Compares the feature extraction with and without the compiled feature extractors on one lexelt')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-i', dest='bin_file', required=True, help='Lexelt in ULM format (for instance data/semcor30_ulm/be.v.bin)')
+    parser.add_argument('-c', dest='config_file', required=True, help='XML feature definition file')
+    parser.add_argument('-n', dest='repeats', type=int, default=3, help='Number of repetitions, the best time is reported')
+    args = parser.parse_args()
+
+    lexelt = load_lexelt(args.bin_file)
+
+    my_classifier = SVMClassifier(extraction_mode='ids')
+    my_classifier.load_feature_extractors(args.config_file)
+
+    time_uncompiled, features_uncompiled = best_time(lambda: extract_uncompiled(lexelt, my_classifier.list_feature_extractors), args.repeats)
+    time_compiled, features_compiled = best_time(lambda: extract_compiled(lexelt, my_classifier), args.repeats)
+    time_ids, features_ids = best_time(lambda: extract_ids(lexelt, my_classifier), args.repeats)
+
+    if features_uncompiled != features_compiled:
+        print('ERROR: the compiled extractors generate different features', file=sys.stderr)
+        sys.exit(1)
+    to_string = my_classifier.feature_vocabulary.to_string
+    if features_compiled != [[to_string(feature_id) for feature_id in feature_ids] for feature_ids in features_ids]:
+        print('ERROR: the integer ids do not correspond to the string features', file=sys.stderr)
+        sys.exit(1)
+
+    num_features = sum(len(features) for features in features_compiled)
+    print('Lexelt %s: %d instances, %d features' % (lexelt.get_item_key(), len(lexelt), num_features))
+    print('Uncompiled extractors: %.3f seconds' % time_uncompiled)
+    print('Compiled extractors  : %.3f seconds' % time_compiled)
+    print('Integer feature ids  : %.3f seconds' % time_ids)
+    print('Speed-up compiled: %.2fx  integer ids: %.2fx' % (time_uncompiled / time_compiled, time_uncompiled / time_ids))
@@ -1,54 +1,87 @@
 #!/usr/bin/env python
 
+import argparse
 import os
 import sys
 import pickle
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 
 from python_mods import SVMClassifier
-from nltk.corpus import WordNetCorpusReader
+from sense_inventory import as_sense_inventory, get_sense_inventory
 
 def get_mfs(lemma,pos,wn_reader):
-    mfs_key = None
-    lemmas = wn_reader.lemmas(lemma,pos)
-    if lemmas != None and len(lemmas) != 0:
-        mfs_key = lemmas[0].key()
-    return mfs_key
+    # wn_reader is a NLTK reader or a sense inventory, None if the lemma is not in WordNet
+    return as_sense_inventory(wn_reader).get_first_sense(lemma,pos)
 
 
-if __name__ == '__main__':
-    lexelt_filename = sys.argv[1]
-    model_folder = sys.argv[2]
-    
-    path_to_wn_dict = '/home/rbevia/wsd_lfs/resources/WordNet-3.0/dict'
-    
-    my_wn_reader = WordNetCorpusReader(path_to_wn_dict,None)
-    
-    fd = open(lexelt_filename,'rb')
-    lexelt_data = pickle.load(fd)
-    fd.close()
+def classify_item(item):
+    # Runs in the workers, returns None for the values if there is no classifier for the lemma
+    lemma, short_pos, lexelt, model_folder, backend = item
+    my_classifier = SVMClassifier(backend)
+    exists_classifier = my_classifier.start_classifier(lemma,short_pos,model_folder)
+    if exists_classifier:
+        return my_classifier.disambiguate_lexelt(lexelt)
+    else:
+        return None
 
-    total_no_class = total_yes_class = 0
-    no_classifiers = []
-    keys_for_instance_id = {}
+
+def disambiguate_items(lexelt_data, model_folder, wn_reader, jobs=1, use_processes=False, backend=None):
+    # The items are classified concurrently, but the results are collected in
+    # the original order of lexelt_data so the output is always the same
+    items = []
     for (lemma,pos), lexelt in lexelt_data.items():
-        lemma = lemma.lower()
-        short_pos = pos.lower()[0]
-        print('Running classification for %s.%s' % (lemma,pos), file=sys.stderr)
-        my_classifier = SVMClassifier()
-        exists_classifier = my_classifier.start_classifier(lemma,short_pos,model_folder) 
-        if exists_classifier:
+        items.append((lemma.lower(), pos.lower()[0], lexelt, model_folder, backend))
+
+    if jobs > 1:
+        if use_processes:
+            executor = ProcessPoolExecutor(jobs)
+        else:
+            executor = ThreadPoolExecutor(jobs)
+        results = executor.map(classify_item, items)
+    else:
+        executor = None
+        results = map(classify_item, items)
+
+    keys_for_instance_id = {}
+    no_classifiers = []
+    total_yes_class = 0
+    for (lemma, short_pos, lexelt, _, _), values_for_instance_id in zip(items, results):
+        print('Running classification for %s.%s' % (lemma,short_pos), file=sys.stderr)
+        if values_for_instance_id is not None:
             total_yes_class += 1
-            values_for_instance_id = my_classifier.disambiguate_lexelt(lexelt)
             for this_id, these_values in values_for_instance_id.items():
                 keys_for_instance_id[this_id] = these_values
         else:
-            total_no_class += 1
             no_classifiers.append((lemma,short_pos))
             #Get the MFS for (lemma,pos) and assign it to all the instance for this lexical item
             print('\tNo classifier for %s %s' % (lemma,short_pos), file = sys.stderr)
-            mfs_key = get_mfs(lemma, short_pos, my_wn_reader)
+            mfs_key = get_mfs(lemma, short_pos, wn_reader)
             for instance in lexelt:
-                keys_for_instance_id[instance.get_id()] = [(mfs_key,1.0)]                
+                keys_for_instance_id[instance.get_id()] = [(mfs_key,1.0)]
+    if executor is not None:
+        executor.shutdown()
+    return keys_for_instance_id, total_yes_class, no_classifiers
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Disambiguates the instances of a pickled dictionary of Clexelt objects')
+    parser.add_argument('lexelt_filename', help='Pickle file with the Clexelt objects for every (lemma,pos)')
+    parser.add_argument('model_folder', help='Folder with the trained models')
+    parser.add_argument('-wn', dest='path_to_wn_dict', default='/home/rbevia/wsd_lfs/resources/WordNet-3.0/dict', help='Path to the wordnet dict folder or to a sense inventory file (wn_to_sense_inventory.py)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of lemmas classified concurrently')
+    parser.add_argument('--processes', dest='use_processes', action='store_true', help='Use a pool of processes instead of threads')
+    parser.add_argument('-b', '--backend', dest='backend', default=None, help='SVM backend (svmlight or linear)')
+    args = parser.parse_args()
+    
+    my_wn_reader = get_sense_inventory(args.path_to_wn_dict)
+    
+    fd = open(args.lexelt_filename,'rb')
+    lexelt_data = pickle.load(fd)
+    fd.close()
+
+    keys_for_instance_id, total_yes_class, no_classifiers = disambiguate_items(lexelt_data, args.model_folder, my_wn_reader,
+                                                                               jobs=args.jobs, use_processes=args.use_processes, backend=args.backend)
+    total_no_class = len(no_classifiers)
     
     total_instances = 0
     for this_id, list_key_confidence in sorted(list(keys_for_instance_id.items()), key=lambda t: t[0]):
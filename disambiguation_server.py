@@ -0,0 +1,253 @@
+#!/usr/bin/env python
+
+'''
+Local HTTP server that keeps the models loaded and disambiguates batches of
+instances. Send a POST to /disambiguate with a JSON document like:
+
+{"items": [{"lemma": "house", "pos": "n",
+            "instances": [{"id": "d001.s001.t003",
+                           "tokens": [["The", "the", "DT"], ["house", "house", "NN"], ...],
+                           "head": [1],
+                           "sentence_positions": [0, 0, ...]}]}]}
+
+Every token is [text, lemma, pos], "head" are the indexes of the target
+tokens and "sentence_positions" (optional) the sentence of every token
+relative to the sentence of the target. The answer contains, for every
+instance id, the ranked list of [sensekey, score] returned by
+SVMClassifier.disambiguate_lexelt (or the MFS for lemmas without a model):
+
+{"results": {"d001.s001.t003": [["house%1:06:00::", 0.52], ...]}}
+
+Requests arriving within a short window are grouped by lemma.pos and scored
+in one single call to the classifier. GET /stats returns the counters of the
+model registry and the batches.
+'''
+
+import argparse
+import json
+import queue
+import sys
+import threading
+import time
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from my_data_classes import Ctoken, Cinstance, Clexelt
+from python_mods import ModelRegistry
+from disambiguate import get_mfs
+
+
+def get_lemma_pos(item):
+    # Normalised (lemma, pos) of one item of a request, ValueError if they are not non-empty strings
+    lemma = item['lemma']
+    pos = item['pos']
+    if not isinstance(lemma, str) or not isinstance(pos, str) or len(lemma) == 0 or len(pos) == 0:
+        raise ValueError('lemma and pos must be non-empty strings, not %r and %r' % (lemma, pos))
+    return lemma.lower(), pos.lower()[0]
+
+
+def create_instance(instance_data, internal_id):
+    # ValueError if the tokens, head or sentence positions of the instance are not valid
+    tokens = instance_data['tokens']
+    if not isinstance(tokens, list) or any(not isinstance(token, list) or len(token) != 3 for token in tokens):
+        raise ValueError('tokens must be a list of [text, lemma, pos] lists')
+    head = instance_data['head']
+    if not isinstance(head, list) or len(head) == 0 or \
+       any(type(index) is not int or not 0 <= index < len(tokens) for index in head):
+        raise ValueError('head must be a non-empty list of token indexes between 0 and %d, not %r' % (len(tokens)-1, head))
+    sentence_positions = instance_data.get('sentence_positions')
+    if sentence_positions is not None and (not isinstance(sentence_positions, list) or len(sentence_positions) != len(tokens)):
+        raise ValueError('sentence_positions must be a list with one position for each of the %d tokens' % len(tokens))
+
+    new_instance = Cinstance()
+    new_instance.set_id(internal_id)
+    list_tokens = []
+    relative_sentence_for_token_id = {}
+    for num_token, (text, lemma, pos) in enumerate(tokens):
+        new_token = Ctoken('%s#%d' % (internal_id, num_token))
+        new_token.set_text(text)
+        new_token.set_lemma(lemma)
+        new_token.set_pos(pos)
+        list_tokens.append(new_token)
+        if sentence_positions is not None:
+            relative_sentence_for_token_id[new_token.get_id()] = sentence_positions[num_token]
+    new_instance.set_tokens_and_sentence_positions(list_tokens, relative_sentence_for_token_id)
+    new_instance.set_index_head_list(head)
+    return new_instance
+
+
+class BatchScheduler:
+    '''
+    Collects the requests that arrive within batch_window seconds, groups their
+    instances by (lemma,pos) and scores every group in one pass
+    '''
+    def __init__(self, registry, wn_reader=None, batch_window=0.01):
+        self.registry = registry
+        self.wn_reader = wn_reader
+        self.batch_window = batch_window
+        self.pending = queue.Queue()
+        self.num_batches = 0
+        self.num_requests = 0
+        self.num_instances = 0
+        self.thread = threading.Thread(target=self.__run, daemon=True)
+        self.thread.start()
+
+    def submit(self, items):
+        # items is the list of {"lemma", "pos", "instances"} of one request, returns a Future
+        this_future = Future()
+        self.pending.put((items, this_future))
+        return this_future
+
+    def __run(self):
+        while True:
+            batch = [self.pending.get()]
+            deadline = time.time() + self.batch_window
+            while True:
+                remaining = deadline - time.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.pending.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # Any unexpected error fails the requests of this batch, the thread keeps serving the next ones
+            try:
+                self.__process_batch(batch)
+            except Exception as e:
+                for items, this_future in batch:
+                    if not this_future.done():
+                        this_future.set_exception(e)
+
+    def __process_batch(self, batch):
+        # Internal ids avoid collisions between the instance ids of different requests
+        lexelt_for_lemma_pos = {}
+        requests_for_lemma_pos = {}     # (lemma,pos) -> set of num request with instances in that lexelt
+        original_ids = []           # internal id -> (num request, original id)
+        for num_request, (items, this_future) in enumerate(batch):
+            # The whole request is parsed before adding its instances, a malformed one adds nothing
+            parsed_instances = []
+            try:
+                for item in items:
+                    lemma_pos = get_lemma_pos(item)
+                    for instance_data in item['instances']:
+                        internal_id = str(len(original_ids) + len(parsed_instances))
+                        parsed_instances.append((lemma_pos, instance_data['id'], create_instance(instance_data, internal_id)))
+            except Exception as e:
+                this_future.set_exception(ValueError('Malformed request: %s: %s' % (type(e).__name__, e)))
+                continue
+            for lemma_pos, original_id, new_instance in parsed_instances:
+                if lemma_pos not in lexelt_for_lemma_pos:
+                    lexelt_for_lemma_pos[lemma_pos] = Clexelt(*lemma_pos)
+                    requests_for_lemma_pos[lemma_pos] = set()
+                original_ids.append((num_request, original_id))
+                requests_for_lemma_pos[lemma_pos].add(num_request)
+                # Instances are appended directly, the same context can be sent by different requests
+                lexelt_for_lemma_pos[lemma_pos].instances.append(new_instance)
+
+        results = [{} for _ in batch]
+        for (lemma, pos), lexelt in lexelt_for_lemma_pos.items():
+            # An error in one lexelt only fails the requests that sent instances to it
+            try:
+                my_classifier = self.registry.get_classifier(lemma, pos)
+                if my_classifier is not None:
+                    values_for_instance_id = my_classifier.disambiguate_lexelt(lexelt)
+                else:
+                    mfs_key = get_mfs(lemma, pos, self.wn_reader) if self.wn_reader is not None else None
+                    values_for_instance_id = {}
+                    for instance in lexelt:
+                        values_for_instance_id[instance.get_id()] = [(mfs_key,1.0)] if mfs_key is not None else []
+            except Exception as e:
+                for num_request in requests_for_lemma_pos[(lemma, pos)]:
+                    this_future = batch[num_request][1]
+                    if not this_future.done():
+                        this_future.set_exception(e)
+                continue
+            for internal_id, these_values in values_for_instance_id.items():
+                num_request, original_id = original_ids[int(internal_id)]
+                results[num_request][original_id] = these_values
+
+        self.num_batches += 1
+        self.num_requests += len(batch)
+        self.num_instances += len(original_ids)
+        for (items, this_future), these_results in zip(batch, results):
+            if not this_future.done():
+                this_future.set_result(these_results)
+
+    def get_stats(self):
+        return {'batches': self.num_batches, 'requests': self.num_requests, 'instances': self.num_instances}
+
+
+class DisambiguationHandler(BaseHTTPRequestHandler):
+    scheduler = None
+    request_timeout = 60.0          # seconds waiting for the result of one request
+
+    def __send_json(self, code, data):
+        body = json.dumps(data).encode('utf-8')
+        self.send_response(code)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path == '/stats':
+            stats = {'registry': self.scheduler.registry.get_stats(), 'scheduler': self.scheduler.get_stats()}
+            self.__send_json(200, stats)
+        else:
+            self.__send_json(404, {'error': 'Unknown path %s' % self.path})
+
+    def do_POST(self):
+        if self.path != '/disambiguate':
+            self.__send_json(404, {'error': 'Unknown path %s' % self.path})
+            return
+        try:
+            length = int(self.headers.get('Content-Length', 0))
+            request = json.loads(self.rfile.read(length).decode('utf-8'))
+            if not isinstance(request, dict) or not isinstance(request.get('items'), list):
+                raise ValueError('The request must be a JSON object with a list of items')
+            results = self.scheduler.submit(request['items']).result(timeout=self.request_timeout)
+        except FutureTimeoutError:
+            self.__send_json(503, {'error': 'No result after %.1f seconds' % self.request_timeout})
+            return
+        except ValueError as e:
+            self.__send_json(400, {'error': str(e)})
+            return
+        except KeyError as e:
+            self.__send_json(400, {'error': 'Missing field %s' % e})
+            return
+        except Exception as e:
+            self.__send_json(500, {'error': '%s: %s' % (type(e).__name__, e)})
+            return
+        self.__send_json(200, {'results': results})
+
+    def log_message(self, format, *args):
+        print('%s - %s' % (self.address_string(), format % args), file=sys.stderr)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Runs a local server that disambiguates batches of instances with the models loaded once')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-m', dest='model_folder', required=True, help='Folder with the trained models')
+    parser.add_argument('-wn', dest='path_to_wn', default=None, help='Path to the wordnet dict folder or to a sense inventory file, used for the MFS of lemmas without model')
+    parser.add_argument('--host', dest='host', default='127.0.0.1', help='Host to listen on')
+    parser.add_argument('-p', '--port', dest='port', type=int, default=8080, help='Port to listen on')
+    parser.add_argument('-w', '--window', dest='window', type=float, default=10, help='Milliseconds to wait for more requests to group in one batch')
+    parser.add_argument('-b', '--backend', dest='backend', default=None, help='SVM backend (svmlight or linear)')
+    parser.add_argument('-t', '--timeout', dest='timeout', type=float, default=60, help='Seconds to wait for the result of one request')
+    args = parser.parse_args()
+
+    my_wn_reader = None
+    if args.path_to_wn is not None:
+        from sense_inventory import get_sense_inventory
+        my_wn_reader = get_sense_inventory(args.path_to_wn)
+
+    registry = ModelRegistry(args.model_folder, backend=args.backend)
+    DisambiguationHandler.request_timeout = args.timeout
+    DisambiguationHandler.scheduler = BatchScheduler(registry, my_wn_reader, batch_window=args.window/1000.0)
+    server = ThreadingHTTPServer((args.host, args.port), DisambiguationHandler)
+    print('Serving models from %s on http://%s:%d' % (args.model_folder, args.host, args.port), file=sys.stderr)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
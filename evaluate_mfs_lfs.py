@@ -1,6 +1,7 @@
 #!/usr/bin/env python
 
 from nltk.corpus import wordnet
+from sense_inventory import as_sense_inventory, get_sense_inventory
 
 import sys
 import tempfile
@@ -19,9 +20,11 @@ def load_file(this_file):
     fd.close()
     return keys_for_id
 
-def get_first_sense(this_lemma, this_pos):
-    lemmas = wordnet.lemmas(this_lemma,this_pos)
-    return lemmas[0].key()
+def get_first_sense(this_lemma, this_pos, inventory=None):
+    # inventory is a sense inventory (sense_inventory.py), by default the one of the NLTK wordnet corpus
+    if inventory is None:
+        inventory = as_sense_inventory(wordnet)
+    return inventory.get_first_sense(this_lemma,this_pos)
 
 
 def evaluate(list_ids, gold_keys, system_keys):
@@ -61,6 +64,10 @@ if __name__ == '__main__':
     gold_keys_for_id = load_file(path_to_key)
     
     system_keys_for_id = load_file(sys.argv[1])
+    # Optional second argument: a sense inventory file or a wordnet dict folder
+    inventory = None
+    if len(sys.argv) > 2:
+        inventory = get_sense_inventory(sys.argv[2])
     
     mfs_ids = set()
     lfs_ids = set()
@@ -69,7 +76,7 @@ if __name__ == '__main__':
     for this_id, list_keys in gold_keys_for_id.items():
         one_key = list_keys[0]
         lemma = one_key[:one_key.find('%')]
-        mfs = get_first_sense(lemma,'n')
+        mfs = get_first_sense(lemma,'n',inventory)
         if mfs in list_keys:
             mfs_ids.add(this_id)
         else:
@@ -0,0 +1,48 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import gc
+import os
+import resource
+import time
+
+from ulm_archive import iter_lexelts
+
+
+def get_resident_memory():
+    # Current resident memory in bytes (Linux), otherwise the peak from getrusage
+    try:
+        fd = open('/proc/self/statm')
+        resident_pages = int(fd.read().split()[1])
+        fd.close()
+        return resident_pages * resource.getpagesize()
+    except (IOError, OSError):
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Measures the resident memory used to load all the lexelts of a folder in ULM format')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-i', dest='input_folder', required=True, help='Folder with the .bin or .ulm2 files in ULM format or ULM archive')
+    parser.add_argument('--compact', dest='compact', action='store_true', help='Move the tokens to columnar tables (Clexelt.compact) after loading')
+    args = parser.parse_args()
+
+    gc.collect()
+    memory_before = get_resident_memory()
+    start = time.time()
+    string_table = None
+    list_lexelts = []
+    for lexelt in iter_lexelts(args.input_folder):
+        if args.compact:
+            string_table = lexelt.compact(string_table)
+        list_lexelts.append(lexelt)
+    gc.collect()
+    memory_after = get_resident_memory()
+
+    num_instances = sum(len(lexelt) for lexelt in list_lexelts)
+    num_tokens = sum(instance.get_num_tokens() for lexelt in list_lexelts for instance in lexelt)
+    print('Lexelts: %d  Instances: %d  Tokens in the contexts: %d' % (len(list_lexelts), num_instances, num_tokens))
+    print('Loading time: %.2f seconds' % (time.time() - start))
+    print('Resident memory: %.1f MB (%.1f MB before loading)' % ((memory_after - memory_before) / (1024.0 * 1024.0), memory_before / (1024.0 * 1024.0)))
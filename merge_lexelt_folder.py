@@ -6,20 +6,18 @@ import glob
 import pickle
 from copy import deepcopy
 
+from ulm_archive import iter_lexelts
+
 if __name__ == '__main__':
     out_folder = sys.argv[-1]
     
     data_lexelt = {}
     os.mkdir(out_folder)
     for folder in sys.argv[1:-1]:
-        for bin_file in glob.glob(folder+'/*.bin'):
-            print(bin_file)
-            fd_in = open(bin_file,'rb')
-            lexelt = pickle.load(fd_in)
-            fd_in.close()
-            
+        for lexelt in iter_lexelts(folder):
             item_key = lexelt.get_item_key()
             item_key = item_key.replace('/','_')
+            print('%s %s' % (folder, item_key))
             
             if item_key not in data_lexelt:
                 print('  First found')
@@ -1,27 +1,60 @@
 from __future__ import print_function
 
+import copy
 import hashlib
 import sys
+from array import array
+from types import MappingProxyType
 
 from lxml import html, etree
 from xml.sax.saxutils import escape
 
 
+EMPTY_SET = frozenset()                 # Shared default for the empty sets of the instances
+EMPTY_DICT = MappingProxyType({})       # Shared default for the empty dictionaries of the instances
+CONTENT_DIGEST_SIZE = 16                # Bytes of the blake2b digests of Clexelt.existing_instances
+
+
+def get_text_digest(text):
+    # Digest of the text that Cinstance.get_content_digest hashes, used to migrate the old
+    # existing_instances, which had the text itself
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=CONTENT_DIGEST_SIZE).digest()
+
+
+def intern_string(this_string):
+    # The lemmas and PoS tags repeat a lot, all the equal ones are the same object in memory
+    if isinstance(this_string, str):
+        return sys.intern(this_string)
+    return this_string
+
+
 class Ctoken:
+    __slots__ = ('token_id', 'pos', 'lemma', 'text')
+    
     def __init__(self, token_id):
         self.token_id = token_id
         self.pos = None
         self.lemma = None
         self.text = None
         
+    def __getstate__(self):
+        return {'token_id': self.token_id, 'pos': self.pos, 'lemma': self.lemma, 'text': self.text}
+    
+    def __setstate__(self, state):
+        # state is the __dict__ of the tokens pickled before __slots__ or the one of __getstate__
+        self.token_id = state.get('token_id')
+        self.pos = intern_string(state.get('pos'))
+        self.lemma = intern_string(state.get('lemma'))
+        self.text = state.get('text')
+        
     def set_pos(self,this_pos):
-        self.pos = this_pos
+        self.pos = intern_string(this_pos)
         
     def set_text(self,this_text):
         self.text = this_text
         
     def set_lemma(self, this_lemma):
-        self.lemma = this_lemma
+        self.lemma = intern_string(this_lemma)
            
 
     def get_lemma(self):
@@ -45,6 +78,132 @@ class Ctoken:
         a = '%s %s %s %s' % (self.token_id, str(self.text),str(self.lemma),str(self.pos))
         return a
     
+    
+class Cstring_table:
+    '''
+    Every distinct string gets an integer id, used by the columns of Ctoken_table
+    '''
+    def __init__(self):
+        self.strings = []
+        self.id_for_string = {}
+        
+    def get_id(self, this_string):
+        # None is -1
+        if this_string is None:
+            return -1
+        string_id = self.id_for_string.get(this_string)
+        if string_id is None:
+            string_id = len(self.strings)
+            this_string = intern_string(this_string)
+            self.id_for_string[this_string] = string_id
+            self.strings.append(this_string)
+        return string_id
+    
+    def get_string(self, string_id):
+        if string_id == -1:
+            return None
+        return self.strings[string_id]
+    
+    def __len__(self):
+        return len(self.strings)
+    
+    
+class Ctoken_table:
+    '''
+    Columnar version of a list of Ctoken: the token ids in a list and the text, lemma and
+    PoS as arrays of ids of a Cstring_table. It is used as a list of tokens, the Ctoken
+    objects are created when they are accessed
+    '''
+    def __init__(self, string_table, list_tokens=()):
+        self.string_table = string_table
+        self.token_ids = []
+        self.text_ids = array('i')
+        self.lemma_ids = array('i')
+        self.pos_ids = array('i')
+        self.extend(list_tokens)
+        
+    def extend(self, list_tokens):
+        get_id = self.string_table.get_id
+        for token in list_tokens:
+            self.token_ids.append(token.token_id)
+            self.text_ids.append(get_id(token.text))
+            self.lemma_ids.append(get_id(token.lemma))
+            self.pos_ids.append(get_id(token.pos))
+            
+    def __get_token(self, num_token):
+        get_string = self.string_table.get_string
+        token = Ctoken(self.token_ids[num_token])
+        token.text = get_string(self.text_ids[num_token])
+        token.lemma = get_string(self.lemma_ids[num_token])
+        token.pos = get_string(self.pos_ids[num_token])
+        return token
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self.__get_token(num_token) for num_token in range(*i.indices(len(self.token_ids)))]
+        if i < 0:
+            i += len(self.token_ids)
+        if i < 0 or i >= len(self.token_ids):
+            raise IndexError('Token index out of range')
+        return self.__get_token(i)
+    
+    def __len__(self):
+        return len(self.token_ids)
+    
+    def __iter__(self):
+        for num_token in range(len(self.token_ids)):
+            yield self.__get_token(num_token)
+            
+            
+class Cdocument:
+    '''
+    Tokens of one document split in sentences. The instances taken from the
+    document point to it and to a range of its sentences, instead of having
+    their own copy of the tokens of the context
+    '''
+    def __init__(self, doc_id=''):
+        self.id = doc_id
+        self.tokens = []                    # Ctoken objects of all the sentences in order
+        self.sentence_offsets = [0]         # The sentence n has the tokens [sentence_offsets[n], sentence_offsets[n+1])
+        self.sentence_for_token_id = {}     # token id -> number of sentence
+        
+    def add_sentence(self, list_tokens):
+        # Returns the number of the new sentence (starting at 0)
+        num_sentence = self.get_num_sentences()
+        for token in list_tokens:
+            self.sentence_for_token_id[token.get_id()] = num_sentence
+        self.tokens.extend(list_tokens)
+        self.sentence_offsets.append(len(self.tokens))
+        return num_sentence
+    
+    def get_num_sentences(self):
+        return len(self.sentence_offsets) - 1
+    
+    def get_sentence(self, num_sentence):
+        return self.tokens[self.sentence_offsets[num_sentence]:self.sentence_offsets[num_sentence+1]]
+    
+    def get_sentence_offset(self, num_sentence):
+        return self.sentence_offsets[num_sentence]
+    
+    def get_sentence_for_token_id(self, token_id):
+        return self.sentence_for_token_id.get(token_id)
+    
+    def get_id(self):
+        return self.id
+    
+    def compact(self, string_table):
+        # Keeps the tokens in a Ctoken_table instead of a list of Ctoken objects
+        if not isinstance(self.tokens, Ctoken_table):
+            self.tokens = Ctoken_table(string_table, self.tokens)
+    
+    def get_sub_document(self, list_sentences):
+        # New document with only the sentences in list_sentences (sorted numbers of sentence)
+        sub_document = Cdocument(self.id)
+        for num_sentence in list_sentences:
+            sub_document.add_sentence(self.get_sentence(num_sentence))
+        return sub_document
+    
+    
 class Csense:
     def __init__(self, lexkey=None,num_sense=None, synset_offset=None):
         self.lexkey = lexkey                #string
@@ -68,32 +227,115 @@ class Csense:
     
     
 class Cinstance:
+    __slots__ = ('id', 'docsrc', 'strategy', 'lemma', 'pos', 'document', 'first_sentence', 'last_sentence', 'target_sentence',
+                 'index_head', 'lexkeys', 'sense_rank', 'confidence_for_senses', 'is_mfs', 'is_lfs', 'annotation_type',
+                 'cosensekeys', 'mono_cosensekeys', 'cohypo_sensekeys', 'mono_cohypo_sensekeys',
+                 'relative_sentence_position_for_token_id')
+    
     def __init__(self):
         self.id = ''
         self.docsrc = ''
         self.strategy = ''                  # Which was the strategy to get this instance (expansion type)
         self.lemma = None                   # The lemma of this instance
         self.pos = None                     # The pos of this instance
-        self.tokens = []                    # List of Ctoken objects
+        self.document = None                # Cdocument with the tokens, shared with the other instances of the document
+        self.first_sentence = 0             # The tokens of the instance are the sentences first_sentence...last_sentence of the document
+        self.last_sentence = 0
+        self.target_sentence = 0            # Sentence of the head, the relative sentence positions are computed from it
         self.index_head = []                # Indexes of the head word (could be a multiword) in the self.tokens list
-        self.lexkeys = set()                # Gold standard list of sensekeys
+        self.lexkeys = EMPTY_SET            # Gold standard list of sensekeys
         self.sense_rank = None              # Integer corresponding to the ranking of the anotated sense (1, 2, 3...)
-        self.confidence_for_senses = {}     # Dictionary assigning a confidence to every sense of the token
+        self.confidence_for_senses = EMPTY_DICT     # Dictionary assigning a confidence to every sense of the token
         self.is_mfs = False                 # Is a MFS case (at least one of the possible sensekeys is)
         self.is_lfs = False                 # Is a LFS case
         self.annotation_type = None         # manual or auto
-        self.cosensekeys = set()            # Co occurent sensekeys in the same synset
-        self.mono_cosensekeys = set()       # Subset of cosensekeys that are monosemous (the lemma of the sensekey is monosemous)
-        self.cohypo_sensekeys = set()       # Sensekeys in all synsets that are  cohyponyms of the gold synset 
-        self.mono_cohypo_sensekeys = set()  # Monosemous sensekeys in all the synsets that are cohyponyms of the gold synset 
-        self.relative_sentence_position_for_token_id = {}
+        self.cosensekeys = EMPTY_SET        # Co occurent sensekeys in the same synset
+        self.mono_cosensekeys = EMPTY_SET   # Subset of cosensekeys that are monosemous (the lemma of the sensekey is monosemous)
+        self.cohypo_sensekeys = EMPTY_SET   # Sensekeys in all synsets that are  cohyponyms of the gold synset 
+        self.mono_cohypo_sensekeys = EMPTY_SET  # Monosemous sensekeys in all the synsets that are cohyponyms of the gold synset 
+        self.relative_sentence_position_for_token_id = None   # Only for the instances created with set_relative_sentence_position_for_token_id
+        
+    def __getstate__(self):
+        # The attributes with the shared empty defaults are not saved
+        state = {}
+        for name in self.__slots__:
+            value = getattr(self, name)
+            if value is not EMPTY_SET and value is not EMPTY_DICT:
+                state[name] = value
+        return state
+        
+    def __setstate__(self, state):
+        # state is the one of __getstate__ or the __dict__ of the instances pickled before __slots__. The
+        # instances pickled before the documents existed have their own list of tokens
+        Cinstance.__init__(self)
+        state = dict(state)
+        list_tokens = state.pop('tokens', None)
+        for name, value in state.items():
+            if name not in self.__slots__:
+                continue
+            if isinstance(value, (set, dict)) and len(value) == 0 and isinstance(getattr(self, name), (frozenset, MappingProxyType)):
+                continue
+            setattr(self, name, value)
+        self.lemma = intern_string(self.lemma)
+        self.pos = intern_string(self.pos)
+        if list_tokens is not None:
+            self.set_tokens_and_sentence_positions(list_tokens, self.relative_sentence_position_for_token_id or {})
+        
+    def set_context(self, document, first_sentence, last_sentence, target_sentence):
+        # The tokens of the instance are the sentences first_sentence...last_sentence of the Cdocument
+        self.document = document
+        self.first_sentence = first_sentence
+        self.last_sentence = last_sentence
+        self.target_sentence = target_sentence
+        self.relative_sentence_position_for_token_id = None
+        
+    def get_document(self):
+        return self.document
+        
+    def set_tokens_and_sentence_positions(self, list_tokens, relative_sentence_for_token_id):
+        # Creates a document for the tokens, with one sentence for every relative position when they are in order
+        sentence_positions = [relative_sentence_for_token_id.get(token.get_id(),0) for token in list_tokens]
+        in_order = all(this_position <= next_position for this_position, next_position in zip(sentence_positions, sentence_positions[1:]))
+        if len(list_tokens) == 0 or not in_order or min(sentence_positions) > 0 or max(sentence_positions) < 0:
+            self.set_tokens(list_tokens)
+            self.set_relative_sentence_position_for_token_id(relative_sentence_for_token_id)
+            return
+        new_document = Cdocument(self.docsrc)
+        num_token = 0
+        for relative_position in range(sentence_positions[0], sentence_positions[-1]+1):
+            start_token = num_token
+            while num_token < len(list_tokens) and sentence_positions[num_token] == relative_position:
+                num_token += 1
+            new_document.add_sentence(list_tokens[start_token:num_token])
+        self.set_context(new_document, 0, new_document.get_num_sentences()-1, -sentence_positions[0])
         
     def set_relative_sentence_position_for_token_id(self,r):
         self.relative_sentence_position_for_token_id = r
          
         
     def get_relative_sentence_position_for_token_id(self,token_id):
-        return self.relative_sentence_position_for_token_id.get(token_id,0)
+        if self.relative_sentence_position_for_token_id is not None:
+            return self.relative_sentence_position_for_token_id.get(token_id,0)
+        if self.document is None:
+            return 0
+        num_sentence = self.document.sentence_for_token_id.get(token_id)
+        if num_sentence is None or num_sentence < self.first_sentence or num_sentence > self.last_sentence:
+            return 0
+        return num_sentence - self.target_sentence
+    
+    def __get_token_range(self):
+        if self.document is None:
+            return 0, 0
+        sentence_offsets = self.document.sentence_offsets
+        return sentence_offsets[self.first_sentence], sentence_offsets[self.last_sentence+1]
+    
+    @property
+    def tokens(self):
+        # List of Ctoken objects, taken from the document
+        if self.document is None:
+            return []
+        start, end = self.__get_token_range()
+        return self.document.tokens[start:end]
         
     def __iter__(self):
         for token in self.tokens:
@@ -109,19 +351,25 @@ class Cinstance:
             return False
                     
     def get_num_tokens(self):
-        return len(self.tokens)
+        start, end = self.__get_token_range()
+        return end - start
     
     def get_position_target_token(self):
         return self.index_head[0]
     
     def get_token(self,i):
-        if i>0 and i<len(self.tokens):
-            return self.tokens[i]
+        start, end = self.__get_token_range()
+        if i>0 and i<end-start:
+            return self.document.tokens[start+i]
         else:
             return None
     
     def set_tokens(self, list_token_objects):
-        self.tokens = list_token_objects[:]       
+        # The tokens are kept in a new document of one sentence
+        new_document = Cdocument(self.docsrc)
+        new_document.add_sentence(list_token_objects)
+        self.document = new_document
+        self.first_sentence = self.last_sentence = self.target_sentence = 0
         
     def set_index_head_list(self,list_index_head):
         self.index_head = list_index_head[:]
@@ -130,26 +378,32 @@ class Cinstance:
         whole_text = '#'.join([token.text for token in self.tokens]) 
         return whole_text
         
-    def get_md5_checksum(self):
-        text = '%s_%s_%s_%s' % (self.get_whole_text(), self.get_lemma(), self.get_pos(),str(self.index_head))
-        return text
-    
+    def get_content_digest(self):
+        # blake2b digest of the whole text, lemma, pos and heads of the instance, hashed token by token
+        # without joining the text. It is the same as get_text_digest of the joined string
+        hasher = hashlib.blake2b(digest_size=CONTENT_DIGEST_SIZE)
+        separator = b''
+        for token in self.tokens:
+            hasher.update(separator + token.text.encode('utf-8'))
+            separator = b'#'
+        hasher.update(('_%s_%s_%s' % (self.get_lemma(), self.get_pos(),str(self.index_head))).encode('utf-8'))
+        return hasher.digest()
     
-        md5_hasher = hashlib.md5()
-        md5_hasher.update(text.encode('utf-8'))
-        return md5_hasher.hexdigest()     
+    def get_md5_checksum(self):
+        # Old name of get_content_digest
+        return self.get_content_digest()
 
     def get_lemma(self):
         return self.lemma
     
     def set_lemma(self,lemma):
-        self.lemma = lemma
+        self.lemma = intern_string(lemma)
         
     def get_pos(self):
         return self.pos
     
     def set_pos(self,pos):
-        self.pos = pos
+        self.pos = intern_string(pos)
        
     def set_annotation_type(self, this_type):
         self.annotation_type = this_type
@@ -180,6 +434,16 @@ class Cinstance:
 
     def get_lexkeys(self):
         return self.lexkeys
+
+    def get_mutable_set(self, name):
+        # The sets of sense keys (lexkeys, cosensekeys...) can be frozensets shared with other instances
+        # (EMPTY_SET or the ones of sensekey_utils.add_sense_info_to_clexelt). They are copied the first
+        # time they are modified: getattr(instance, name) for reading, this method for updating the set
+        value = getattr(self, name)
+        if isinstance(value, frozenset):
+            value = set(value)
+            setattr(self, name, value)
+        return value
     
     def set_confidence_for_senses(self,this_dict):
         self.confidence_for_senses = this_dict
@@ -218,7 +482,7 @@ class Clexelt:
         self.pos = this_pos
         self.nltk_wn_pos = None
         self.instances = []
-        self.existing_instances = set() #set of md5 checksums for the texts of the instances
+        self.existing_instances = set() #set of digests (get_content_digest) of the instances
         self.wn_possible_senses = {}  #Dictionary from lexkey to Csense
         self._set_nltk_wn_pos()
 
@@ -261,23 +525,31 @@ class Clexelt:
         return (lexkey in self.wn_possible_senses)
             
     def set_wn_possible_skeys(self, wn_reader):
+        # wn_reader can be a NLTK reader or a sense inventory (sense_inventory.py), the senses of every
+        # lemma.pos are computed only once
         if wn_reader is not None:
-            lemmas = wn_reader.lemmas(self.lemma,pos=self.nltk_wn_pos)
-            for int_sense, l in enumerate(lemmas,1):
-                #Synset offset is by defualt in, we convert it a 8 character string
-                this_synset_offset = str(l.synset().offset())
-                num_zeros = 8 - len(this_synset_offset)
-                this_synset_offset = '0'*num_zeros + this_synset_offset
-                self.wn_possible_senses[l.key()] = Csense(lexkey=l.key(),num_sense=int_sense, synset_offset=this_synset_offset)
+            from sense_inventory import as_sense_inventory
+            for lexkey, int_sense, this_synset_offset in as_sense_inventory(wn_reader).get_senses(self.lemma, self.nltk_wn_pos):
+                self.wn_possible_senses[lexkey] = Csense(lexkey=lexkey,num_sense=int_sense, synset_offset=this_synset_offset)
 
     def get_item_key(self):
         return '%s.%s' % (self.lemma,self.pos[0].lower())
+    
+    def compact(self, string_table=None):
+        # Moves the tokens of the documents of the instances to columnar tables, string_table
+        # can be shared by many lexelts. Returns the string table
+        if string_table is None:
+            string_table = Cstring_table()
+        for this_instance in self.instances:
+            if this_instance.get_document() is not None:
+                this_instance.get_document().compact(string_table)
+        return string_table
         
 
     
     def add_instance(self,this_instance):
-        md5_checksum = this_instance.get_md5_checksum()
-        if md5_checksum in self.existing_instances:
+        content_digest = this_instance.get_content_digest()
+        if content_digest in self.existing_instances:
             pass
             #print('Instance with id %s already exists for this lexelt object. Not added' % this_instance.get_id(), file=sys.stderr)           
         else:
@@ -286,7 +558,46 @@ class Clexelt:
                 this_instance.set_sense_rank(self.wn_possible_senses)
             
             self.instances.append(this_instance)
-            self.existing_instances.add(md5_checksum)
+            self.existing_instances.add(content_digest)
+        
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state['instances'] = self.get_instances_to_save()
+        return state
+    
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        # The old files have the whole text of every instance instead of the digest
+        if any(isinstance(text, str) for text in self.existing_instances):
+            self.existing_instances = set(get_text_digest(text) if isinstance(text, str) else text for text in self.existing_instances)
+        
+    def get_instances_to_save(self):
+        # Every document is saved only with the sentences used by the instances of this lexelt,
+        # otherwise every lexelt file would contain the whole documents of its instances. The
+        # instances that need it are copied with their sub document, the others are returned as they are
+        sentences_for_document = {}
+        for this_instance in self.instances:
+            this_document = this_instance.get_document()
+            if this_document is not None:
+                sentences_for_document.setdefault(id(this_document), set()).update(range(this_instance.first_sentence, this_instance.last_sentence+1))
+        sub_document_for_document = {}
+        list_instances = []
+        for this_instance in self.instances:
+            this_document = this_instance.get_document()
+            if this_document is not None and len(sentences_for_document[id(this_document)]) < this_document.get_num_sentences():
+                if id(this_document) not in sub_document_for_document:
+                    list_sentences = sorted(sentences_for_document[id(this_document)])
+                    new_number_for_sentence = {num_sentence: new_number for new_number, num_sentence in enumerate(list_sentences)}
+                    sub_document_for_document[id(this_document)] = (this_document.get_sub_document(list_sentences), new_number_for_sentence)
+                sub_document, new_number_for_sentence = sub_document_for_document[id(this_document)]
+                # The sentences of the context of an instance are still consecutive in the sub document
+                this_instance = copy.copy(this_instance)
+                this_instance.document = sub_document
+                this_instance.first_sentence = new_number_for_sentence[this_instance.first_sentence]
+                this_instance.last_sentence = new_number_for_sentence[this_instance.last_sentence]
+                this_instance.target_sentence = new_number_for_sentence[this_instance.target_sentence]
+            list_instances.append(this_instance)
+        return list_instances
         
     def __repr__(self):
         return self.lemma+' '+self.pos+' '+str(len(self.instances))
@@ -8,11 +8,14 @@ import argparse
 import sys
 import os
 import pickle
+import shutil
+from multiprocessing import Pool
 from lxml import etree
 from nltk.corpus import WordNetCorpusReader
 
-from my_data_classes import Ctoken, Cinstance, Clexelt
+from my_data_classes import Ctoken, Cinstance, Clexelt, Cdocument
 from sensekey_utils import add_sense_info_to_clexelt
+from sense_inventory import set_sense_inventory_file
 
 
 __here__ = os.path.realpath(os.path.dirname(__file__))
@@ -162,7 +165,9 @@ def process_node(this_root_node, this_id):
     return list_of_tokens, sense_keys_for_token_id, type_tag_for_token_id
         
 def generate_instances(this_id, list_tokens, sense_keys_for_token_id, type_tag_for_token_id, data_lexelt, my_wn_reader):
-    
+    # The gloss is one document of one sentence shared by all its instances
+    this_document = Cdocument(this_id)
+    this_document.add_sentence(list_tokens)
     for index_token, token in enumerate(list_tokens):
         token_id = token.get_id()
         gold_lexkeys = sense_keys_for_token_id.get(token_id)
@@ -191,7 +196,7 @@ def generate_instances(this_id, list_tokens, sense_keys_for_token_id, type_tag_f
                 new_instance.set_lexkeys(gold_lexkeys)
                 new_instance.set_confidence_for_senses({skey: 1.0 for skey in gold_lexkeys})
                 new_instance.set_annotation_type(type_tag_for_token_id[token_id])
-                new_instance.set_tokens(list_tokens)
+                new_instance.set_context(this_document, 0, 0, 0)
                 new_instance.set_index_head_list([index_token])
                 data_lexelt[this_lemma_key].add_instance(new_instance) 
             else:
@@ -199,10 +204,12 @@ def generate_instances(this_id, list_tokens, sense_keys_for_token_id, type_tag_f
             
             
             
-def process_file(this_file, my_wn_reader, data_lexelt):
-    my_tree = etree.parse(this_file)
-    n=0
-    for synset_node in my_tree.findall('synset'):
+def process_file(this_file, my_wn_reader, data_lexelt, part_writer=None):
+    # The synsets are read one by one with iterparse and removed from the tree once processed,
+    # so the whole tree of the file is never in memory. With part_writer, the instances are
+    # moved to its part files every SYNSETS_IN_MEMORY synsets
+    num_synsets = 0
+    for event, synset_node in etree.iterparse(this_file, events=('end',), tag='synset'):
         synset_id = synset_node.get('id')
         # Find the gloss node
         gloss_node = None
@@ -223,9 +230,113 @@ def process_file(this_file, my_wn_reader, data_lexelt):
         for example_node in gloss_node.findall('ex'):
             list_of_tokens, sense_keys_for_token_id, type_tag_for_token_id = process_node(example_node, example_node.get('id'))
             generate_instances(example_node.get('id'), list_of_tokens, sense_keys_for_token_id, type_tag_for_token_id, data_lexelt, my_wn_reader)
+        
+        synset_node.clear()
+        while synset_node.getprevious() is not None:
+            del synset_node.getparent()[0]
+        num_synsets += 1
+        if part_writer is not None and num_synsets % part_writer.synsets_in_memory == 0:
+            part_writer.write(data_lexelt)
+    if part_writer is not None:
+        part_writer.write(data_lexelt)
   
   
-  
+class PartWriter:
+    '''
+    Moves the instances of the lexelts of one input file to part files, one
+    per lemma.pos, with a pickled list of instances for every write. The
+    Clexelt objects stay in data_lexelt without instances, to keep checking
+    the duplicated ones
+    '''
+    def __init__(self, folder, synsets_in_memory):
+        self.folder = folder
+        self.synsets_in_memory = synsets_in_memory
+        self.part_file_for_item_key = {}
+        os.mkdir(folder)
+        
+    def write(self, data_lexelt):
+        for item_key, lexelt in data_lexelt.items():
+            if len(lexelt.instances) == 0:
+                continue
+            part_file = self.part_file_for_item_key.get(item_key)
+            if part_file is None:
+                # Numbered files, the item keys are not always valid or unique file names
+                part_file = os.path.join(self.folder, '%d.part' % len(self.part_file_for_item_key))
+                self.part_file_for_item_key[item_key] = part_file
+                fd_part = open(part_file, 'wb')
+                pickle.dump((lexelt.get_lemma(), lexelt.get_pos()), fd_part, protocol=-1)
+            else:
+                fd_part = open(part_file, 'ab')
+            pickle.dump(lexelt.instances, fd_part, protocol=-1)
+            fd_part.close()
+            lexelt.instances = []
+            
+            
+def read_part_file(part_file):
+    # Returns the lemma, pos and a generator with the instances of a part file
+    fd_part = open(part_file, 'rb')
+    lemma, pos = pickle.load(fd_part)
+    def generate_instances_in_part():
+        while True:
+            try:
+                list_instances = pickle.load(fd_part)
+            except EOFError:
+                break
+            for this_instance in list_instances:
+                yield this_instance
+        fd_part.close()
+    return lemma, pos, generate_instances_in_part()
+
+
+# WordNet reader of the worker processes, set by init_worker
+worker_wn_reader = None
+
+def init_worker(path_to_wn, sense_inventory=None):
+    global worker_wn_reader
+    worker_wn_reader = WordNetCorpusReader(path_to_wn,None)
+    if sense_inventory is not None:
+        set_sense_inventory_file(sense_inventory)
+
+
+def process_file_to_parts(task):
+    # Runs in the worker processes: converts one input file to part files, returns the
+    # list of (item_key, part_file) in order of appearance
+    path_to_file, parts_folder, synsets_in_memory = task
+    print('Processing %s' % path_to_file)
+    data_lexelt = {}
+    part_writer = PartWriter(parts_folder, synsets_in_memory)
+    process_file(path_to_file, worker_wn_reader, data_lexelt, part_writer)
+    return list(part_writer.part_file_for_item_key.items())
+
+
+def save_lexelt_from_parts(task):
+    # Runs in the worker processes: joins the part files of one lemma.pos (in the order of the
+    # input files), adds the sense information and saves the lexelt. Returns the number of instances
+    item_key, list_part_files, output = task
+    lexelt = None
+    for part_file in list_part_files:
+        lemma, pos, instances_in_part = read_part_file(part_file)
+        if lexelt is None:
+            lexelt = Clexelt(lemma,pos)
+            lexelt.set_wn_possible_skeys(worker_wn_reader)
+        # add_instance removes the instances repeated in several input files
+        for this_instance in instances_in_part:
+            lexelt.add_instance(this_instance)
+    if lexelt is None or len(lexelt) == 0:
+        return item_key, 0
+    
+    # First we call to add_sense_info_to_clexelt to create all the senskey related info
+    # We do not need to assign the return value to a variable, as the object is passed by reference
+    # and it's modified already 
+    add_sense_info_to_clexelt(lexelt, worker_wn_reader, debug=False)
+    
+    #Save the lexelt object 
+    item_key = item_key.replace('/','_').lower()
+    output_bin = os.path.join(output,item_key+'.bin')
+    fd_bin = open(output_bin,'wb')
+    pickle.dump(lexelt, fd_bin, protocol=3)
+    fd_bin.close()
+    return item_key, len(lexelt)
 
 
 if __name__ == '__main__':
@@ -234,54 +345,54 @@ if __name__ == '__main__':
     parser.add_argument('-i', dest='input_folder', required=True, help='Path to original wordnet gloss corpus main folder')
     parser.add_argument('-o', dest='output', required=True, help='Output folder')
     parser.add_argument('-wn',dest='path_to_wn', required = True, help='Path to the wordnet root folder')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of processes to convert the files and to save the lexelts')
+    parser.add_argument('-si', '--sense-inventory', dest='sense_inventory', default=None, help='Sense inventory file (wn_to_sense_inventory.py) for the senses and monosemy of the lemmas')
+    parser.add_argument('--synsets-in-memory', dest='synsets_in_memory', type=int, default=5000, help='Synsets read before moving their instances to the part files')
     args = parser.parse_args()
     
-    data_lexelt = {}
-    
     #Load the NLTK wordnet reader
     if 'dict' not in args.path_to_wn:
         args.path_to_wn = os.path.join(args.path_to_wn,'dict')
-    my_wn_reader = WordNetCorpusReader(args.path_to_wn,None)
     
     files = [('adj.xml','a'), ('adv.xml','r'), ('noun.xml','n'), ('verb.xml','v')]
     #files = [('noun.xml','n')]
     
+    os.mkdir(args.output)
+    # Temporary part files, one folder per input file
+    parts_folder = os.path.join(args.output, 'parts')
+    os.mkdir(parts_folder)
+    tasks = []
     for this_file, short_pos in files:
         path_to_file = os.path.join(args.input_folder,'merged', this_file)
-        print('Processing %s' % path_to_file)
-        process_file(path_to_file, my_wn_reader, data_lexelt)
-        #brea
+        tasks.append((path_to_file, os.path.join(parts_folder, short_pos), args.synsets_in_memory))
+        
+    if args.jobs > 1:
+        pool = Pool(args.jobs, initializer=init_worker, initargs=(args.path_to_wn, args.sense_inventory))
+        map_function = pool.imap
+    else:
+        init_worker(args.path_to_wn, args.sense_inventory)
+        pool = None
+        map_function = map
+    
+    # The part files of every lemma.pos in the order of the input files
+    part_files_for_item_key = {}
+    for list_part_files in map_function(process_file_to_parts, tasks):
+        for item_key, part_file in list_part_files:
+            part_files_for_item_key.setdefault(item_key, []).append(part_file)
     
-    os.mkdir(args.output)
     print('Creating training data...', file=sys.stderr)
     total_instances = 0
     total_lemmas = 0
-    for item_key, lexelt in data_lexelt.items():
-        
-        # First we call to add_sense_info_to_clexelt to create all the senskey related info
-        
-        if len(lexelt) > 0:
-            # First we call to add_sense_info_to_clexelt to create all the senskey related info
-            # We do not need to assign the return value to a variable, as the object is passed by reference
-            # and it's modified already 
+    tasks = [(item_key, list_part_files, args.output) for item_key, list_part_files in part_files_for_item_key.items()]
+    for item_key, num_instances in map_function(save_lexelt_from_parts, tasks):
+        if num_instances > 0:
             print('\tLexical item: %s' % item_key, file=sys.stderr)
-
-            add_sense_info_to_clexelt(lexelt, my_wn_reader, debug=False)
-            
-            
             total_lemmas += 1
-            item_key = item_key.replace('/','_').lower()
-            
-            total_instances += len(lexelt)
-            
-            #Save the lexelt object 
-            output_bin = os.path.join(args.output,item_key+'.bin')
-            fd_bin = open(output_bin,'wb')
-            pickle.dump(lexelt, fd_bin, protocol=3)
-            fd_bin.close()
-        
+            total_instances += num_instances
+    if pool is not None:
+        pool.close()
+        pool.join()
+    shutil.rmtree(parts_folder)
 
     print('Total number of lemma.pos (unique): %d' % total_lemmas)
     print('Total number of instances: %d' % total_instances)
-    
-    
\ No newline at end of file
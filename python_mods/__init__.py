@@ -1,2 +1,3 @@
 from .svm_classifier import SVMClassifier
 from .my_names import *
+from .model_registry import ModelRegistry
@@ -0,0 +1,157 @@
+#!/usr/bin/env python
+
+# On-disk cache of the extracted features. Every <function> of a feature
+# config is a group of features, and the features of one group for all the
+# instances of a lexelt are saved in one file:
+#
+#   <folder>/<lexelt digest>/<group key>.bin
+#
+# The lexelt digest is the one of the bytes of the lexelt (ulm_v2
+# LexeltReader.get_digest, or the one given by train_lemmas.py) and the group
+# key is a digest of the extractor name and its normalized options, so
+# 'sentence_window' 1 and ' 1 ' are the same group, and an extractor without
+# options is the same group as the one with the default values. Different
+# feature configs (and runs with different SVM parameters) share the groups
+# they have in common: only the missing groups are extracted, and the
+# features of every instance are assembled from the groups in the order of
+# the config, so the vectors are exactly the same as without the cache.
+#
+# A group file is a sequence of pickles: a header with the version and the
+# number of instances, and then one chunk for every TRAINING_BLOCK_SIZE
+# instances with the distinct feature strings of the chunk and, for every
+# instance, the numbers of its features (ids and offsets, as NumPy arrays).
+# The groups are written and read chunk by chunk while the instances are
+# streamed, so only one chunk of every group is in memory at the same time
+
+import hashlib
+import os
+import pickle
+
+import numpy as np
+
+from .feature_extractor import parse_collocations
+from .my_names import TRAINING_BLOCK_SIZE
+
+# Changing it invalidates the groups saved by previous versions of the extractors
+FEATURE_CACHE_VERSION = 2
+GROUP_EXTENSION = '.bin'
+KEY_DIGEST_SIZE = 16
+
+
+def normalize_options(function_name, options):
+    # The options that change the output of the extractor, with the default values and parsed
+    if function_name == 'extract_bow_lemmas':
+        return {'sentence_window': int(options.get('sentence_window', 3))}
+    elif function_name == 'extract_pos':
+        return {'window': int(options.get('window', 3))}
+    elif function_name == 'extract_collocations':
+        return {'collocations': parse_collocations(options.get('collocations'))}
+    else:
+        return dict((name, value.strip() if isinstance(value, str) else value) for name, value in options.items())
+
+
+def get_group_key(function_name, options):
+    normalized = sorted(normalize_options(function_name, options).items())
+    text = repr((FEATURE_CACHE_VERSION, function_name, normalized))
+    return hashlib.blake2b(text.encode('utf-8'), digest_size=KEY_DIGEST_SIZE).hexdigest()
+
+
+class FeatureGroupReader:
+    '''
+    Iterates the features of one group for the instances of a lexelt, in order,
+    reading the chunks of the file one by one
+    '''
+    def __init__(self, fd, num_instances):
+        self.fd = fd
+        self.num_instances = num_instances
+
+    def __iter__(self):
+        num_read = 0
+        while num_read < self.num_instances:
+            values, ids, offsets = pickle.load(self.fd)
+            object_values = np.empty(len(values), dtype=object)
+            object_values[:] = values
+            for num_instance in range(len(offsets) - 1):
+                yield object_values[ids[offsets[num_instance]:offsets[num_instance+1]]].tolist()
+            num_read += len(offsets) - 1
+
+    def close(self):
+        self.fd.close()
+
+
+class FeatureGroupWriter:
+    '''
+    Writes the features of one group instance by instance, in chunks of chunk_size
+    instances, to a temporary file that is renamed by close
+    '''
+    def __init__(self, filename, num_instances, chunk_size=TRAINING_BLOCK_SIZE):
+        self.filename = filename
+        self.temp_filename = '%s.%d.tmp' % (filename, os.getpid())
+        self.chunk_size = chunk_size
+        self.fd = open(self.temp_filename, 'wb')
+        pickle.dump({'version': FEATURE_CACHE_VERSION, 'num_instances': num_instances}, self.fd, protocol=-1)
+        self.chunk_features = []
+        self.chunk_offsets = [0]
+
+    def add(self, list_features):
+        # The features of the next instance
+        self.chunk_features.extend(list_features)
+        self.chunk_offsets.append(len(self.chunk_features))
+        if len(self.chunk_offsets) - 1 == self.chunk_size:
+            self.__write_chunk()
+
+    def __write_chunk(self):
+        # The distinct features of the chunk are numbered in order of first appearance
+        values = list(dict.fromkeys(self.chunk_features))
+        id_for_value = dict((value, value_id) for value_id, value in enumerate(values))
+        ids = np.fromiter(map(id_for_value.__getitem__, self.chunk_features), dtype=np.int32, count=len(self.chunk_features))
+        pickle.dump((values, ids, np.array(self.chunk_offsets, dtype=np.int64)), self.fd, protocol=-1)
+        self.chunk_features = []
+        self.chunk_offsets = [0]
+
+    def close(self):
+        # Renamed when complete, the processes that train in parallel never read half a file
+        if len(self.chunk_offsets) > 1:
+            self.__write_chunk()
+        self.fd.close()
+        os.replace(self.temp_filename, self.filename)
+
+    def discard(self):
+        self.fd.close()
+        os.remove(self.temp_filename)
+
+
+class FeatureCache:
+    def __init__(self, folder):
+        self.folder = folder
+
+    def __get_group_filename(self, lexelt_digest, group_key):
+        return os.path.join(self.folder, lexelt_digest, group_key + GROUP_EXTENSION)
+
+    def open_group(self, lexelt_digest, group_key, num_instances):
+        # FeatureGroupReader of the group or None if it is not in the cache (or it does not have num_instances)
+        filename = self.__get_group_filename(lexelt_digest, group_key)
+        if not os.path.exists(filename):
+            return None
+        fd = open(filename, 'rb')
+        try:
+            header = pickle.load(fd)
+        except Exception:
+            header = None
+        if not isinstance(header, dict) or header.get('version') != FEATURE_CACHE_VERSION or header.get('num_instances') != num_instances:
+            fd.close()
+            return None
+        return FeatureGroupReader(fd, num_instances)
+
+    def create_group(self, lexelt_digest, group_key, num_instances):
+        filename = self.__get_group_filename(lexelt_digest, group_key)
+        if not os.path.exists(os.path.dirname(filename)):
+            os.makedirs(os.path.dirname(filename), exist_ok=True)
+        return FeatureGroupWriter(filename, num_instances)
+
+
+def get_feature_cache(feature_cache):
+    # feature_cache is a folder, a FeatureCache or None (no cache)
+    if feature_cache is None or isinstance(feature_cache, FeatureCache):
+        return feature_cache
+    return FeatureCache(feature_cache)
@@ -79,3 +79,95 @@ def extract_collocations(this_instance, options, features):
     
             
 
+
+
+##########################################################################
+## Compiled extractors: the options of every <function> of the feature
+## config are parsed once by compile_feature_extractors, which returns
+## functions that only receive the instance and the list of features
+##########################################################################
+
+def compile_bow_lemmas(options):
+    sentence_window = int(options.get('sentence_window',3))
+    feature_for_lemma = {}      # lemma -> 'BOW#...' or None if not valid
+
+    def bow_lemmas(this_instance, features):
+        get_relative_sentence = this_instance.get_relative_sentence_position_for_token_id
+        append = features.append
+        for token in this_instance:
+            if abs(get_relative_sentence(token.token_id)) <= sentence_window:
+                this_lemma = token.lemma
+                if this_lemma is not None:
+                    try:
+                        feat = feature_for_lemma[this_lemma]
+                    except KeyError:
+                        text = transform_lemma(this_lemma)
+                        feat = 'BOW#%s' % text if is_valid_as_lemma(text) else None
+                        feature_for_lemma[this_lemma] = feat
+                    if feat is not None:
+                        append(feat)
+    return bow_lemmas
+
+
+def compile_pos(options):
+    size_context = int(options.get('window',3))
+    prefix_for_position = {relative_position: 'POS#%d#' % relative_position for relative_position in range(-size_context, size_context+1)}
+
+    def pos(this_instance, features):
+        index_of_target = this_instance.get_position_target_token()
+        get_token = this_instance.get_token
+        start_index = max(0,index_of_target-size_context)
+        end_index = min(this_instance.get_num_tokens()-1,index_of_target+size_context)
+        for this_idx in range(start_index,end_index+1):
+            this_token = get_token(this_idx)
+            if this_token is not None:
+                features.append('%s%s' % (prefix_for_position[this_idx - index_of_target], this_token.pos))
+    return pos
+
+
+def parse_collocations(string_collocations):
+    # 'C#-2#-2;C#-1#1;...' -> [(-2,-2), (-1,1), ...]
+    collocations = []
+    for this_str_col in string_collocations.split(';'):
+        if len(this_str_col) != 0:
+            tokens = this_str_col.split('#')
+            collocations.append((int(tokens[1]), int(tokens[2])))
+    return collocations
+
+
+def compile_collocations(options):
+    collocations = [(relative_start, relative_end, 'C#%d#%d#' % (relative_start, relative_end))
+                    for relative_start, relative_end in parse_collocations(options.get('collocations'))]
+
+    def collocations_function(this_instance, features):
+        index_of_target = this_instance.get_position_target_token()
+        get_token = this_instance.get_token
+        for relative_start, relative_end, prefix in collocations:
+            tokens = []
+            for this_idx in range(index_of_target + relative_start, index_of_target + relative_end + 1):
+                this_token = get_token(this_idx)
+                if this_token is None:
+                    tokens = None
+                    break
+                tokens.append(this_token.text)
+            if tokens is not None:
+                features.append(prefix + '_'.join(tokens))
+    return collocations_function
+
+
+COMPILERS = {'extract_bow_lemmas': compile_bow_lemmas,
+             'extract_pos': compile_pos,
+             'extract_collocations': compile_collocations}
+
+
+def compile_feature_extractors(list_feature_extractors):
+    # list_feature_extractors is the list of (function name, options) read from the XML config
+    # Extractors without a compiled version are called through the usual interface
+    compiled_extractors = []
+    for this_function_name, these_options in list_feature_extractors:
+        if this_function_name in COMPILERS:
+            compiled_extractors.append(COMPILERS[this_function_name](these_options))
+        else:
+            this_function = globals()[this_function_name]
+            compiled_extractors.append(lambda this_instance, features, f=this_function, o=these_options: f(this_instance, o, features))
+    return compiled_extractors
@@ -0,0 +1,121 @@
+#!/usr/bin/env python
+
+# Hashing trick: the feature strings are mapped directly to one of 2^bits
+# columns with a stable hash (CRC32), so there is no index of features to
+# build, save or load. With signed hashing one bit of the hash gives the sign
+# of the value, so the collisions tend to cancel out instead of adding up.
+# It is selected in the feature config with an <encoder> element:
+#
+#   <encoder name="hashing">
+#     <arg name="bits">18</arg>
+#     <arg name="signed">true</arg>
+#   </encoder>
+
+import zlib
+from collections import defaultdict
+from itertools import chain
+
+import numpy as np
+
+from .svm_backends import sorted_unique
+
+DEFAULT_BITS = 18
+# Every model has classes x 2^bits base features, 24 bits are already 16M columns
+MAX_BITS = 24
+# Entries of the memo of hash_feature, it is cleared when it is full (the encoder
+# of a feature config is shared by all the classifiers of the model registry)
+HASH_CACHE_SIZE = 1 << 20
+
+
+class HashingEncoder:
+    def __init__(self, bits=DEFAULT_BITS, signed=True):
+        if not 1 <= bits <= MAX_BITS:
+            raise ValueError('The number of bits of the hashing encoder must be between 1 and %d, not %d' % (MAX_BITS, bits))
+        self.bits = bits
+        self.signed = signed
+        self.num_buckets = 1 << bits
+        self.mask = self.num_buckets - 1
+        self.hash_for_feature = {}                  # string feature -> (num_feat, sign)
+        # Statistics of the features seen while training
+        self.seen_features = set()
+        self.features_for_bucket = defaultdict(int)
+
+    @staticmethod
+    def from_options(options):
+        bits = int(options.get('bits', DEFAULT_BITS))
+        signed = str(options.get('signed', 'true')).strip().lower() in ('1', 'true', 'yes')
+        return HashingEncoder(bits, signed)
+
+    def get_options(self):
+        return {'bits': str(self.bits), 'signed': 'true' if self.signed else 'false'}
+
+    def hash_feature(self, string_feat):
+        # Returns the feature number (starting at 1) and the sign for the feature
+        hashed = self.hash_for_feature.get(string_feat)
+        if hashed is None:
+            value = zlib.crc32(string_feat.encode('utf-8'))
+            sign = -1 if (self.signed and value & 0x80000000) else 1
+            hashed = ((value & self.mask) + 1, sign)
+            if len(self.hash_for_feature) >= HASH_CACHE_SIZE:
+                self.hash_for_feature.clear()
+            self.hash_for_feature[string_feat] = hashed
+        return hashed
+
+    def encode(self, list_features, update_stats=False):
+        # Same output as SVMClassifier.encode, sorted [(num_feat, value)], every
+        # distinct feature adds its sign once to its bucket (binary features)
+        map_feat = defaultdict(int)
+        for string_feat in set(list_features):
+            num_feat, sign = self.hash_feature(string_feat)
+            if update_stats and string_feat not in self.seen_features:
+                self.seen_features.add(string_feat)
+                self.features_for_bucket[num_feat] += 1
+            map_feat[num_feat] += sign
+        return sorted((num_feat, value) for num_feat, value in map_feat.items() if value != 0)
+
+    def encode_batch(self, list_features_for_instances, update_stats=False):
+        # Vectorized version of encode for many instances, returns the sorted
+        # (rows, columns, values) of the non-zero entries, the columns start at 0
+        lengths = np.fromiter(map(len, list_features_for_instances), dtype=np.int64, count=len(list_features_for_instances))
+        all_features = list(chain.from_iterable(list_features_for_instances))
+        position_for_feature = {string_feat: position for position, string_feat in enumerate(dict.fromkeys(all_features))}
+        hashed = [self.hash_feature(string_feat) for string_feat in position_for_feature]
+        if update_stats:
+            for string_feat, (num_feat, sign) in zip(position_for_feature, hashed):
+                if string_feat not in self.seen_features:
+                    self.seen_features.add(string_feat)
+                    self.features_for_bucket[num_feat] += 1
+        columns_for_position = np.array([num_feat - 1 for num_feat, sign in hashed], dtype=np.int64)
+        signs_for_position = np.array([sign for num_feat, sign in hashed], dtype=np.float64)
+
+        # Every distinct feature of an instance counts once
+        num_positions = max(len(position_for_feature), 1)
+        rows = np.repeat(np.arange(len(lengths), dtype=np.int64), lengths)
+        positions = np.fromiter(map(position_for_feature.__getitem__, all_features), dtype=np.int64, count=len(all_features))
+        rows, positions = np.divmod(sorted_unique(rows * num_positions + positions), num_positions)
+
+        # and adds its sign to its bucket
+        entries = rows * self.num_buckets + columns_for_position[positions]
+        order = np.argsort(entries, kind='stable')
+        entries, starts = sorted_unique(entries[order], return_starts=True)
+        if len(entries) != 0:
+            values = np.add.reduceat(signs_for_position[positions][order], starts)
+        else:
+            values = np.zeros(0)
+        non_zero = values != 0
+        rows, columns = np.divmod(entries[non_zero], self.num_buckets)
+        return rows, columns, values[non_zero]
+
+    def start_stats(self):
+        self.seen_features = set()
+        self.features_for_bucket.clear()
+
+    def get_collision_stats(self):
+        num_features = sum(self.features_for_bucket.values())
+        num_buckets = len(self.features_for_bucket)
+        colliding_buckets = len([n for n in self.features_for_bucket.values() if n > 1])
+        return {'features': num_features,
+                'buckets_used': num_buckets,
+                'colliding_buckets': colliding_buckets,
+                'colliding_features': num_features - num_buckets,
+                'max_features_in_bucket': max(self.features_for_bucket.values()) if num_buckets != 0 else 0}
@@ -0,0 +1,197 @@
+#!/usr/bin/env python
+
+# Extraction of integer feature ids instead of feature strings. Every string
+# feature is prefix + value, where the prefix identifies the template and its
+# offsets ('BOW#', 'POS#-1#', 'C#-2#1#'...) and the value is the lemma, PoS
+# or joined tokens. The prefixes (slots) and the values are interned in a
+# FeatureVocabulary, and the pair is combined in one integer:
+#      feature id = value id * MAX_SLOTS + slot id
+# The ids are generated in the same order as the strings, so encoding them
+# produces exactly the same vectors and the same index_features.bin
+
+from .feature_extractor import transform_lemma, is_valid_as_lemma, parse_collocations
+from . import feature_extractor
+
+MAX_SLOTS = 1 << 12
+RAW_PREFIX = ''         # slot for the features of extractors without an integer version
+
+
+class FeatureVocabulary:
+    def __init__(self):
+        self.slot_for_prefix = {}
+        self.prefixes = []
+        self.id_for_value = {}
+        self.values = []
+        self.frozen = False             # when frozen, unknown values get None instead of a new id
+        self.memo = {}                  # caches of the extractors, only valid while frozen does not change
+
+    def set_frozen(self, frozen):
+        if frozen != self.frozen:
+            for this_memo in self.memo.values():
+                this_memo.clear()
+        self.frozen = frozen
+
+    def get_slot(self, prefix):
+        slot = self.slot_for_prefix.get(prefix)
+        if slot is None:
+            slot = len(self.prefixes)
+            if slot >= MAX_SLOTS:
+                raise ValueError('Too many feature templates, the maximum is %d' % MAX_SLOTS)
+            self.slot_for_prefix[prefix] = slot
+            self.prefixes.append(prefix)
+        return slot
+
+    def get_value_id(self, value):
+        value_id = self.id_for_value.get(value)
+        if value_id is None and not self.frozen:
+            value_id = len(self.values)
+            self.id_for_value[value] = value_id
+            self.values.append(value)
+        return value_id
+
+    def get_feature_id(self, slot, value):
+        value_id = self.get_value_id(value)
+        if value_id is None:
+            return None
+        return value_id * MAX_SLOTS + slot
+
+    def split_string(self, string_feat):
+        # 'POS#-1#NN' -> ('POS#-1#', 'NN'), the inverse of to_string
+        if string_feat.startswith('BOW#'):
+            return 'BOW#', string_feat[4:]
+        fields = None
+        if string_feat.startswith('POS#'):
+            fields = string_feat.split('#', 2)
+            num_offsets = 1
+        elif string_feat.startswith('C#'):
+            fields = string_feat.split('#', 3)
+            num_offsets = 2
+        if fields is not None and len(fields) == num_offsets + 2:
+            try:
+                offsets = [int(offset) for offset in fields[1:-1]]
+            except ValueError:
+                offsets = None
+            if offsets is not None:
+                prefix = '#'.join([fields[0]] + ['%d' % offset for offset in offsets]) + '#'
+                if string_feat.startswith(prefix):
+                    return prefix, fields[-1]
+        return RAW_PREFIX, string_feat
+
+    def from_string(self, string_feat):
+        prefix, value = self.split_string(string_feat)
+        return self.get_feature_id(self.get_slot(prefix), value)
+
+    def to_string(self, feature_id):
+        value_id, slot = divmod(feature_id, MAX_SLOTS)
+        return self.prefixes[slot] + self.values[value_id]
+
+    def convert_index(self, index_features):
+        # index_features (string -> feature number) to (feature id -> feature number)
+        return {self.from_string(string_feat): num_feat for string_feat, num_feat in index_features.items()}
+
+    def to_string_index(self, index_feature_ids):
+        return {self.to_string(feature_id): num_feat for feature_id, num_feat in index_feature_ids.items()}
+
+
+def compile_bow_lemmas_ids(options, vocabulary):
+    sentence_window = int(options.get('sentence_window',3))
+    slot = vocabulary.get_slot('BOW#')
+    memo = vocabulary.memo.setdefault(('BOW#', id(options)), {})     # lemma -> feature id or None
+    invalid = -1
+
+    def bow_lemmas(this_instance, features):
+        get_relative_sentence = this_instance.get_relative_sentence_position_for_token_id
+        append = features.append
+        for token in this_instance:
+            if abs(get_relative_sentence(token.token_id)) <= sentence_window:
+                this_lemma = token.lemma
+                if this_lemma is not None:
+                    feature_id = memo.get(this_lemma)
+                    if feature_id is None:
+                        text = transform_lemma(this_lemma)
+                        feature_id = vocabulary.get_feature_id(slot, text) if is_valid_as_lemma(text) else invalid
+                        if feature_id is None:
+                            continue
+                        memo[this_lemma] = feature_id
+                    if feature_id != invalid:
+                        append(feature_id)
+    return bow_lemmas
+
+
+def compile_pos_ids(options, vocabulary):
+    size_context = int(options.get('window',3))
+    slot_for_position = {relative_position: vocabulary.get_slot('POS#%d#' % relative_position) for relative_position in range(-size_context, size_context+1)}
+    get_feature_id = vocabulary.get_feature_id
+
+    def pos(this_instance, features):
+        index_of_target = this_instance.get_position_target_token()
+        get_token = this_instance.get_token
+        start_index = max(0,index_of_target-size_context)
+        end_index = min(this_instance.get_num_tokens()-1,index_of_target+size_context)
+        for this_idx in range(start_index,end_index+1):
+            this_token = get_token(this_idx)
+            if this_token is not None:
+                this_pos = this_token.pos
+                feature_id = get_feature_id(slot_for_position[this_idx - index_of_target], this_pos if isinstance(this_pos, str) else str(this_pos))
+                if feature_id is not None:
+                    features.append(feature_id)
+    return pos
+
+
+def compile_collocations_ids(options, vocabulary):
+    collocations = [(relative_start, relative_end, vocabulary.get_slot('C#%d#%d#' % (relative_start, relative_end)))
+                    for relative_start, relative_end in parse_collocations(options.get('collocations'))]
+    # tuple of token texts -> value id, the texts are joined only the first time
+    memo = vocabulary.memo.setdefault(('C#', id(options)), {})
+    unknown = -1
+
+    def collocations_function(this_instance, features):
+        index_of_target = this_instance.get_position_target_token()
+        get_token = this_instance.get_token
+        for relative_start, relative_end, slot in collocations:
+            texts = []
+            for this_idx in range(index_of_target + relative_start, index_of_target + relative_end + 1):
+                this_token = get_token(this_idx)
+                if this_token is None:
+                    texts = None
+                    break
+                texts.append(this_token.text)
+            if texts is not None:
+                texts = tuple(texts)
+                value_id = memo.get(texts)
+                if value_id is None:
+                    value_id = vocabulary.get_value_id('_'.join(texts))
+                    if value_id is None:
+                        value_id = unknown
+                    memo[texts] = value_id
+                if value_id != unknown:
+                    features.append(value_id * MAX_SLOTS + slot)
+    return collocations_function
+
+
+ID_COMPILERS = {'extract_bow_lemmas': compile_bow_lemmas_ids,
+                'extract_pos': compile_pos_ids,
+                'extract_collocations': compile_collocations_ids}
+
+
+def compile_feature_id_extractors(list_feature_extractors, vocabulary):
+    # Same as feature_extractor.compile_feature_extractors, but the functions append feature ids
+    compiled_extractors = []
+    for this_function_name, these_options in list_feature_extractors:
+        if this_function_name in ID_COMPILERS:
+            compiled_extractors.append(ID_COMPILERS[this_function_name](these_options, vocabulary))
+        else:
+            string_extractor = feature_extractor.compile_feature_extractors([(this_function_name, these_options)])[0]
+            compiled_extractors.append(_wrap_string_extractor(string_extractor, vocabulary))
+    return compiled_extractors
+
+
+def _wrap_string_extractor(string_extractor, vocabulary):
+    def ids_from_strings(this_instance, features):
+        list_string_features = []
+        string_extractor(this_instance, list_string_features)
+        for string_feat in list_string_features:
+            feature_id = vocabulary.from_string(string_feat)
+            if feature_id is not None:
+                features.append(feature_id)
+    return ids_from_strings
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+
+import os
+import threading
+from collections import OrderedDict
+
+from .my_names import *
+from .svm_classifier import SVMClassifier
+
+
+class ModelRegistry:
+    '''
+    Keeps the classifiers of one model folder loaded in memory (indexes, parsed
+    feature extractors and model weights), so a lemma that is requested again
+    does not touch the disk. The classifiers are loaded lazily the first time
+    they are requested, and the least recently used ones are evicted when there
+    are more than max_items or they use more than max_megabytes
+    '''
+    def __init__(self, model_folder, max_items=MODEL_REGISTRY_SIZE, max_megabytes=MODEL_REGISTRY_MEMORY, backend=None):
+        self.model_folder = model_folder
+        self.max_items = max_items
+        self.max_bytes = max_megabytes * 1024 * 1024
+        self.backend = backend
+        self.classifiers = OrderedDict()        # (lemma,pos) -> (SVMClassifier, size in bytes)
+        self.without_model = set()              # (lemma,pos) with no model in the folder
+        self.feature_config = None              # The feature config is the same for all the lemmas
+        self.loading = {}                       # (lemma,pos) -> threading.Event of the thread loading it
+        self.total_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.lock = threading.RLock()
+
+    def __normalise(self, lemma, pos):
+        return (lemma.lower(), pos.lower()[0])
+
+    def get_classifier(self, lemma, pos):
+        # Returns the SVMClassifier for (lemma,pos) or None if there is no model for it
+        key = self.__normalise(lemma, pos)
+        while True:
+            with self.lock:
+                if key in self.classifiers:
+                    self.hits += 1
+                    self.classifiers.move_to_end(key)
+                    return self.classifiers[key][0]
+                if key in self.without_model:
+                    self.hits += 1
+                    return None
+                loading = self.loading.get(key)
+                if loading is None:
+                    self.misses += 1
+                    loading = threading.Event()
+                    self.loading[key] = loading
+                    break
+            # Another thread is loading this lemma, it is looked up again when it finishes
+            loading.wait()
+
+        # Loaded without the lock, so the lemmas already in memory do not wait for the disk
+        my_classifier = None
+        try:
+            my_classifier = self.__load_classifier(key)
+        finally:
+            with self.lock:
+                del self.loading[key]
+                if my_classifier is False:
+                    self.without_model.add(key)
+                elif my_classifier is not None:
+                    size = my_classifier.get_size_in_bytes()
+                    self.classifiers[key] = (my_classifier, size)
+                    self.total_bytes += size
+                    self.__evict()
+            loading.set()
+        if my_classifier is False:
+            return None
+        return my_classifier
+
+    def __load_classifier(self, key):
+        # The SVMClassifier of key, or False if there is no model for it
+        feature_config = self.feature_config
+        if feature_config is None:
+            parser = SVMClassifier(self.backend)
+            parser.load_feature_extractors(os.path.join(self.model_folder, FEATURE_FILENAME))
+            feature_config = parser.get_feature_config()
+            with self.lock:
+                if self.feature_config is None:
+                    self.feature_config = feature_config
+                feature_config = self.feature_config
+        my_classifier = SVMClassifier(self.backend)
+        exists_classifier = my_classifier.start_classifier(key[0], key[1], self.model_folder,
+                                                           feature_config=feature_config,
+                                                           load_model=True)
+        if not exists_classifier:
+            return False
+        return my_classifier
+
+    def __evict(self):
+        # The last inserted classifier is never evicted, even if it alone is over the budget
+        while len(self.classifiers) > 1 and (len(self.classifiers) > self.max_items or self.total_bytes > self.max_bytes):
+            key, (my_classifier, size) = self.classifiers.popitem(last=False)
+            self.total_bytes -= size
+            self.evictions += 1
+
+    def __contains__(self, lemma_pos):
+        with self.lock:
+            return self.__normalise(*lemma_pos) in self.classifiers
+
+    def __len__(self):
+        return len(self.classifiers)
+
+    def clear(self):
+        with self.lock:
+            self.classifiers.clear()
+            self.without_model.clear()
+            self.feature_config = None
+            self.total_bytes = 0
+
+    def get_stats(self):
+        with self.lock:
+            return {'items': len(self.classifiers),
+                    'megabytes': self.total_bytes / (1024.0 * 1024.0),
+                    'hits': self.hits,
+                    'misses': self.misses,
+                    'evictions': self.evictions}
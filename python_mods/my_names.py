@@ -6,3 +6,22 @@ MODEL_FILENAME = 'model.svm'
 
 SVM_LEARN = '/home/rbevia/wsd_svm/svmlight_lib/svm_multiclass_learn'
 SVM_CLASSIFY = '/home/rbevia/wsd_svm/svmlight_lib/svm_multiclass_classify'
+
+# Backend used to learn and apply the models: 'svmlight' calls the binaries
+# above, 'linear' trains and scores in-process with NumPy/SciPy
+SVM_BACKEND = 'svmlight'
+SVM_C = 1
+# Score the svm_multiclass models in NumPy instead of calling SVM_CLASSIFY
+SVM_CLASSIFY_IN_PROCESS = True
+# Number of parsed model files kept in memory by svm_model.load_svm_model
+MODEL_CACHE_SIZE = 64
+# Limits of the model_registry.ModelRegistry: number of classifiers and memory in MB
+MODEL_REGISTRY_SIZE = 512
+MODEL_REGISTRY_MEMORY = 2048
+# 'strings' builds the feature strings, 'ids' generates integer feature ids
+# (python_mods/feature_ids.py) that produce the same vectors
+FEATURE_EXTRACTION_MODE = 'strings'
+# Instances extracted, encoded and written to the training file at once by SVMClassifier.train
+TRAINING_BLOCK_SIZE = 1000
+# Folder of the on-disk cache of extracted features used by SVMClassifier.train (see feature_cache.py), None disables it
+FEATURE_CACHE_FOLDER = None
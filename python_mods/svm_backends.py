@@ -0,0 +1,286 @@
+#!/usr/bin/env python
+
+# Backends to learn and apply the multiclass SVM models. All of them receive
+# the instances already encoded as a sparse (instances x features) matrix with
+# the feature numbers of the index minus 1 as columns, and the svm classes
+# (starting at 1) as labels. The method classify returns a dense
+# (instances x classes) array, where the column c holds the score of the svm
+# class c+1. learn_blocks receives the same matrix in blocks of rows, so the
+# training instances do not have to be encoded all at once
+
+import sys
+import os
+import subprocess
+import tempfile
+
+import numpy as np
+from scipy import sparse
+
+from .my_names import *
+from .svm_model import load_svm_model, write_svm_model
+
+
+def sorted_unique(values, return_starts=False):
+    # np.unique for 1-D numeric arrays, just sorting and dropping the repeated neighbours
+    values = np.sort(values)
+    is_new = np.empty(len(values), dtype=bool)
+    is_new[:1] = True
+    np.not_equal(values[1:], values[:-1], out=is_new[1:])
+    if return_starts:
+        return values[is_new], np.flatnonzero(is_new)
+    return values[is_new]
+
+
+def write_svmlight_file(fd, X, labels, rows_per_write=10000):
+    # Every distinct (feature, value) pair is formatted only once, and the
+    # lines are joined from the tokens and written in blocks
+    X = sparse.csr_matrix(X)
+    distinct_values = sorted_unique(X.data).tolist()
+    num_values = max(len(distinct_values), 1)
+    keys = X.indices.astype(np.int64) * num_values + np.searchsorted(distinct_values, X.data)
+    token_for_key = {}
+    for key in sorted_unique(keys).tolist():
+        int_feat, num_value = divmod(key, num_values)
+        token_for_key[key] = ' %d:%.8g' % (int_feat+1, distinct_values[num_value])
+    tokens = list(map(token_for_key.__getitem__, keys.tolist()))
+    indptr = X.indptr.tolist()
+    lines = []
+    for num_row, this_label in enumerate(labels):
+        lines.append('%s%s\n' % (this_label, ''.join(tokens[indptr[num_row]:indptr[num_row+1]])))
+        if len(lines) == rows_per_write:
+            fd.write(''.join(lines))
+            lines = []
+    fd.write(''.join(lines))
+
+
+def matrix_from_vectors(list_vectors, num_features, binary=True):
+    # list_vectors is a list of the sorted [(int_feat, freq)...] lists returned by SVMClassifier.encode
+    # With binary all the values are 1 (as in the training files), otherwise the freq is the value
+    indptr = [0]
+    indices = []
+    values = []
+    for vector_feat in list_vectors:
+        indices.extend(int_feat-1 for int_feat, freq in vector_feat)
+        if not binary:
+            values.extend(freq for int_feat, freq in vector_feat)
+        indptr.append(len(indices))
+    if binary:
+        data = np.ones(len(indices))
+    else:
+        data = np.array(values, dtype=np.float64)
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(list_vectors), num_features))
+
+
+def matrix_from_entries(rows, columns, data, num_rows, num_features):
+    # rows and columns must be sorted by row and then by column, without repetitions
+    indptr = np.zeros(num_rows+1, dtype=np.int64)
+    np.cumsum(np.bincount(rows, minlength=num_rows), out=indptr[1:])
+    return sparse.csr_matrix((np.asarray(data, dtype=np.float64), columns, indptr), shape=(num_rows, num_features))
+
+
+def stack_rows(list_matrices, num_features):
+    # One CSR matrix with the rows of all the matrices, which can have less than num_features columns
+    row_lengths = np.concatenate([np.zeros(0, dtype=np.int64)] + [np.diff(X.indptr) for X in list_matrices])
+    indptr = np.zeros(len(row_lengths)+1, dtype=np.int64)
+    np.cumsum(row_lengths, out=indptr[1:])
+    indices = np.concatenate([np.zeros(0, dtype=np.int32)] + [X.indices for X in list_matrices])
+    data = np.concatenate([np.zeros(0)] + [X.data for X in list_matrices])
+    return sparse.csr_matrix((data, indices, indptr), shape=(len(row_lengths), num_features))
+
+
+class SVMLightBackend:
+    name = 'svmlight'
+
+    def __init__(self, c=SVM_C, classify_in_process=SVM_CLASSIFY_IN_PROCESS):
+        # With classify_in_process the model file is parsed (once) and applied
+        # in NumPy, svm_multiclass_classify is only called otherwise
+        self.c = c
+        self.classify_in_process = classify_in_process
+
+    def get_training_params(self):
+        # The parameters that change the learned models (train_lemmas.py retrains when they change)
+        return {'backend': self.name, 'c': self.c, 'svm_learn': SVM_LEARN}
+
+    def learn(self, X, labels, training_filename, model_filename):
+        return self.learn_blocks([(X, labels)], training_filename, model_filename)
+
+    def learn_blocks(self, blocks, training_filename, model_filename):
+        # Every block of (X, labels) is written to the training file as soon as it is received
+        fd_training = open(training_filename,'w')
+        for X, labels in blocks:
+            write_svmlight_file(fd_training, X, labels)
+        fd_training.close()
+
+        training_cmd = []
+        training_cmd.append(SVM_LEARN)
+        training_cmd.append('-c')
+        training_cmd.append(str(self.c))
+        #training_cmd.append('-w')
+        #training_cmd.append('4')
+        training_cmd.append(training_filename)
+        training_cmd.append(model_filename)
+        log_training = model_filename+".log"
+        fd_log = open(log_training,'w')
+        training_code = subprocess.check_call(training_cmd, stdout=fd_log)
+        fd_log.close()
+        return training_code
+
+    def classify(self, X, model_filename):
+        if self.classify_in_process:
+            return load_svm_model(model_filename).score(X)
+
+        ### usage: svm_struct_classify [options] example_file model_file output_file
+        fd_testing = tempfile.NamedTemporaryFile('w',delete=False)
+        write_svmlight_file(fd_testing, X, [1]*X.shape[0])
+        fd_testing.close()
+        output_filename = tempfile.mktemp()
+
+        testing_cmd = []
+        testing_cmd.append(SVM_CLASSIFY)
+        testing_cmd.append(fd_testing.name)
+        testing_cmd.append(model_filename)
+        testing_cmd.append(output_filename)
+        evaluation_code = subprocess.check_call(testing_cmd, stdout=subprocess.DEVNULL)
+        print('\tClassification done with code %d' % evaluation_code, file=sys.stderr)
+
+        scores = []
+        fd_out = open(output_filename)
+        for line in fd_out:
+            tokens = line.strip().split(' ')
+            scores.append([float(value) for value in tokens[1:]])   #Starts from 1 the first class
+        fd_out.close()
+
+        os.remove(fd_testing.name)
+        os.remove(output_filename)
+        return np.array(scores, dtype=np.float64).reshape(X.shape[0], -1)
+
+
+class LinearSVMBackend:
+    '''
+    In-process multiclass linear SVM, solving the same Crammer & Singer problem
+    as svm_multiclass_learn (C divided by the number of instances and a loss
+    of 100 for a wrong class) with the sequential dual method of Keerthi et al.
+    The model is saved in the svm_multiclass format, so both backends can read
+    the models of the other
+    '''
+    name = 'linear'
+    classify_in_process = True
+
+    def __init__(self, c=SVM_C, loss=100.0, max_iter=100, tolerance=0.1):
+        self.c = c
+        self.loss = loss
+        self.max_iter = max_iter
+        self.tolerance = tolerance
+
+    def get_training_params(self):
+        return {'backend': self.name, 'c': self.c, 'loss': self.loss, 'max_iter': self.max_iter, 'tolerance': self.tolerance}
+
+    def learn_blocks(self, blocks, training_filename, model_filename):
+        # The solver needs all the instances, the blocks are only kept as sparse matrices
+        list_matrices = []
+        list_labels = []
+        for X, labels in blocks:
+            list_matrices.append(sparse.csr_matrix(X, dtype=np.float64))
+            list_labels.append(np.asarray(labels, dtype=np.int64))
+        num_features = max([X.shape[1] for X in list_matrices] + [0])
+        return self.learn(stack_rows(list_matrices, num_features), np.concatenate([np.zeros(0, dtype=np.int64)] + list_labels), training_filename, model_filename)
+
+    def learn(self, X, labels, training_filename, model_filename):
+        X = sparse.csr_matrix(X, dtype=np.float64)
+        labels = np.asarray(labels, dtype=np.int64) - 1
+        if len(labels) != 0 and labels.min() < 0:
+            raise ValueError('The svm classes of the training instances must start at 1')
+        num_classes = int(labels.max()) + 1 if len(labels) != 0 else 1
+
+        # Only the columns seen in the training instances can get a weight
+        used_columns = np.unique(X.indices)
+        compact_X = X[:, used_columns]
+        compact_X.sort_indices()
+        compact_weights, num_iterations, max_violation = self.__solve(compact_X, labels, num_classes)
+        # Written from the weights of the used columns, without a dense (classes x features) matrix,
+        # with the hashing encoder the features are 2^bits
+        rows = np.repeat(np.arange(num_classes), len(used_columns))
+        columns = np.tile(used_columns, num_classes)
+        weights = sparse.coo_matrix((compact_weights.ravel(), (rows, columns)), shape=(num_classes, X.shape[1]))
+        write_svm_model(model_filename, weights, num_training_documents=X.shape[0])
+
+        fd_log = open(model_filename+'.log','w')
+        fd_log.write('Linear backend, C=%s loss=%s\n' % (self.c, self.loss))
+        fd_log.write('Instances: %d Features: %d Classes: %d\n' % (X.shape[0], X.shape[1], num_classes))
+        fd_log.write('Iterations: %d Maximum violation: %.6g\n' % (num_iterations, max_violation))
+        fd_log.close()
+        return 0
+
+    def classify(self, X, model_filename):
+        return load_svm_model(model_filename).score(X)
+
+    def __solve(self, X, labels, num_classes):
+        num_instances = X.shape[0]
+        weights = np.zeros((num_classes, X.shape[1]))
+        alpha = np.zeros((num_instances, num_classes))
+        c_instance = float(self.c) / max(num_instances, 1)
+        square_norms = np.asarray(X.multiply(X).sum(axis=1)).ravel()
+        random_state = np.random.RandomState(1)
+        max_violation = 0.0
+        num_iterations = 0
+        for num_iterations in range(1, self.max_iter+1):
+            max_violation = 0.0
+            for i in random_state.permutation(num_instances):
+                a_i = square_norms[i]
+                if a_i <= 0:
+                    continue
+                start, end = X.indptr[i], X.indptr[i+1]
+                columns = X.indices[start:end]
+                values = X.data[start:end]
+                y_i = labels[i]
+                alpha_i = alpha[i]
+
+                gradient = weights[:, columns] @ values + self.loss
+                gradient[y_i] -= self.loss
+                upper_bound = np.zeros(num_classes)
+                upper_bound[y_i] = c_instance
+                free = alpha_i < upper_bound
+                if not free.any():
+                    continue
+                violation = gradient.max() - gradient[free].min()
+                if violation <= 1e-12:
+                    continue
+                max_violation = max(max_violation, violation)
+
+                b = gradient - a_i * alpha_i
+                new_alpha_i = self.__solve_sub_problem(a_i, y_i, c_instance, b)
+                delta = new_alpha_i - alpha_i
+                alpha[i] = new_alpha_i
+                weights[:, columns] += np.outer(delta, values)
+            if max_violation < self.tolerance * self.loss:
+                break
+        return weights, num_iterations, max_violation
+
+    @staticmethod
+    def __solve_sub_problem(a_i, y_i, c_instance, b):
+        d = b.copy()
+        d[y_i] += a_i * c_instance
+        d = -np.sort(-d)
+        beta = d[0] - a_i * c_instance
+        r = 1
+        while r < len(d) and beta < r * d[r]:
+            beta += d[r]
+            r += 1
+        beta /= r
+        new_alpha_i = np.minimum(0.0, (beta - b) / a_i)
+        new_alpha_i[y_i] = min(c_instance, (beta - b[y_i]) / a_i)
+        return new_alpha_i
+
+
+BACKENDS = {SVMLightBackend.name: SVMLightBackend,
+            LinearSVMBackend.name: LinearSVMBackend}
+
+
+def get_backend(backend=None, **params):
+    if backend is None:
+        backend = SVM_BACKEND
+    if isinstance(backend, str):
+        if backend not in BACKENDS:
+            raise ValueError('Unknown SVM backend %s, valid ones are %s' % (backend, ', '.join(sorted(BACKENDS))))
+        backend = BACKENDS[backend](**params)
+    return backend
@@ -3,33 +3,70 @@
 import sys
 import os
 import pickle
-import subprocess
+from itertools import chain, repeat
+
+import numpy as np
 
 from . import feature_extractor
+from .feature_cache import get_feature_cache, get_group_key
+from .feature_ids import FeatureVocabulary, compile_feature_id_extractors
+from .feature_hashing import HashingEncoder
 from .my_names import *
+from .svm_backends import get_backend, matrix_from_entries, sorted_unique
+from .svm_model import load_svm_model
 from collections import defaultdict
 from xml.etree import ElementTree
-import tempfile
 
 
 class SVMClassifier:
-    def __init__(self):
+    def __init__(self, backend=None, extraction_mode=None, feature_cache=None):
+        # backend is the name of one of the svm_backends.BACKENDS or a backend object
+        # extraction_mode is 'strings' or 'ids' (see feature_ids.py), by default FEATURE_EXTRACTION_MODE
+        # feature_cache is a folder or a feature_cache.FeatureCache for the training, by default FEATURE_CACHE_FOLDER
+        self.backend = get_backend(backend)
+        self.feature_cache = get_feature_cache(feature_cache if feature_cache is not None else FEATURE_CACHE_FOLDER)
+        self.extraction_mode = extraction_mode if extraction_mode is not None else FEATURE_EXTRACTION_MODE
+        if self.extraction_mode not in ('strings', 'ids'):
+            raise ValueError('Unknown feature extraction mode %s' % self.extraction_mode)
         self.lemma = None
         self.pos = None
         self.list_feature_extractors = None
+        self.compiled_feature_extractors = None
         self.index_features = {}
+        self.feature_vocabulary = None          # Only for the 'ids' extraction mode
+        self.compiled_feature_id_extractors = None
+        self.index_feature_ids = {}
+        self.use_feature_ids = False
+        self.feature_encoder = None             # HashingEncoder if the feature config selects it
         self.svm_class_for_key = {}
         self.main_folder = ''
+        self.num_training_instances = 0
+        self.num_instances_without_keys = 0     # Left out of the training, they have no class
+        self.svm_model = None
         
-    def start_classifier(self,lemma,pos,folder):
+    def start_classifier(self,lemma,pos,folder, feature_config=None, load_model=False):
+        # feature_config (from get_feature_config) can be given to reuse the already parsed feature config of the folder
+        # With load_model the weights are kept in the object when the backend scores in-process
         self.lemma = lemma.lower()
         self.__set_normalised_pos(pos)
         self.main_folder = folder
         model_file = self.__get_model_filename()
         if os.path.exists(model_file):
-            self.__load_index_features()
+            if feature_config is None:
+                self.load_feature_extractors(self.__get_feature_config_filename())
+            else:
+                self.set_feature_config(feature_config)
+            # The models with hashed features have no index
+            if self.feature_encoder is None:
+                self.__load_index_features()
             self.__load_index_classes()
-            self.load_feature_extractors(self.__get_feature_config_filename())
+            if self.use_feature_ids:
+                # The string index is converted and not needed anymore
+                self.index_feature_ids = self.feature_vocabulary.convert_index(self.index_features)
+                self.index_features = {}
+                self.feature_vocabulary.set_frozen(True)
+            if load_model and self.backend.classify_in_process:
+                self.svm_model = load_svm_model(model_file)
             return True
         else:
             return False
@@ -68,25 +105,85 @@ class SVMClassifier:
             for arg in function.findall('arg'):
                 options[arg.get('name')] = arg.text
                 self.list_feature_extractors.append((function.get('name'), options))
+        self.feature_encoder = None
+        encoder = tree_s.find('encoder')
+        if encoder is not None and encoder.get('name') != 'index':
+            if encoder.get('name') != 'hashing':
+                raise ValueError('Unknown feature encoder %s in %s' % (encoder.get('name'), _file))
+            options = {}
+            for arg in encoder.findall('arg'):
+                options[arg.get('name')] = arg.text
+            self.feature_encoder = HashingEncoder.from_options(options)
+        self.set_feature_extractors(self.list_feature_extractors)
+
+    def get_feature_config(self):
+        return (self.list_feature_extractors, self.compiled_feature_extractors, self.feature_encoder)
+
+    def set_feature_config(self, feature_config):
+        list_feature_extractors, compiled_feature_extractors, feature_encoder = feature_config
+        self.feature_encoder = feature_encoder
+        self.set_feature_extractors(list_feature_extractors, compiled_feature_extractors)
 
+    def set_feature_extractors(self, list_feature_extractors, compiled_feature_extractors=None):
+        self.list_feature_extractors = list_feature_extractors
+        if compiled_feature_extractors is None:
+            compiled_feature_extractors = feature_extractor.compile_feature_extractors(list_feature_extractors)
+        self.compiled_feature_extractors = compiled_feature_extractors
+        # The hashing encoder works on the feature strings
+        self.use_feature_ids = self.extraction_mode == 'ids' and self.feature_encoder is None
+        if self.use_feature_ids:
+            # The vocabulary belongs to the lemma, so these can not be shared between classifiers
+            self.feature_vocabulary = FeatureVocabulary()
+            self.compiled_feature_id_extractors = compile_feature_id_extractors(list_feature_extractors, self.feature_vocabulary)
                 
     def extract_features(self, this_instance):
         list_string_features = []
-        for this_function_name, these_options in self.list_feature_extractors:
-            this_function = getattr(feature_extractor, this_function_name)
-            this_function(this_instance, these_options, list_string_features)
+        for this_extractor in self.compiled_feature_extractors:
+            this_extractor(this_instance, list_string_features)
         return list_string_features
 
+    def extract_feature_ids(self, this_instance):
+        list_feature_ids = []
+        for this_extractor in self.compiled_feature_id_extractors:
+            this_extractor(this_instance, list_feature_ids)
+        return list_feature_ids
+
+    def extract(self, this_instance):
+        # Features of the instance in the current extraction mode, strings or integer ids
+        if self.use_feature_ids:
+            return self.extract_feature_ids(this_instance)
+        else:
+            return self.extract_features(this_instance)
+
+    def encode_features(self, list_features, update_index):
+        # Encodes the output of extract with the index of the current extraction mode
+        if self.feature_encoder is not None:
+            return self.feature_encoder.encode(list_features, update_stats=update_index)
+        elif self.use_feature_ids:
+            return self.encode(list_features, update_index, self.index_feature_ids)
+        else:
+            return self.encode(list_features, update_index)
 
-    def encode(self, list_features, update_index):
-        #List of s is a list of strings
+    def get_num_features(self):
+        if self.feature_encoder is not None:
+            return self.feature_encoder.num_buckets
+        elif self.use_feature_ids:
+            return len(self.index_feature_ids)
+        else:
+            return len(self.index_features)
+
+
+    def encode(self, list_features, update_index, index_features=None):
+        #List of s is a list of strings (or feature ids, with the index_features for them)
+        if index_features is None:
+            index_features = self.index_features
         map_feat = defaultdict(int)
         for string_feat in list_features:
-            num_feat = self.index_features.get(string_feat,None)
+            num_feat = index_features.get(string_feat,None)
             if num_feat is None:
                 if update_index:
-                    num_feat = len(self.index_features)+1
-                    self.index_features[string_feat] = num_feat
+                    num_feat = len(index_features)+1
+                    index_features[string_feat] = num_feat
             
             if num_feat is not None:
                 map_feat[num_feat] += 1
@@ -96,10 +193,157 @@ class SVMClassifier:
         else:
             vector_feat = []
         return vector_feat
+
+    def encode_batch(self, list_features_for_instances, update_index):
+        # Encodes the output of extract for many instances at once in a CSR matrix
+        # (one row per instance), with the same values as encode_features for every row
+        num_rows = len(list_features_for_instances)
+        if self.feature_encoder is not None:
+            rows, columns, values = self.feature_encoder.encode_batch(list_features_for_instances, update_stats=update_index)
+            return matrix_from_entries(rows, columns, values, num_rows, self.get_num_features())
+
+        index_features = self.index_feature_ids if self.use_feature_ids else self.index_features
+        all_features = list(chain.from_iterable(list_features_for_instances))
+        if update_index:
+            # New features get consecutive numbers in order of first appearance, as in encode
+            for string_feat in dict.fromkeys(all_features):
+                if string_feat not in index_features:
+                    index_features[string_feat] = len(index_features)+1
+        columns = np.fromiter(map(index_features.get, all_features, repeat(0)), dtype=np.int64, count=len(all_features)) - 1
+        lengths = np.fromiter(map(len, list_features_for_instances), dtype=np.int64, count=num_rows)
+        rows = np.repeat(np.arange(num_rows, dtype=np.int64), lengths)
+        known = columns >= 0
+        num_features = self.get_num_features()
+        # Sorted and without repetitions, the values are binary
+        rows, columns = np.divmod(sorted_unique(rows[known] * max(num_features, 1) + columns[known]), max(num_features, 1))
+        return matrix_from_entries(rows, columns, np.ones(len(rows)), num_rows, num_features)
+
+    def get_svm_labels(self, list_keys_for_instances, update_index):
+        # The svm class (starting at 1) of the first key of every instance, new keys get a new class with update_index
+        # and 0 otherwise. The instances without keys get 0 too, they are only accepted when classifying (the labels
+        # are ignored), the training blocks do not include them
+        labels = np.zeros(len(list_keys_for_instances), dtype=np.int64)
+        for num_instance, these_keys in enumerate(list_keys_for_instances):
+            keys = list(these_keys)
+            if len(keys) == 0:
+                continue
+            this_class = keys[0]
+            this_svm_class = self.svm_class_for_key.get(this_class)
+            if this_svm_class is None and update_index:
+                this_svm_class = len(self.svm_class_for_key) + 1  #First is 1
+                self.svm_class_for_key[this_class] = this_svm_class
+            if this_svm_class is not None:
+                labels[num_instance] = this_svm_class
+        return labels
+
+    def __extract_with_cache(self, lexelt, lexelt_digest):
+        # (instance, features) for every instance of the lexelt. The groups of features (one per extractor of the
+        # config) that are in the feature cache are read from it, the others are extracted and written to it, both
+        # chunk by chunk while the instances are read
+        num_instances = len(lexelt)
+        group_keys = [get_group_key(function_name, options) for function_name, options in self.list_feature_extractors]
+        cached_groups = {}          # group key -> iterator of the features of every instance
+        missing_groups = {}         # group key -> (extractor, FeatureGroupWriter)
+        completed = False
+        try:
+            for group_key, this_extractor in zip(group_keys, self.compiled_feature_extractors):
+                if group_key in cached_groups or group_key in missing_groups:
+                    continue
+                group_reader = self.feature_cache.open_group(lexelt_digest, group_key, num_instances)
+                if group_reader is not None:
+                    cached_groups[group_key] = (group_reader, iter(group_reader))
+                else:
+                    missing_groups[group_key] = (this_extractor, self.feature_cache.create_group(lexelt_digest, group_key, num_instances))
+            print('\tFeature cache: %d groups read, %d groups extracted' % (len(cached_groups), len(missing_groups)))
+
+            for this_instance in lexelt:
+                features_for_group = {}
+                for group_key, (group_reader, features_iterator) in cached_groups.items():
+                    features_for_group[group_key] = next(features_iterator)
+                for group_key, (this_extractor, group_writer) in missing_groups.items():
+                    features_for_group[group_key] = []
+                    this_extractor(this_instance, features_for_group[group_key])
+                    group_writer.add(features_for_group[group_key])
+                # In the order of the config, as extract_features
+                list_string_features = []
+                for group_key in group_keys:
+                    list_string_features.extend(features_for_group[group_key])
+                if self.use_feature_ids:
+                    yield this_instance, list(map(self.feature_vocabulary.from_string, list_string_features))
+                else:
+                    yield this_instance, list_string_features
+            completed = True
+        finally:
+            # The new groups are only saved if all the instances were extracted
+            for group_reader, features_iterator in cached_groups.values():
+                group_reader.close()
+            for this_extractor, group_writer in missing_groups.values():
+                if completed:
+                    group_writer.close()
+                else:
+                    group_writer.discard()
+
+    def __encode_training_blocks(self, lexelt, lexelt_digest=None):
+        # The instances are read, extracted and encoded in blocks of TRAINING_BLOCK_SIZE, which
+        # are given to the backend one by one, so only one block is in memory at the same time
+        self.num_training_instances = 0
+        self.num_instances_without_keys = 0
+        total_features = 0
+        list_features = []
+        list_keys = []
+        if self.feature_cache is not None and lexelt_digest is not None:
+            extracted_instances = self.__extract_with_cache(lexelt, lexelt_digest)
+        else:
+            extracted_instances = ((this_instance, self.extract(this_instance)) for this_instance in lexelt)
+        for this_instance, these_features in extracted_instances:
+            list_features.append(these_features)
+            list_keys.append(this_instance.get_lexkeys())
+            if len(list_keys[-1]) != 0:
+                total_features += len(these_features)
+            if len(list_features) == TRAINING_BLOCK_SIZE:
+                yield self.__encode_training_block(list_features, list_keys)
+                list_features = []
+                list_keys = []
+        if len(list_features) != 0:
+            yield self.__encode_training_block(list_features, list_keys)
+        print('\tTotal instances: %d' % self.num_training_instances)
+        if self.num_instances_without_keys != 0:
+            print('\tInstances without sense keys (not used): %d' % self.num_instances_without_keys)
+        print('\tTotal features: %d' % total_features)
+
+    def __encode_training_block(self, list_features, list_keys):
+        # The label 0 of an instance without keys is not a class (svm_multiclass rejects it and the
+        # linear backend would take it as the last class), those instances are left out
+        with_keys = [num_instance for num_instance, these_keys in enumerate(list_keys) if len(these_keys) != 0]
+        if len(with_keys) != len(list_keys):
+            self.num_instances_without_keys += len(list_keys) - len(with_keys)
+            list_features = [list_features[num_instance] for num_instance in with_keys]
+            list_keys = [list_keys[num_instance] for num_instance in with_keys]
+        self.num_training_instances += len(list_features)
+        #only one key
+        labels = self.get_svm_labels(list_keys, update_index=True)
+        X = self.encode_batch(list_features, update_index=True)
+        return X, labels
+
+    def encode_lexelt(self, this_lexelt, update_index=False):
+        # Returns the CSR matrix of the instances of the lexelt, the vector of their labels and the list of their ids
+        instance_ids_in_order = []
+        list_features = []
+        list_keys = []
+        for this_instance in this_lexelt:
+            instance_ids_in_order.append(this_instance.get_id())
+            list_features.append(self.extract(this_instance))
+            list_keys.append(this_instance.get_lexkeys())
+        X = self.encode_batch(list_features, update_index)
+        labels = self.get_svm_labels(list_keys, update_index)
+        return X, labels, instance_ids_in_order
         
         
     
-    def train(self,bin_file, features_file, model_folder):
+    def train(self,bin_file, features_file, model_folder, lexelt_digest=None):
+        # bin_file is the path to a .bin/.ulm2 file or a lexelt already opened (Clexelt or ulm_v2.LexeltReader)
+        # lexelt_digest identifies the instances in the feature cache, by default the digest of the file
+        # or of the LexeltReader (the cache is not used for a Clexelt without it)
         self.main_folder = model_folder
         if not os.path.exists(self.main_folder):
             os.mkdir(self.main_folder)
@@ -114,11 +358,22 @@ class SVMClassifier:
         ###########################
         #  Load the instances 
         ###########################
-        fd = open(bin_file,'rb')
+        # ULM v2 or pickled Clexelt (this module does not need the data classes otherwise)
+        from ulm_v2 import open_lexelt_file
         
-        #This is a list of Cinstance objects
-        lexelt = pickle.load(fd)
-        fd.close()
+        # The instances are read one by one while training, the ULM v2 files are not loaded at once
+        if isinstance(bin_file, str):
+            lexelt = open_lexelt_file(bin_file)
+        else:
+            lexelt = bin_file
+        if self.feature_cache is not None and lexelt_digest is None:
+            if isinstance(bin_file, str):
+                from ulm_archive import get_file_digest
+                lexelt_digest = get_file_digest(bin_file)
+            elif hasattr(lexelt, 'get_digest'):
+                lexelt_digest = lexelt.get_digest()
+            else:
+                print('\tThe lexelt has no digest, the feature cache is not used')
         
         self.lemma = lexelt.get_lemma().lower()
         self.__set_normalised_pos(lexelt.get_pos())
@@ -127,156 +382,87 @@ class SVMClassifier:
         ###########################
         ###########################
 
-        ###########################
-        #  Load the instances 
-        ###########################
-        
-        features_for_instance_id = {}
-        keys_for_instance_id = {}
-        feature_frequency = defaultdict(int)
-        total_features = 0
-        instance_ids_in_order = []
-        for this_instance in lexelt:
-            instance_ids_in_order.append(this_instance.get_id())
-            features_for_instance_id[this_instance.get_id()] = self.extract_features(this_instance)
-            ###print(this_instance.get_id(),features_for_instance_id[this_instance.get_id()])
-            for f in features_for_instance_id[this_instance.get_id()]:
-                feature_frequency[f] += 1
-            total_features += len(features_for_instance_id[this_instance.get_id()])
-            keys_for_instance_id[this_instance.get_id()] = this_instance.get_lexkeys()
-        print('\tTotal instances: %d' % len(keys_for_instance_id))
-        print('\tTotal features: %d' % total_features)
-
-        #for f, v in sorted(list(_frequency.items()), key=lambda t: -t[1]):
-        #    print('%s -> %d' % (f,v))
-        ###########################
-        ###########################
-        
         ###########################
         #  Encode the instances
         #  Generates the index
-        #  Generate the training file
+        #  Train the model
         ###########################
         training_filename = self.__get_training_filename__()
-        fd_training = open(training_filename,'w')
-        
-        for instance_id in instance_ids_in_order:
-            list_string_features = features_for_instance_id[instance_id]
-            keys = list(keys_for_instance_id[instance_id])
-            this_class = keys[0]
-            if this_class in self.svm_class_for_key:
-                this_svm_class = self.svm_class_for_key[this_class]
-            else:
-                this_svm_class = len(self.svm_class_for_key) + 1  #First is 1
-                self.svm_class_for_key[this_class] = this_svm_class
-                
-            #only one key
-            fd_training.write('%s' % this_svm_class)
-            int_features_and_frequency = self.encode(list_string_features, update_index=True)
-            for int_feat, freq in int_features_and_frequency:
-                fd_training.write(' %d:%d' % (int_feat, 1))
-            fd_training.write('\n')
-        fd_training.close()
+        if self.feature_encoder is not None:
+            self.feature_encoder.start_stats()
         
-        ###########################
-        #  Train the model
-        ###########################
         model_filename = self.__get_model_filename()
-
-        training_cmd = []
-        training_cmd.append(SVM_LEARN)
-        training_cmd.append('-c')
-        training_cmd.append('1')
-        #training_cmd.append('-w')
-        #training_cmd.append('4')        
-        training_cmd.append(training_filename)
-        training_cmd.append(model_filename)
-        log_training = model_filename+".log"
-        fd_log = open(log_training,'w')
-        training_code = subprocess.check_call(training_cmd, stdout=fd_log)
-        fd_log.close()
+        training_code = self.backend.learn_blocks(self.__encode_training_blocks(lexelt, lexelt_digest), training_filename, model_filename)
         print('\tTraining done with exit code: %d' % training_code)
-        print('\tLog training file in %s' % log_training)
+        print('\tLog training file in %s' % (model_filename+'.log'))
+        if self.feature_encoder is not None:
+            stats = self.feature_encoder.get_collision_stats()
+            print('\tHashing with %d bits: %d features in %d buckets, %d colliding features (%d buckets with collisions, max %d features in one)' %
+                  (self.feature_encoder.bits, stats['features'], stats['buckets_used'], stats['colliding_features'], stats['colliding_buckets'], stats['max_features_in_bucket']))
         
         
         ###########################
         #  Save the indexes
         ###########################
         
-        index_feature_filename = self.__get_index_feature_filename()
-        fd_index_feat = open(index_feature_filename,'wb')
-        pickle.dump(self.index_features, fd_index_feat, protocol=-1)
-        fd_index_feat.close()
+        if self.use_feature_ids:
+            # Saved as strings, the same index as the one of the 'strings' mode
+            self.index_features = self.feature_vocabulary.to_string_index(self.index_feature_ids)
+        if self.feature_encoder is None:
+            index_feature_filename = self.__get_index_feature_filename()
+            fd_index_feat = open(index_feature_filename,'wb')
+            pickle.dump(self.index_features, fd_index_feat, protocol=-1)
+            fd_index_feat.close()
         
         index_class_filename = self.__get_index_class_filename()
         fd_index_class = open(index_class_filename,'wb')
         pickle.dump(self.svm_class_for_key, fd_index_class, protocol=-1)
         fd_index_class.close()
+        return training_code
         
     def disambiguate_lexelt(self,this_lexelt):
         values_for_instance_id = {}
-        # Create the testing file
-        fd_testing = tempfile.NamedTemporaryFile('w',delete=False)
-        ids_in_order = []
-        for this_instance in this_lexelt:
-            ids_in_order.append(this_instance.get_id())
-            fd_testing.write('1 ')
-            string_features = self.extract_features(this_instance)
-            int_features_and_frequency = self.encode(string_features, update_index=False)
-            for int_feat, freq in int_features_and_frequency:
-                fd_testing.write(' %d:%d' % (int_feat, 1))
-            fd_testing.write('\n')
-        fd_testing.close()
+        X, labels, ids_in_order = self.encode_lexelt(this_lexelt, update_index=False)
+        if len(ids_in_order) == 0:
+            return values_for_instance_id
         
         # Run the classification
-        ### usage: svm_struct_classify [options] example_file model_file output_file
-        model_filename = self.__get_model_filename()
-        output_filename = tempfile.mktemp()
-        
-        testing_cmd = []
-        testing_cmd.append(SVM_CLASSIFY)
-        testing_cmd.append(fd_testing.name)
-        testing_cmd.append(model_filename)
-        testing_cmd.append(output_filename)
-        evaluation_code = subprocess.check_call(testing_cmd, stdout=subprocess.DEVNULL)
-        print('\tClassification done with code %d' % evaluation_code, file=sys.stderr)
+        if self.svm_model is not None:
+            scores = self.svm_model.score(X)
+        else:
+            scores = self.backend.classify(X, self.__get_model_filename())
         
         # Reverse the dictionary
         wn_class_for_svm_class = {}
         for wn_class, svm_class in self.svm_class_for_key.items():
             wn_class_for_svm_class[svm_class] = wn_class
             
-            
-        fd_out = open(output_filename)
-        for idx_instance, line in enumerate(fd_out):
-            instance_id = ids_in_order[idx_instance]
+        for idx_instance, instance_id in enumerate(ids_in_order):
             these_values = []
-            
-            '''
-            #### This was for liblinear 
-            wn_class = wn_class_for_svm_class[int(line.strip())]
-            
-            these_values.append((wn_class,1.0))
-            values_for_instance_id[instance_id] = these_values
-            continue
-            ############
-            '''
-            
-            tokens = line.strip().split(' ')
-            
-            for idx_class, value in enumerate(tokens[1:], 1): #Starts from 1 the first class
+            for idx_class, value in enumerate(scores[idx_instance], 1): #Starts from 1 the first class
                 wn_class = wn_class_for_svm_class[idx_class]
                 these_values.append((wn_class,float(value)))
             these_values.sort(key=lambda t: -t[1])
             values_for_instance_id[instance_id] = these_values
-        fd_out.close()
-        
-        os.remove(fd_testing.name)  
-        os.remove(output_filename)      
         return values_for_instance_id
         
         
             
+    def get_size_in_bytes(self):
+        # Approximate memory used by the indexes and the model weights
+        size = sys.getsizeof(self.index_features) + sys.getsizeof(self.svm_class_for_key) + sys.getsizeof(self.index_feature_ids)
+        for string_feat in self.index_features:
+            size += sys.getsizeof(string_feat)
+        if self.feature_vocabulary is not None:
+            size += sys.getsizeof(self.feature_vocabulary.id_for_value) + sys.getsizeof(self.feature_vocabulary.values)
+            for value in self.feature_vocabulary.values:
+                size += sys.getsizeof(value)
+        for wn_class in self.svm_class_for_key:
+            size += sys.getsizeof(wn_class)
+        if self.svm_model is not None:
+            size += self.svm_model.get_size_in_bytes()
+        return size
+        
     def __load_index_features(self):
         index_feature_filename = self.__get_index_feature_filename()
         fd_index_feat = open(index_feature_filename,'rb')
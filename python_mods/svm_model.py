@@ -0,0 +1,166 @@
+#!/usr/bin/env python
+
+# Reading and writing of linear models in the svm_multiclass file format.
+# svm_multiclass stores a linear model as one single support vector that
+# contains the weights of all the classes one after the other: the weight of
+# the base feature j (starting at 1) for the class y (starting at 1) is found
+# at the position (y-1)*num_base_features + j
+# The models are parsed once into a (classes x base features) weight matrix,
+# kept in a small cache, so scoring a lexelt is one sparse matrix product.
+# The matrix is built sparse from the non zero weights of the file, and it is
+# only made dense when most weights are non zero, so the models with hashed
+# features (2^bits base features) do not allocate classes x 2^bits floats
+
+import os
+import threading
+from collections import OrderedDict
+
+import numpy as np
+from scipy import sparse
+
+from .my_names import MODEL_CACHE_SIZE
+
+SVM_MULTICLASS_VERSION = 'V2.20'
+
+
+# Below this ratio of non zero weights the matrix is stored as a sparse CSR matrix
+MAX_SPARSE_DENSITY = 0.3
+
+_model_cache = OrderedDict()     # absolute path -> ((mtime, size), SVMModel)
+_model_cache_lock = threading.Lock()    # disambiguate.py -j N loads the models from several threads
+
+
+class SVMModel:
+    def __init__(self, weights, num_training_documents=0):
+        self.weights = weights              # (classes x base features) matrix, dense or CSR
+        self.num_training_documents = num_training_documents
+
+    def compact(self):
+        # Sparse CSR below MAX_SPARSE_DENSITY non zero weights, dense otherwise
+        if sparse.issparse(self.weights):
+            if self.weights.nnz >= MAX_SPARSE_DENSITY * self.weights.shape[0] * self.weights.shape[1]:
+                self.weights = self.weights.toarray()
+        else:
+            num_non_zero = np.count_nonzero(self.weights)
+            if num_non_zero < MAX_SPARSE_DENSITY * self.weights.size:
+                self.weights = sparse.csr_matrix(self.weights)
+        return self
+
+    def get_size_in_bytes(self):
+        if sparse.issparse(self.weights):
+            return self.weights.data.nbytes + self.weights.indices.nbytes + self.weights.indptr.nbytes
+        else:
+            return self.weights.nbytes
+
+    def get_num_classes(self):
+        return self.weights.shape[0]
+
+    def get_num_features(self):
+        return self.weights.shape[1]
+
+    def score(self, X):
+        # X is a (instances x features) sparse matrix, the result is a dense (instances x classes) array
+        num_features = self.get_num_features()
+        if X.shape[1] > num_features:
+            X = X[:, :num_features]
+        scores = X @ self.weights[:, :X.shape[1]].T
+        if sparse.issparse(scores):
+            scores = scores.toarray()
+        return np.asarray(scores)
+
+
+def write_svm_model(filename, weights, num_training_documents=0, loss_function=0):
+    # weights is a dense or sparse (classes x base features) matrix, only its non zero weights are used
+    num_classes, num_features = weights.shape
+    coo_weights = sparse.coo_matrix(weights, dtype=np.float64)
+    positions = coo_weights.row.astype(np.int64) * num_features + coo_weights.col
+    non_zero = coo_weights.data != 0
+    order = np.argsort(positions[non_zero], kind='stable')
+    positions = positions[non_zero][order]
+    values = coo_weights.data[non_zero][order]
+    fd = open(filename, 'w')
+    fd.write('SVM-multiclass Version %s\n' % SVM_MULTICLASS_VERSION)
+    fd.write('%d # number of classes\n' % num_classes)
+    fd.write('%d # number of base features\n' % num_features)
+    fd.write('%d # loss function\n' % loss_function)
+    fd.write('0 # kernel type\n')
+    fd.write('3 # kernel parameter -d \n')
+    fd.write('1 # kernel parameter -g \n')
+    fd.write('1 # kernel parameter -s \n')
+    fd.write('1 # kernel parameter -r \n')
+    fd.write('empty# kernel parameter -u \n')
+    fd.write('%d # highest feature index \n' % (num_classes * num_features))
+    fd.write('%d # number of training documents \n' % num_training_documents)
+    fd.write('2 # number of support vectors plus 1 \n')
+    fd.write('0 # threshold b, each following line is a SV (starting with alpha*y)\n')
+    fd.write('1 ')
+    for position, value in zip(positions.tolist(), values.tolist()):
+        fd.write('%d:%.8g ' % (position + 1, value))
+    fd.write('#\n')
+    fd.close()
+
+
+def read_svm_model(filename):
+    header = {}
+    support_vectors = []
+    fd = open(filename)
+    fd.readline()   # SVM-multiclass Version ...
+    for line in fd:
+        value, sep, comment = line.partition('#')
+        comment = comment.strip()
+        if comment.startswith('threshold b'):
+            break
+        header[comment] = value.strip()
+    for line in fd:
+        line = line.partition('#')[0]
+        if len(line.strip()) != 0:
+            support_vectors.append(line)
+    fd.close()
+
+    if header.get('kernel type', '0') != '0':
+        raise ValueError('Only linear svm_multiclass models can be read, kernel type in %s is %s' % (filename, header['kernel type']))
+
+    num_classes = int(header['number of classes'])
+    num_features = int(header['number of base features'])
+    list_positions = [np.zeros(0, dtype=np.int64)]
+    list_values = [np.zeros(0)]
+    for support_vector in support_vectors:
+        alpha_y, sep, pairs = support_vector.strip().partition(' ')
+        if len(pairs) == 0:
+            continue
+        # "position:value position:value ..." parsed in one go
+        pairs = np.array(pairs.replace(':', ' ').split(), dtype=np.float64).reshape(-1, 2)
+        positions = pairs[:, 0].astype(np.int64)
+        valid = (positions >= 1) & (positions <= num_classes * num_features)
+        list_positions.append(positions[valid] - 1)
+        list_values.append(float(alpha_y) * pairs[valid, 1])
+    # The repeated positions of different support vectors are added by the conversion to CSR
+    rows, columns = np.divmod(np.concatenate(list_positions), max(num_features, 1))
+    weights = sparse.coo_matrix((np.concatenate(list_values), (rows, columns)), shape=(num_classes, num_features)).tocsr()
+    weights.eliminate_zeros()
+    return SVMModel(weights, int(header.get('number of training documents', 0))).compact()
+
+
+def load_svm_model(filename):
+    # Cached version of read_svm_model, the file is parsed again only if it changed on disk
+    path = os.path.abspath(filename)
+    stat = os.stat(path)
+    signature = (stat.st_mtime_ns, stat.st_size)
+    with _model_cache_lock:
+        cached = _model_cache.get(path)
+        if cached is not None and cached[0] == signature:
+            _model_cache.move_to_end(path)
+            return cached[1]
+    # Parsed without the lock, so the threads do not wait for the models of the others
+    this_model = read_svm_model(path)
+    with _model_cache_lock:
+        _model_cache[path] = (signature, this_model)
+        _model_cache.move_to_end(path)
+        while len(_model_cache) > MODEL_CACHE_SIZE:
+            _model_cache.popitem(last=False)
+    return this_model
+
+
+def clear_model_cache():
+    with _model_cache_lock:
+        _model_cache.clear()
@@ -7,12 +7,14 @@ import sys
 import os
 import glob
 import pickle
+from multiprocessing import Pool, get_start_method
 from lxml import html, etree
 from xml.sax.saxutils import escape
 
 from nltk.corpus import WordNetCorpusReader
-from my_data_classes import Ctoken, Cinstance, Clexelt
+from my_data_classes import Ctoken, Cinstance, Clexelt, Cdocument
 from sensekey_utils import add_sense_info_to_clexelt
+from sense_inventory import set_sense_inventory_file
 from copy import deepcopy
 
 
@@ -79,9 +81,14 @@ def add_file(filename, my_wn_reader, data_lexelt):
                 
             
                 
+    # All the instances of the file share the tokens of this document
+    this_document = Cdocument(file_id)
+    for sentence_id in sents_in_order:
+        this_document.add_sentence(tokens_per_sent[sentence_id])
+                
     SENTENCE_CONTEXT = 3
     for index_sentence, sentence_id in enumerate(sents_in_order):
-        for token in tokens_per_sent[sentence_id]:
+        for index_in_sentence, token in enumerate(tokens_per_sent[sentence_id]):
             token_id = token.get_id()
             if token_id in lex_key_for_token_id: #Is target
                 lemma = token.get_lemma() 
@@ -111,32 +118,14 @@ def add_file(filename, my_wn_reader, data_lexelt):
                         new_instance.set_annotation_type('manual')
         
                         
-                        list_tokens = []
-                        target_indexes = []
-                        
                         start_at_sentence = max(index_sentence-SENTENCE_CONTEXT,0)
                         end_at_sentence = min(index_sentence+SENTENCE_CONTEXT, len(sents_in_order)-1)
                         
-                        rel_pos_and_sent_id = []
-                        for this_idx in range(start_at_sentence,end_at_sentence+1):
-                            relative_position = this_idx - index_sentence
-                            rel_pos_and_sent_id.append((relative_position, sents_in_order[this_idx]))
-                            
-                       
-                        current_token_idx = 0
+                        # Position of the target in the tokens from start_at_sentence on
+                        target_index = this_document.get_sentence_offset(index_sentence) - this_document.get_sentence_offset(start_at_sentence) + index_in_sentence
                         
-                        relative_sentence_for_token_id = {}
-                        for relative_position, current_sentence_id in rel_pos_and_sent_id:
-                            for this_token in tokens_per_sent[current_sentence_id]:
-                                relative_sentence_for_token_id[this_token.get_id()] = relative_position
-                                list_tokens.append(this_token)  # this_token is a Ctoken object
-                                if this_token.get_id() == token.get_id():
-                                    target_indexes.append(current_token_idx)
-                                current_token_idx += 1
-                                
-                        new_instance.set_tokens(list_tokens)
-                        new_instance.set_index_head_list(target_indexes)
-                        new_instance.set_relative_sentence_position_for_token_id(relative_sentence_for_token_id)
+                        new_instance.set_context(this_document, start_at_sentence, end_at_sentence, index_sentence)
+                        new_instance.set_index_head_list([target_index])
                         data_lexelt[this_lemma_key].add_instance(new_instance)
                     else:
                         print('Token %s in file %s not valid with lexkeys %s' % (token_id, file_id, str(gold_lexkeys)), file=sys.stderr)    
@@ -144,12 +133,74 @@ def add_file(filename, my_wn_reader, data_lexelt):
                             
 
 
+# WordNet reader and output folder of the worker processes, set by init_worker
+worker_wn_reader = None
+worker_output = None
+# Lexelts to save, set in the main process before forking the workers (only with the fork start method)
+worker_data_lexelt = None
+
+def init_worker(path_to_wn, output=None, sense_inventory=None):
+    global worker_wn_reader, worker_output
+    worker_wn_reader = WordNetCorpusReader(path_to_wn,None)
+    if sense_inventory is not None:
+        set_sense_inventory_file(sense_inventory)
+    worker_output = output
+
+
+def parse_file(filename):
+    # Runs in the worker processes: the instances of one file for every lemma.pos. They are returned
+    # in one list and not as Clexelt objects, so the document of the file is pickled only once
+    partial_data_lexelt = {}
+    add_file(filename, worker_wn_reader, partial_data_lexelt)
+    return [(item_key, lexelt.get_lemma(), lexelt.get_pos(), lexelt.instances) for item_key, lexelt in partial_data_lexelt.items()]
+
+
+def merge_file_instances(file_instances, my_wn_reader, data_lexelt):
+    # Adds the instances of one file (from parse_file) in the same order and with the same
+    # duplicate checking as add_file
+    for item_key, lemma, pos, list_instances in file_instances:
+        if item_key not in data_lexelt:
+            data_lexelt[item_key] = Clexelt(lemma,pos)
+            data_lexelt[item_key].set_wn_possible_skeys(my_wn_reader)
+        for this_instance in list_instances:
+            data_lexelt[item_key].add_instance(this_instance)
+
+
+def save_lexelt(item_key, lexelt, my_wn_reader, output):
+    # First we call to add_sense_info_to_clexelt to create all the senskey related info
+    # We do not need to assign the return value to a variable, as the object is passed by reference
+    # and it's modified already 
+    add_sense_info_to_clexelt(lexelt, my_wn_reader, debug=False)
+            
+    #Save the lexelt object 
+    item_key = item_key.replace('/','_').lower()
+    output_bin = os.path.join(output,item_key+'.bin')
+    fd_bin = open(output_bin,'wb')
+    pickle.dump(lexelt, fd_bin, protocol=-1)
+    fd_bin.close()
+
+
+def save_lexelt_in_worker(item_key):
+    # The lexelts are taken from the data of the worker (inherited from the main process with fork) and not sent to it
+    save_lexelt(item_key, worker_data_lexelt[item_key], worker_wn_reader, worker_output)
+    return item_key
+
+
+def save_sent_lexelt_in_worker(item_key_and_lexelt):
+    # Without fork the workers do not have the data of the main process, every lexelt is sent to the worker that saves it
+    item_key, lexelt = item_key_and_lexelt
+    save_lexelt(item_key, lexelt, worker_wn_reader, worker_output)
+    return item_key
+
+
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Converts semcor to our intermediate ULM format')
     parser.add_argument('-v', action='version', version = '1.0')
     parser.add_argument('-i', dest='input_folder', required=True, help='Path to original semcor main folder')
     parser.add_argument('-o', dest='output', required=True, help='Output folder')
     parser.add_argument('-wn',dest='path_to_wn', required = True, help='Path to the wordnet root folder')
+    parser.add_argument('-si', '--sense-inventory', dest='sense_inventory', default=None, help='Sense inventory file (wn_to_sense_inventory.py) for the senses and monosemy of the lemmas')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of processes to parse the files and to save the lexelts')
     args = parser.parse_args()
     
     data_lexelt = {}
@@ -158,12 +209,26 @@ if __name__ == '__main__':
     if 'dict' not in args.path_to_wn:
         args.path_to_wn = os.path.join(args.path_to_wn,'dict')
     my_wn_reader = WordNetCorpusReader(args.path_to_wn,None)
+    if args.sense_inventory is not None:
+        set_sense_inventory_file(args.sense_inventory)
     
-        
+    # Always in the same order, the instances of the lexelts follow the order of the files
+    list_files = []
     for folder in ['brown1', 'brown2', 'brownv']:
-        print('Reading folder %s' % folder, file=sys.stderr)
         path_to_files = os.path.join(args.input_folder,folder,'tagfiles','br-*')
-        for filename in glob.glob(path_to_files):
+        list_files.extend(sorted(glob.glob(path_to_files)))
+        
+    if args.jobs > 1:
+        # The files are parsed in parallel and their instances merged in the order of the files
+        print('Reading %d files with %d processes' % (len(list_files), args.jobs), file=sys.stderr)
+        pool = Pool(args.jobs, initializer=init_worker, initargs=(args.path_to_wn, None, args.sense_inventory))
+        for filename, file_instances in zip(list_files, pool.imap(parse_file, list_files)):
+            print('\tFilename: %s' % filename, file=sys.stderr)
+            merge_file_instances(file_instances, my_wn_reader, data_lexelt)
+        pool.close()
+        pool.join()
+    else:
+        for filename in list_files:
             print('\tFilename: %s' % filename, file=sys.stderr)
             add_file(filename,my_wn_reader, data_lexelt)
     
@@ -171,27 +236,33 @@ if __name__ == '__main__':
     print('Creating training data...', file=sys.stderr)
     total_instances = 0
     total_lemmas = 0
+    list_item_keys = []
     for item_key, lexelt in data_lexelt.items():
-        
-
         if len(lexelt) > 0:
-            # First we call to add_sense_info_to_clexelt to create all the senskey related info
-            # We do not need to assign the return value to a variable, as the object is passed by reference
-            # and it's modified already 
-            print('\tLexical item: %s' % item_key, file=sys.stderr)
-
-            add_sense_info_to_clexelt(lexelt, my_wn_reader, debug=False)
-            
             total_lemmas += 1
             total_instances += len(lexelt)
-                    
-            #Save the lexelt object 
-            item_key = item_key.replace('/','_').lower()
-            output_bin = os.path.join(args.output,item_key+'.bin')
-            fd_bin = open(output_bin,'wb')
-            pickle.dump(lexelt, fd_bin, protocol=-1)
-            fd_bin.close()
+            list_item_keys.append(item_key)
+            
+    if args.jobs > 1:
+        # The biggest lexelts first
+        list_item_keys.sort(key=lambda item_key: -len(data_lexelt[item_key]))
+        if get_start_method() == 'fork':
+            # The workers are forked now, so they get data_lexelt from the main process without sending it
+            worker_data_lexelt = data_lexelt
+            pool = Pool(args.jobs, initializer=init_worker, initargs=(args.path_to_wn, args.output, args.sense_inventory))
+            saved_item_keys = pool.imap_unordered(save_lexelt_in_worker, list_item_keys)
+        else:
+            # With spawn (macOS, Windows) every worker receives only the lexelts it saves
+            pool = Pool(args.jobs, initializer=init_worker, initargs=(args.path_to_wn, args.output, args.sense_inventory))
+            saved_item_keys = pool.imap_unordered(save_sent_lexelt_in_worker,
+                                                  ((item_key, data_lexelt[item_key]) for item_key in list_item_keys))
+        for item_key in saved_item_keys:
+            print('\tLexical item: %s' % item_key, file=sys.stderr)
+        pool.close()
+        pool.join()
+    else:
+        for item_key in list_item_keys:
+            print('\tLexical item: %s' % item_key, file=sys.stderr)
+            save_lexelt(item_key, data_lexelt[item_key], my_wn_reader, args.output)
     print('Total number of lemma.pos (unique): %d' % total_lemmas)
     print('Total number of instances: %d' % total_instances)
-        
-            
\ No newline at end of file
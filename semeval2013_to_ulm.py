@@ -1,115 +1,145 @@
 #!/usr/bin/env python
 
+from __future__ import print_function
+
+import argparse
 import sys
 import pickle
 
 from my_data_classes import *
-from xml.etree import cElementTree
-from nltk.corpus import WordNetCorpusReader
+from lxml import etree
+from sense_inventory import get_sense_inventory
 
+SENTENCE_CONTEXT = 3
 
-def convert_to_lexelt(xml_file, key_file, my_wn_reader):
+
+def load_valid_ids(key_file):
     valid_ids = set()
-    #Load teh valid ids
     fd = open(key_file)
     for line in fd:
         #d013 d013.s022.t005 freddie_mac%1:14:00::
         tokens = line.strip().split()
-        valid_ids.add(tokens[1])
+        if len(tokens) >= 2:
+            valid_ids.add(tokens[1])
     fd.close()
-        
+    return valid_ids
+
+
+def read_sentence(sentence, text_id, valid_ids):
+    # Tokens of the <sentence> element and the targets (num_token, semeval_id) that are in valid_ids
+    sent_id = sentence.get('id')
+    tokens = []
+    targets = []
+    for num_token, element in enumerate(sentence):
+        token_id = '%s_%s_%d' % (text_id, sent_id, num_token)
+        new_token = Ctoken(token_id)
+        new_token.set_text(element.text)
+        new_token.set_lemma(element.get('lemma'))
+        new_token.set_pos(element.get('pos'))
+        tokens.append(new_token)
+
+        if element.tag == 'instance':
+            semeval_id = element.get('id')
+            if semeval_id in valid_ids:
+                targets.append((num_token, semeval_id))
+    return tokens, targets
+
+
+def create_instances(text_id, window, index_target):
+    # Instances of the targets of window[index_target], with the sentences of the window around it
+    # (at most SENTENCE_CONTEXT before and after) as context. The targets of one sentence share the document
+    tokens, targets = window[index_target]
+    if len(targets) == 0:
+        return
+    start_at_sentence = max(index_target-SENTENCE_CONTEXT, 0)
+    end_at_sentence = min(index_target+SENTENCE_CONTEXT, len(window)-1)
+    this_document = Cdocument(text_id)
+    for sentence_tokens, sentence_targets in window[start_at_sentence:end_at_sentence+1]:
+        this_document.add_sentence(sentence_tokens)
+    index_sentence = index_target - start_at_sentence
+
+    for num_token, semeval_id in targets:
+        this_target_token = tokens[num_token]
+        lemma = this_target_token.get_lemma()
+        pos = this_target_token.get_pos().lower()[0]
+
+        new_instance = Cinstance()
+        new_instance.set_id(semeval_id)
+        new_instance.set_lemma(lemma)
+        new_instance.set_pos(pos)
+        new_instance.set_context(this_document, 0, end_at_sentence-start_at_sentence, index_sentence)
+        new_instance.set_index_head_list([this_document.get_sentence_offset(index_sentence) + num_token])
+        yield new_instance
+
+
+def iter_instances(xml_file, valid_ids):
+    # Reads the file (a filename or a file object, like sys.stdin.buffer) with iterparse and yields the instances
+    # in the order of the file. Only the last 2*SENTENCE_CONTEXT+1 sentences of the current text are kept: the
+    # targets of a sentence are yielded when the SENTENCE_CONTEXT sentences after it have been read (or the text ends)
+    text_id = None
+    window = []
+    for event, element in etree.iterparse(xml_file, events=('start', 'end')):
+        if event == 'start':
+            if element.tag == 'text':
+                text_id = element.get('id')
+                window = []
+        elif element.tag == 'sentence':
+            window.append(read_sentence(element, text_id, valid_ids))
+            if len(window) > SENTENCE_CONTEXT:
+                for new_instance in create_instances(text_id, window, len(window)-1-SENTENCE_CONTEXT):
+                    yield new_instance
+            if len(window) == 2*SENTENCE_CONTEXT+1:
+                del window[0]
+            # Removes the sentence and the previous ones from the tree
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+        elif element.tag == 'text':
+            # The last sentences of the text have no more sentences on the right
+            for index_target in range(max(len(window)-SENTENCE_CONTEXT, 0), len(window)):
+                for new_instance in create_instances(text_id, window, index_target):
+                    yield new_instance
+            window = []
+            element.clear()
+            while element.getprevious() is not None:
+                del element.getparent()[0]
+
+
+def convert_to_lexelt(xml_file, key_file, my_wn_reader):
+    valid_ids = load_valid_ids(key_file)
     this_data = {}
-    
-    my_tree = cElementTree.parse(xml_file)
     total_instances = 0
-    for text in my_tree.findall('text'):
-        text_id = text.get('id')
-        tokens_per_sent = {}
-        list_sent_id_in_order = []
-        target_token_ids_per_sent = {}
-        for sentence in text.findall('sentence'):
-            
-            sent_id = sentence.get('id')
-            tokens_per_sent[sent_id] = []
-            list_sent_id_in_order.append(sent_id)
-            target_token_ids_per_sent[sent_id] = []
-            for num_token, element in enumerate(sentence):
-                # 1931 instance
-                # 6211 wf
-                token_id = '%s_%s_%d' % (text_id, sent_id, num_token)
-                new_token = Ctoken(token_id)
-                new_token.set_text(element.text)
-                new_token.set_lemma(element.get('lemma'))
-                new_token.set_pos(element.get('pos'))
-                tokens_per_sent[sent_id].append(new_token)
-                
-                if element.tag == 'instance':
-                    semeval_id = element.get('id')
-                    if semeval_id in valid_ids:
-                        target_token_ids_per_sent[sent_id].append((num_token, token_id,semeval_id))
-                
-        
-        SENTENCE_CONTEXT = 3
-        for index_sentence, sentence_id in enumerate(list_sent_id_in_order):
-            for num_token_id, target_token_id, semeval_id in target_token_ids_per_sent[sentence_id]:
-                this_target_token = tokens_per_sent[sentence_id][num_token_id]
-                lemma = this_target_token.get_lemma() 
-                pos  = this_target_token.get_pos().lower()[0]
-                
-                   
-                if (lemma,pos) not in this_data:
-                    this_data[(lemma,pos)] = Clexelt(lemma,pos)
-                    this_data[(lemma,pos)].set_wn_possible_skeys(my_wn_reader)
-
-                start_at_sentence = max(index_sentence-SENTENCE_CONTEXT,0)
-                end_at_sentence = min(index_sentence+SENTENCE_CONTEXT, len(list_sent_id_in_order)-1)
-                
-                rel_pos_and_sent_id = []
-                for this_idx in range(start_at_sentence,end_at_sentence+1):
-                    relative_position = this_idx - index_sentence
-                    rel_pos_and_sent_id.append((relative_position, list_sent_id_in_order[this_idx]))
-                    
-                current_token_idx = 0
-                list_tokens = []
-                target_indexes = []
-                relative_sentence_for_token_id = {}
-                for relative_position, current_sentence_id in rel_pos_and_sent_id:
-                    for this_token in tokens_per_sent[current_sentence_id]:
-                        relative_sentence_for_token_id[this_token.get_id()] = relative_position
-                        list_tokens.append(this_token)  
-                        if this_token.get_id() == target_token_id:
-                            target_indexes.append(current_token_idx)
-                        current_token_idx += 1
-                                
-                new_instance = Cinstance()
-                new_instance.set_id(semeval_id)
-                new_instance.set_lemma(lemma)
-                new_instance.set_pos(pos)
-                new_instance.set_tokens(list_tokens)
-                new_instance.set_index_head_list(target_indexes)
-                new_instance.set_relative_sentence_position_for_token_id(relative_sentence_for_token_id)
-                this_data[(lemma,pos)].add_instance(new_instance)
-                total_instances += 1
-
-  
+    for new_instance in iter_instances(xml_file, valid_ids):
+        lemma = new_instance.get_lemma()
+        pos = new_instance.get_pos()
+        if (lemma,pos) not in this_data:
+            this_data[(lemma,pos)] = Clexelt(lemma,pos)
+            this_data[(lemma,pos)].set_wn_possible_skeys(my_wn_reader)
+        this_data[(lemma,pos)].add_instance(new_instance)
+        total_instances += 1
     return this_data, total_instances
-                    
-            
+
 
 if __name__ == '__main__':
-    path_to_semevalfile = 'semeval-2013-task12-test-data/data/multilingual-all-words.en.xml'
-    path_to_key = 'semeval-2013-task12-test-data/keys/gold/wordnet/wordnet.en.key'
-    path_to_wn_dict = '/home/rbevia/wsd_lfs/resources/WordNet-3.0/dict'
-    
-    my_wn_reader = WordNetCorpusReader(path_to_wn_dict,None)
-    
-    data_lexelt, total_instances = convert_to_lexelt(path_to_semevalfile,path_to_key,my_wn_reader)
-    
-    print('Total of test instances: %d' % total_instances, '(It should be 1644)')
-    
-    out_file = sys.argv[1]
-    fd_out = open(out_file,'wb')
+    parser = argparse.ArgumentParser(description='Converts the SemEval-2013 all-words XML file to a pickled dictionary of Clexelt objects')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-i', dest='input_file', default='semeval-2013-task12-test-data/data/multilingual-all-words.en.xml', help='XML file, - for the standard input')
+    parser.add_argument('-k', dest='key_file', default='semeval-2013-task12-test-data/keys/gold/wordnet/wordnet.en.key', help='Key file with the ids of the instances')
+    parser.add_argument('-wn', dest='path_to_wn', default='/home/rbevia/wsd_lfs/resources/WordNet-3.0/dict', help='Path to the WordNet dict folder or to a sense inventory file (wn_to_sense_inventory.py)')
+    parser.add_argument('output_file', help='Output file for the pickled dictionary of Clexelt objects')
+    args = parser.parse_args()
+
+    my_wn_reader = get_sense_inventory(args.path_to_wn)
+
+    if args.input_file == '-':
+        input_file = getattr(sys.stdin, 'buffer', sys.stdin)
+    else:
+        input_file = args.input_file
+    data_lexelt, total_instances = convert_to_lexelt(input_file,args.key_file,my_wn_reader)
+
+    print('Total of test instances: %d' % total_instances, '(It should be 1644 for SemEval-2013)')
+
+    fd_out = open(args.output_file,'wb')
     pickle.dump(data_lexelt, fd_out, protocol=-1)
     fd_out.close()
-    print('Output in file %s' % out_file)
-    
\ No newline at end of file
+    print('Output in file %s' % args.output_file)
@@ -0,0 +1,487 @@
+#!/usr/bin/env python
+
+'''
+Sense inventory: the WordNet senses of every lemma.pos, precomputed with NLTK
+by wn_to_sense_inventory.py and read with mmap, so the scripts do not need to
+load WordNetCorpusReader to know the senses of a lemma. The file has the same
+layout as the ULM v2 files (see ulm_v2.py):
+
+  'WNSI' | uint32 length of the header | header (JSON) | arrays (8-byte aligned)
+
+The lemma.pos items are sorted by their UTF-8 bytes and found with a binary
+search over the string pool. Every item has its sense keys and synset offsets
+in the order of NLTK wn.lemmas(lemma, pos) (the sense number is the position
+plus one) and a flag that is 1 when wn.synsets(lemma, pos) has one synset.
+
+Since version 2 the file also has the relations of the synsets as integer
+adjacency arrays (CSR: <name>_offsets with one item per synset plus one, and
+<name> with the numbers of the related synsets): hypernyms, hyponyms, the sense
+keys of every synset and its min_depth. The synsets are numbered in the order
+of their keys (pos code * 10^8 + offset). The queries on the relations
+(get_co_sensekeys, get_cohypo_sensekeys, get_hyponym_sensekeys) are done with
+NumPy, level by level, and give the same sense keys as the functions of
+sensekey_utils.py on the NLTK synsets, without creating any NLTK object.
+Since version 3 every item has the synsets of wn.synsets(lemma, pos) and every
+sense key of a synset the item of its lemma.pos, so expand_lemma_pos expands
+a whole set of lemma.pos at once (see sensekey_utils.expand_lemma_pos_batch).
+
+All the inventories have the same memoized interface: get_senses,
+get_sense_keys, get_first_sense and is_monosemous. as_sense_inventory returns
+the inventory for a NLTK reader, so the functions that receive a reader can
+use the file when it has been set with set_sense_inventory_file.
+'''
+
+from __future__ import print_function
+
+import json
+import mmap
+import struct
+import sys
+from array import array
+
+import numpy as np
+
+from ulm_v2 import StringPool, align
+
+MAGIC = b'WNSI'
+VERSION = 3
+# Version 1 has no relations of the synsets, version 2 no tables for expand_lemma_pos
+SUPPORTED_VERSIONS = (1, 2, 3)
+SENSE_INVENTORY_EXTENSION = '.wnsi'
+# Parts of speech of the items of the inventory, the rest are asked to the NLTK reader
+INVENTORY_POS = ['n', 'v', 'a', 'r']
+# Code of the pos in the keys of the synsets, the satellites are in the adjective file as in NLTK
+POS_CODES = {'n': 1, 'v': 2, 'a': 3, 's': 3, 'r': 4}
+# Arrays of the relations, read as NumPy arrays
+RELATION_ARRAYS = ['synset_keys', 'synset_depths', 'synset_sense_offsets', 'synset_sense_keys',
+                   'hypernym_offsets', 'hypernyms', 'hyponym_offsets', 'hyponyms', 'sense_synsets',
+                   'item_synset_offsets', 'item_synsets', 'synset_sense_items', 'item_monosemous']
+
+
+def get_inventory_key(lemma, pos):
+    return '%s.%s' % (lemma.lower(), pos)
+
+
+def get_synset_key(pos, offset):
+    return POS_CODES[pos] * 100000000 + offset
+
+
+def gather(offsets, values, nodes):
+    # Concatenation of the rows values[offsets[node]:offsets[node+1]] of all the nodes
+    starts = offsets[nodes]
+    lengths = offsets[nodes+1] - starts
+    if len(lengths) == 0:
+        return values[:0]
+    return values[np.arange(lengths.sum()) + np.repeat(starts - (np.cumsum(lengths) - lengths), lengths)]
+
+
+class WordNetSenseInventory:
+    '''
+    Sense inventory computed from a NLTK WordNetCorpusReader, memoized by lemma.pos
+    '''
+    def __init__(self, wn_reader):
+        self.wn_reader = wn_reader
+        self.senses_for_key = {}
+        self.monosemous_for_key = {}
+
+    def get_senses(self, lemma, pos):
+        # Tuple of (sense_key, num_sense, synset_offset) with the offset as a string of 8 digits
+        key = (lemma, pos)
+        senses = self.senses_for_key.get(key)
+        if senses is None:
+            lemmas = self.wn_reader.lemmas(lemma, pos=pos)
+            senses = tuple((l.key(), int_sense, '%08d' % l.synset().offset()) for int_sense, l in enumerate(lemmas, 1))
+            self.senses_for_key[key] = senses
+        return senses
+
+    def is_monosemous(self, lemma, pos):
+        key = (lemma, pos)
+        monosemous = self.monosemous_for_key.get(key)
+        if monosemous is None:
+            monosemous = len(self.wn_reader.synsets(lemma, pos=pos)) == 1
+            self.monosemous_for_key[key] = monosemous
+        return monosemous
+
+    def get_sense_keys(self, lemma, pos):
+        return [sense_key for sense_key, num_sense, synset_offset in self.get_senses(lemma, pos)]
+
+    def get_first_sense(self, lemma, pos):
+        # Sense key of the first sense, None if the lemma is not in WordNet
+        senses = self.get_senses(lemma, pos)
+        if len(senses) == 0:
+            return None
+        return senses[0][0]
+
+    def has_relations(self):
+        return False
+
+    def has_expansion_tables(self):
+        return False
+
+    def get_wn_reader(self):
+        return self.wn_reader
+
+
+class SenseInventory(WordNetSenseInventory):
+    '''
+    Sense inventory read from a file created by write_sense_inventory. The lemmas
+    that are not in the file (or with a pos that is not in INVENTORY_POS) are
+    asked to the fallback inventory if there is one
+    '''
+    def __init__(self, filename, fallback=None):
+        self.filename = filename
+        self.fallback = fallback
+        self.senses_for_key = {}
+        self.monosemous_for_key = {}
+        self.item_for_key = {}
+        self.strings = {}
+        self.string_objects = None
+        fd = open(filename, 'rb')
+        try:
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+        self.buffer = memoryview(self.mmap)
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a sense inventory file' % filename)
+        header_length = struct.unpack('<I', self.buffer[len(MAGIC):len(MAGIC)+4])[0]
+        self.header = json.loads(bytes(self.buffer[len(MAGIC)+4:len(MAGIC)+4+header_length]).decode('utf-8'))
+        if self.header['version'] not in SUPPORTED_VERSIONS:
+            raise ValueError('Version %s of sense inventory file %s not supported' % (self.header['version'], filename))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError('The sense inventory file %s was created in a %s-endian machine' % (filename, self.header['byteorder']))
+        for name, (offset, typecode, length) in self.header['arrays'].items():
+            itemsize = array(typecode).itemsize
+            setattr(self, name, self.buffer[offset:offset + length * itemsize].cast(typecode))
+        for name in RELATION_ARRAYS:
+            if name in self.header['arrays']:
+                setattr(self, name, np.frombuffer(getattr(self, name), dtype=self.header['arrays'][name][1]))
+
+    def __len__(self):
+        return len(self.item_keys)
+
+    def get_string(self, string_id):
+        this_string = self.strings.get(string_id)
+        if this_string is None:
+            this_string = bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id+1]]).decode('utf-8')
+            self.strings[string_id] = this_string
+        return this_string
+
+    def __get_string_bytes(self, string_id):
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id+1]])
+
+    def find_item(self, lemma, pos):
+        # Number of the item lemma.pos, -1 if it is not in the inventory
+        num_item = self.item_for_key.get((lemma, pos))
+        if num_item is None:
+            num_item = self.__search_item(get_inventory_key(lemma, pos).encode('utf-8'))
+            self.item_for_key[(lemma, pos)] = num_item
+        return num_item
+
+    def __search_item(self, key):
+        # Binary search of the item keys, sorted by their UTF-8 bytes
+        low, high = 0, len(self.item_keys)
+        while low < high:
+            middle = (low + high) // 2
+            if self.__get_string_bytes(self.item_keys[middle]) < key:
+                low = middle + 1
+            else:
+                high = middle
+        if low < len(self.item_keys) and self.__get_string_bytes(self.item_keys[low]) == key:
+            return low
+        return -1
+
+    def __is_missing(self, lemma, pos):
+        return pos not in INVENTORY_POS or self.find_item(lemma, pos) == -1
+
+    def get_senses(self, lemma, pos):
+        key = (lemma, pos)
+        senses = self.senses_for_key.get(key)
+        if senses is None:
+            if pos is None and self.fallback is None:
+                senses = tuple(sense for this_pos in INVENTORY_POS for sense in self.get_senses(lemma, this_pos))
+            elif self.fallback is not None and self.__is_missing(lemma, pos):
+                senses = self.fallback.get_senses(lemma, pos)
+            else:
+                num_item = self.find_item(lemma, pos) if pos in INVENTORY_POS else -1
+                senses = ()
+                if num_item != -1:
+                    start, end = self.item_sense_offsets[num_item], self.item_sense_offsets[num_item+1]
+                    senses = tuple((self.get_string(sense_key), int_sense, '%08d' % synset_offset)
+                                   for int_sense, (sense_key, synset_offset) in enumerate(zip(self.sense_keys[start:end], self.synset_offsets[start:end]), 1))
+            self.senses_for_key[key] = senses
+        return senses
+
+    def is_monosemous(self, lemma, pos):
+        key = (lemma, pos)
+        monosemous = self.monosemous_for_key.get(key)
+        if monosemous is None:
+            if self.fallback is not None and self.__is_missing(lemma, pos):
+                monosemous = self.fallback.is_monosemous(lemma, pos)
+            else:
+                num_item = self.find_item(lemma, pos) if pos in INVENTORY_POS else -1
+                monosemous = num_item != -1 and self.item_monosemous[num_item] == 1
+            self.monosemous_for_key[key] = monosemous
+        return monosemous
+
+    def has_relations(self):
+        return 'synset_keys' in self.header['arrays']
+
+    def has_expansion_tables(self):
+        return 'item_synsets' in self.header['arrays']
+
+    def get_wn_reader(self):
+        # NLTK reader of the fallback inventory, None if there is not one
+        if self.fallback is None:
+            return None
+        return self.fallback.get_wn_reader()
+
+    def find_synset(self, pos, offset):
+        # Number of the synset with the pos and offset (int or string), -1 if it is not in the inventory
+        if not self.has_relations():
+            raise ValueError('The sense inventory %s has no relations, create it again with wn_to_sense_inventory.py' % self.filename)
+        key = get_synset_key(pos, int(offset))
+        num_synset = int(np.searchsorted(self.synset_keys, key))
+        if num_synset < len(self.synset_keys) and self.synset_keys[num_synset] == key:
+            return num_synset
+        return -1
+
+    def get_sense_synsets(self, lemma, pos):
+        # Numbers of the synsets of the senses of lemma.pos (as in get_senses), empty if it is not in the inventory
+        num_item = self.find_item(lemma, pos) if pos in INVENTORY_POS else -1
+        if num_item == -1:
+            return self.sense_synsets[:0]
+        return self.sense_synsets[self.item_sense_offsets[num_item]:self.item_sense_offsets[num_item+1]]
+
+    def get_depth(self, num_synset):
+        # min_depth of the synset in NLTK (counting the instance hypernyms)
+        return int(self.synset_depths[num_synset])
+
+    def get_sense_key_ids(self, synsets):
+        # String ids of the sense keys of the synsets (array of numbers, repeated or not), every sense
+        # key is in only one synset so there are no repeated ids
+        return gather(self.synset_sense_offsets, self.synset_sense_keys, np.unique(synsets))
+
+    def get_sense_key_strings(self, string_ids):
+        # Set of the strings, they are decoded only the first time and kept in an array of objects
+        if self.string_objects is None:
+            self.string_objects = np.empty(len(self.string_offsets) - 1, dtype=object)
+            self.decoded = np.zeros(len(self.string_offsets) - 1, dtype=bool)
+        missing = string_ids[~self.decoded[string_ids]]
+        for string_id in missing.tolist():
+            self.string_objects[string_id] = self.get_string(string_id)
+        self.decoded[missing] = True
+        return set(self.string_objects[string_ids].tolist())
+
+    def get_co_sensekeys(self, num_synset, main_sensekey=None):
+        # Same as sensekey_utils.get_co_sensekeys
+        co_sensekeys = self.get_sense_key_strings(self.get_sense_key_ids(np.array([num_synset])))
+        co_sensekeys.discard(main_sensekey)
+        return co_sensekeys
+
+    def get_cohyponyms(self, synsets):
+        # Hyponyms of the hypernyms of the synsets (repeated, including the synsets themselves)
+        return gather(self.hyponym_offsets, self.hyponyms, gather(self.hypernym_offsets, self.hypernyms, synsets))
+
+    def get_cohypo_sensekeys(self, num_synset):
+        # Same as sensekey_utils.get_cohypo_sensekeys
+        synsets = np.array([num_synset])
+        cohyponyms = self.get_cohyponyms(synsets)
+        cohyponyms = cohyponyms[cohyponyms != num_synset]
+        string_ids = np.setdiff1d(self.get_sense_key_ids(cohyponyms), self.get_sense_key_ids(synsets), assume_unique=True)
+        return self.get_sense_key_strings(string_ids)
+
+    def get_hyponym_closure(self, synsets, max_depth=None):
+        # Synsets reached from the synsets following the hyponyms, in at most max_depth levels (all if None).
+        # Every synset is expanded only once, at its first level
+        visited = np.zeros(len(self.synset_keys), dtype=bool)
+        visited[synsets] = True
+        frontier = np.unique(synsets)
+        reached = []
+        level = 1
+        while len(frontier) != 0 and (max_depth is None or level <= max_depth):
+            hyponyms = np.unique(gather(self.hyponym_offsets, self.hyponyms, frontier))
+            reached.append(hyponyms)
+            frontier = hyponyms[~visited[hyponyms]]
+            visited[frontier] = True
+            level += 1
+        if len(reached) == 0:
+            return np.array([], dtype=self.hyponyms.dtype)
+        return np.unique(np.concatenate(reached))
+
+    def get_hyponym_sensekeys(self, num_synset, depth_synset=None, max_depth_from_synset=None):
+        # Same as sensekey_utils.hyponym_sensekeys
+        if depth_synset and self.get_depth(num_synset) < depth_synset:
+            return set()
+        hyponyms = self.get_hyponym_closure(np.array([num_synset]), max_depth_from_synset or None)
+        return self.get_sense_key_strings(self.get_sense_key_ids(hyponyms))
+
+    def expand_lemma_pos(self, set_of_lemma_pos, exclude_monosemous=False, cohyponyms=False):
+        # lemma.pos of the sense keys of all the synsets of the seeds (wn.synsets) and, with cohyponyms, of their
+        # cohyponym synsets; without the monosemous ones if exclude_monosemous. Returns the set of (lemma, pos)
+        # and the list of seeds that are not in the inventory
+        if not self.has_expansion_tables():
+            raise ValueError('The sense inventory %s has no expansion tables, create it again with wn_to_sense_inventory.py' % self.filename)
+        items = []
+        missing_seeds = []
+        for lemma, pos in set_of_lemma_pos:
+            num_item = self.find_item(lemma, pos) if pos in INVENTORY_POS else -1
+            if num_item == -1:
+                missing_seeds.append((lemma, pos))
+            else:
+                items.append(num_item)
+        synsets = np.unique(gather(self.item_synset_offsets, self.item_synsets, np.array(items, dtype=np.int64)))
+        if cohyponyms:
+            # The sense keys of the synset itself are always added, so the cohyponyms include it
+            synsets = np.unique(np.concatenate([synsets, self.get_cohyponyms(synsets)]))
+        sense_items = gather(self.synset_sense_offsets, self.synset_sense_items, synsets)
+        sense_ids = gather(self.synset_sense_offsets, self.synset_sense_keys, synsets)
+
+        expanded_lemma_pos = set()
+        found = sense_items != -1
+        result_items = sense_items[found]
+        if exclude_monosemous:
+            result_items = result_items[self.item_monosemous[result_items] == 0]
+        for num_item in np.unique(result_items).tolist():
+            lemma, pos = self.get_string(self.item_keys[num_item]).rsplit('.', 1)
+            expanded_lemma_pos.add((lemma, pos))
+        # The sense keys whose lemma.pos is not an item of the inventory
+        if not found.all():
+            from sensekey_utils import get_lemma_pos_of_sensekey
+            for string_id in sense_ids[~found].tolist():
+                lemma, pos = get_lemma_pos_of_sensekey(self.get_string(string_id))
+                if not exclude_monosemous or not self.is_monosemous(lemma, pos):
+                    expanded_lemma_pos.add((lemma, pos))
+        return expanded_lemma_pos, missing_seeds
+
+
+def write_sense_inventory(wn_reader, filename):
+    # Writes the senses of all the lemmas of WordNet for the pos in INVENTORY_POS and the relations of all
+    # the synsets, returns the number of items
+    strings = StringPool()
+    arrays = {'item_keys': array('i'), 'item_monosemous': array('b'), 'item_sense_offsets': array('i', [0]),
+              'sense_keys': array('i'), 'synset_offsets': array('i'), 'sense_synsets': array('i'),
+              'synset_keys': array('q'), 'synset_depths': array('i'), 'synset_sense_offsets': array('i', [0]),
+              'synset_sense_keys': array('i'), 'hypernym_offsets': array('i', [0]), 'hypernyms': array('i'),
+              'hyponym_offsets': array('i', [0]), 'hyponyms': array('i'),
+              'item_synset_offsets': array('i', [0]), 'item_synsets': array('i'), 'synset_sense_items': array('i')}
+
+    # The synsets, numbered in the order of their keys
+    list_synsets = sorted(wn_reader.all_synsets(), key=lambda synset: get_synset_key(synset.pos(), synset.offset()))
+    number_for_key = {}
+    for num_synset, synset in enumerate(list_synsets):
+        number_for_key[get_synset_key(synset.pos(), synset.offset())] = num_synset
+        arrays['synset_keys'].append(get_synset_key(synset.pos(), synset.offset()))
+    synset_sense_keys = []
+    for synset in list_synsets:
+        arrays['synset_depths'].append(synset.min_depth())
+        synset_sense_keys.extend(l.key() for l in synset.lemmas())
+        arrays['synset_sense_keys'].extend(strings.get_id(l.key()) for l in synset.lemmas())
+        arrays['synset_sense_offsets'].append(len(arrays['synset_sense_keys']))
+        arrays['hypernyms'].extend(number_for_key[get_synset_key(hypernym.pos(), hypernym.offset())] for hypernym in synset.hypernyms())
+        arrays['hypernym_offsets'].append(len(arrays['hypernyms']))
+        arrays['hyponyms'].extend(number_for_key[get_synset_key(hyponym.pos(), hyponym.offset())] for hyponym in synset.hyponyms())
+        arrays['hyponym_offsets'].append(len(arrays['hyponyms']))
+
+    items = []
+    for pos in INVENTORY_POS:
+        for lemma in wn_reader.all_lemma_names(pos=pos):
+            items.append((get_inventory_key(lemma, pos).encode('utf-8'), lemma, pos))
+    items.sort()
+    for key, lemma, pos in items:
+        arrays['item_keys'].append(strings.get_id(key.decode('utf-8')))
+        synsets = wn_reader.synsets(lemma, pos=pos)
+        arrays['item_monosemous'].append(1 if len(synsets) == 1 else 0)
+        arrays['item_synsets'].extend(number_for_key[get_synset_key(synset.pos(), synset.offset())] for synset in synsets)
+        arrays['item_synset_offsets'].append(len(arrays['item_synsets']))
+        for l in wn_reader.lemmas(lemma, pos=pos):
+            arrays['sense_keys'].append(strings.get_id(l.key()))
+            arrays['synset_offsets'].append(l.synset().offset())
+            arrays['sense_synsets'].append(number_for_key[get_synset_key(l.synset().pos(), l.synset().offset())])
+        arrays['item_sense_offsets'].append(len(arrays['sense_keys']))
+
+    # The item of the lemma.pos of every sense key of the synsets, -1 if it is not in the inventory
+    from sensekey_utils import get_lemma_pos_of_sensekey
+    number_for_item_key = {key.decode('utf-8'): num_item for num_item, (key, lemma, pos) in enumerate(items)}
+    for sensekey in synset_sense_keys:
+        lemma, pos = get_lemma_pos_of_sensekey(sensekey)
+        arrays['synset_sense_items'].append(number_for_item_key.get(get_inventory_key(lemma, pos), -1))
+
+    arrays['string_offsets'] = strings.offsets
+    arrays['string_data'] = array('B', bytes(strings.data))
+
+    header = {'version': VERSION,
+              'byteorder': sys.byteorder,
+              'wordnet_version': str(wn_reader.get_version()),
+              'num_items': len(items),
+              'num_synsets': len(list_synsets),
+              'arrays': {}}
+    header_length = 0
+    while True:
+        position = align(len(MAGIC) + 4 + header_length)
+        for name in sorted(arrays):
+            header['arrays'][name] = [position, arrays[name].typecode, len(arrays[name])]
+            position = align(position + len(arrays[name]) * arrays[name].itemsize)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(header_bytes) <= header_length:
+            break
+        header_length = len(header_bytes) + 64
+    header_bytes = header_bytes + b' ' * (header_length - len(header_bytes))
+
+    fd = open(filename, 'wb')
+    fd.write(MAGIC)
+    fd.write(struct.pack('<I', header_length))
+    fd.write(header_bytes)
+    for name in sorted(arrays):
+        fd.write(b'\0' * (header['arrays'][name][0] - fd.tell()))
+        arrays[name].tofile(fd)
+    fd.close()
+    return len(items)
+
+
+def is_sense_inventory_file(path):
+    try:
+        fd = open(path, 'rb')
+    except (IOError, OSError):
+        return False
+    magic = fd.read(len(MAGIC))
+    fd.close()
+    return magic == MAGIC
+
+
+# Sense inventory file used by as_sense_inventory for the NLTK readers, and the inventories already created
+sense_inventory_filename = None
+inventory_for_reader = {}
+opened_inventories = {}
+
+def set_sense_inventory_file(filename):
+    global sense_inventory_filename
+    sense_inventory_filename = filename
+    inventory_for_reader.clear()
+
+
+def as_sense_inventory(wn):
+    # Memoized inventory for wn: wn itself if it is already an inventory, otherwise the one for the NLTK reader,
+    # read from the file set with set_sense_inventory_file (with the reader for the lemmas not in the file)
+    if wn is None or isinstance(wn, WordNetSenseInventory):
+        return wn
+    reader_and_inventory = inventory_for_reader.get(id(wn))
+    if reader_and_inventory is None:
+        inventory = WordNetSenseInventory(wn)
+        if sense_inventory_filename is not None:
+            inventory = SenseInventory(sense_inventory_filename, fallback=inventory)
+        # The reader is kept so that its id is not reused
+        reader_and_inventory = (wn, inventory)
+        inventory_for_reader[id(wn)] = reader_and_inventory
+    return reader_and_inventory[1]
+
+
+def get_sense_inventory(path):
+    # Memoized inventory of a sense inventory file or of a WordNet dict folder (loaded with NLTK)
+    if path not in opened_inventories:
+        if is_sense_inventory_file(path):
+            opened_inventories[path] = SenseInventory(path)
+        else:
+            from nltk.corpus import WordNetCorpusReader
+            opened_inventories[path] = as_sense_inventory(WordNetCorpusReader(path, None))
+    return opened_inventories[path]
@@ -22,6 +22,9 @@ combinations given this seed set with respect to attributes described in
 """
 from nltk.corpus import wordnet as wn
 
+from my_data_classes import EMPTY_SET
+from sense_inventory import as_sense_inventory
+
 
 def get_lemma_pos_of_sensekey(sense_key):
     """
@@ -64,7 +67,7 @@ def get_monosemous_sensekeys(wn_instance, set_of_sensekeys):
     {'poland%1:15:00::'}
 
     :param nltk.corpus.reader.wordnet.WordNetCorpusReader wn_instance:
-    instance of wordnet in nltk
+    instance of wordnet in nltk (or a sense_inventory.SenseInventory)
     :param set set_of_sensekeys: set of wordnet sensekeys
 
     :rtype: set
@@ -72,11 +75,11 @@ def get_monosemous_sensekeys(wn_instance, set_of_sensekeys):
     of the sensekeys are monosemous in wordnet
     """
     mon_sensekeys = set()
+    inventory = as_sense_inventory(wn_instance)
 
     for sensekey in set_of_sensekeys:
         lemma, pos = get_lemma_pos_of_sensekey(sensekey)
-        synsets = wn_instance.synsets(lemma, pos=pos)
-        if len(synsets) == 1:
+        if inventory.is_monosemous(lemma, pos):
             mon_sensekeys.add(sensekey)
 
     return mon_sensekeys
@@ -225,6 +228,167 @@ def expand_lemma_pos(wn_instance, set_of_lemma_pos, exclude_monosemous=False):
     return expanded_lemma_pos
 
 
+def get_expansion_sensekeys(wn_instance, lemma, pos, cohyponyms=False):
+    """
+    sensekeys used by the expansion of one lemma, pos: the sensekeys of all
+    its synsets and, with cohyponyms, the ones of their cohyponym synsets
+
+    :param nltk.corpus.reader.wordnet.WordNetCorpusReader wn_instance:
+    instance of wordnet in nltk
+    :param bool cohyponyms: add the sensekeys of the cohyponym synsets
+
+    :rtype: set
+    :return: set of sensekeys
+    """
+    sensekeys = set()
+    for synset in wn_instance.synsets(lemma, pos=pos):
+        sensekeys.update(lemma.key() for lemma in synset.lemmas())
+        if cohyponyms:
+            sensekeys.update(get_cohypo_sensekeys(synset))
+    return sensekeys
+
+
+def expand_lemma_pos_batch(wn_instance, set_of_lemma_pos, exclude_monosemous=False,
+                           cohyponyms=False, hops=1):
+    """
+    same expansion as expand_lemma_pos, done for all the seeds at once with
+    the tables of the sense inventory (see sense_inventory.py) if wn_instance
+    is one or if it has been set with set_sense_inventory_file. The seeds
+    that are not in the sense inventory are expanded with nltk
+
+    >>> expand_lemma_pos_batch(wn, {('cat', 'n')}) == expand_lemma_pos(wn, {('cat', 'n')})
+    True
+
+    :param nltk.corpus.reader.wordnet.WordNetCorpusReader wn_instance:
+    instance of wordnet in nltk (or a sense_inventory.SenseInventory)
+    :param set set_of_lemma_pos: set of tuples (lemma, pos)
+    :param bool exclude_monosemous: the lemma, pos of the monosemous
+    sensekeys are not added
+    :param bool cohyponyms: also add the lemma, pos of the sensekeys in the
+    cohyponym synsets
+    :param int hops: number of times that the expansion is applied, the
+    lemma, pos added in one hop are the seeds of the next one
+
+    :rtype: set
+    :return: set of lemma pos combinations
+    """
+    inventory = as_sense_inventory(wn_instance)
+    wn_reader = inventory.get_wn_reader()
+    expanded_lemma_pos = set(set_of_lemma_pos)
+    seeds = set(set_of_lemma_pos)
+
+    for hop in range(hops):
+        if inventory.has_expansion_tables():
+            new_lemma_pos, missing_seeds = inventory.expand_lemma_pos(seeds,
+                                                                      exclude_monosemous=exclude_monosemous,
+                                                                      cohyponyms=cohyponyms)
+        else:
+            new_lemma_pos, missing_seeds = set(), seeds
+
+        if wn_reader is not None:
+            sensekeys = set()
+            for lemma, pos in missing_seeds:
+                sensekeys.update(get_expansion_sensekeys(wn_reader, lemma, pos,
+                                                         cohyponyms=cohyponyms))
+            if exclude_monosemous:
+                sensekeys -= get_monosemous_sensekeys(inventory, sensekeys)
+            new_lemma_pos.update(get_lemma_pos_of_sensekey(sensekey)
+                                 for sensekey in sensekeys)
+
+        seeds = new_lemma_pos - expanded_lemma_pos
+        expanded_lemma_pos.update(new_lemma_pos)
+        if len(seeds) == 0:
+            break
+
+    return expanded_lemma_pos
+
+
+
+
+class SenseInfoCache:
+    """
+    corpus-wide memo of the sense information of the gold sensekeys: the
+    co_sensekeys, cohyponym sensekeys and their monosemous subsets are
+    computed once per gold sensekey and the same sets are shared by all the
+    instances (of all the lexelts) with that gold sensekey
+
+    :param nltk.corpus.reader.wordnet.WordNetCorpusReader wn_instance:
+    instance of wordnet in nltk
+    """
+    def __init__(self, wn_instance):
+        self.wn_instance = wn_instance
+        self.inventory = as_sense_inventory(wn_instance)
+        self.sense_info_for_key = {}
+        self.sense_info_for_gold_keys = {}
+
+    def get_sense_info(self, wn_pos, synset_offset, sensekey):
+        """
+        :rtype: tuple
+        :return: (cosensekeys, mono_cosensekeys, cohypo_sensekeys,
+        mono_cohypo_sensekeys) of one gold sensekey, as frozensets
+        """
+        key = (wn_pos, synset_offset, sensekey)
+        sense_info = self.sense_info_for_key.get(key)
+        if sense_info is None:
+            num_synset = -1
+            if self.inventory.has_relations():
+                num_synset = self.inventory.find_synset(wn_pos, synset_offset)
+            if num_synset != -1:
+                # From the relation tables of the sense inventory, without NLTK
+                co_sensekeys = self.inventory.get_co_sensekeys(num_synset,
+                                                               main_sensekey=sensekey)
+                co_hypo_sensekeys = self.inventory.get_cohypo_sensekeys(num_synset)
+            else:
+                synset = self.wn_instance._synset_from_pos_and_offset(wn_pos,
+                                                                      int(synset_offset))
+                co_sensekeys = get_co_sensekeys(synset, main_sensekey=sensekey)
+                co_hypo_sensekeys = get_cohypo_sensekeys(synset)
+            sense_info = tuple(shared_set(keys) for keys in
+                               [co_sensekeys,
+                                get_monosemous_sensekeys(self.wn_instance, co_sensekeys),
+                                co_hypo_sensekeys,
+                                get_monosemous_sensekeys(self.wn_instance, co_hypo_sensekeys)])
+            self.sense_info_for_key[key] = sense_info
+        return sense_info
+
+    def get_sense_info_for_gold_keys(self, wn_pos, gold_senses):
+        """
+        :param list gold_senses: list of (sensekey, synset_offset) of
+        the gold sensekeys of an instance
+
+        :rtype: tuple
+        :return: union of the sense information of the gold sensekeys
+        """
+        key = (wn_pos, tuple(gold_senses))
+        sense_info = self.sense_info_for_gold_keys.get(key)
+        if sense_info is None:
+            list_sense_info = [self.get_sense_info(wn_pos, synset_offset, sensekey)
+                               for sensekey, synset_offset in gold_senses]
+            if len(list_sense_info) == 1:
+                sense_info = list_sense_info[0]
+            else:
+                sense_info = tuple(shared_set(frozenset().union(*[this_info[num_set] for this_info in list_sense_info]))
+                                   for num_set in range(4))
+            self.sense_info_for_gold_keys[key] = sense_info
+        return sense_info
+
+
+def shared_set(keys):
+    # The empty sets are the shared default of Cinstance
+    if len(keys) == 0:
+        return EMPTY_SET
+    return frozenset(keys)
+
+
+# SenseInfoCache of every wordnet reader, kept for all the lexelts of the process
+sense_info_caches = {}
+
+def get_sense_info_cache(wn_instance):
+    reader_and_cache = sense_info_caches.get(id(wn_instance))
+    if reader_and_cache is None:
+        reader_and_cache = (wn_instance, SenseInfoCache(wn_instance))
+        sense_info_caches[id(wn_instance)] = reader_and_cache
+    return reader_and_cache[1]
 
 
 def add_sense_info_to_clexelt(c_lexelt_obj,
@@ -254,6 +418,10 @@ def add_sense_info_to_clexelt(c_lexelt_obj,
     # that are cohyponyms of the gold synset
     4. mono_cohypo_sensekeys
 
+    the sets are computed once per gold sensekey (see SenseInfoCache) and
+    shared by the instances, as frozensets. Cinstance.get_mutable_set copies
+    the set of an instance that has to be modified
+
     :param my_data_classes.Clexelt c_lexelt_obj: class instance defined in
     my_data_classes.Clexelt representing a lemma, pos combination
     with all training instance for this lemma, pos
@@ -268,34 +436,21 @@ def add_sense_info_to_clexelt(c_lexelt_obj,
     for each training instance
     """
     gold_wn_pos = c_lexelt_obj.get_nltk_wn_pos()
+    cache = get_sense_info_cache(wn_instance)
  
     for c_instance in c_lexelt_obj.instances:
 
         gold_keys = c_instance.lexkeys
 
-        keys_synsets = {}
-        for sensekey, c_sense_obj in c_lexelt_obj.wn_possible_senses.items():
-            if sensekey in gold_keys:
-                offset = c_sense_obj.synset_offset
-                synset = wn_instance._synset_from_pos_and_offset(gold_wn_pos,
-                                                            int(offset))
-                keys_synsets[sensekey] = synset
-
-
-        all_co_sensekeys = {co_sensekey
-                    for gold_key, gold_synset in keys_synsets.items()
-                    for co_sensekey in get_co_sensekeys(gold_synset,
-                                                        main_sensekey=gold_key)}
-        mon_co_sensekeys = get_monosemous_sensekeys(wn_instance,
-                                                    all_co_sensekeys)
-
-        all_co_hypo_sensekeys = {co_hypo_sensekey
-                            for gold_key, gold_synset in keys_synsets.items()
-                            for co_hypo_sensekey in
-                            get_cohypo_sensekeys(gold_synset)}
-
-        mon_co_hypo_sensekeys = get_monosemous_sensekeys(wn_instance,
-                                                         all_co_hypo_sensekeys)
+        gold_senses = [(sensekey, c_sense_obj.synset_offset)
+                       for sensekey, c_sense_obj in c_lexelt_obj.wn_possible_senses.items()
+                       if sensekey in gold_keys]
+
+        (all_co_sensekeys,
+         mon_co_sensekeys,
+         all_co_hypo_sensekeys,
+         mon_co_hypo_sensekeys) = cache.get_sense_info_for_gold_keys(gold_wn_pos,
+                                                                      gold_senses)
 
         # update attributes
         c_instance.cosensekeys = all_co_sensekeys
@@ -1,43 +1,248 @@
 #!/usr/bin/env python
 
+import argparse
+import hashlib
 import os
 import shutil
+import subprocess
+import sys
+import time
+from multiprocessing import Pool
 
-from python_mods import SVMClassifier, FEATURE_FILENAME
+from python_mods import SVMClassifier, FEATURE_FILENAME, MODEL_FILENAME, INDEX__FILENAME, INDEX_CLASS_FILENAME, TRAINING_BASE_FILENAME
+from python_mods.svm_backends import get_backend
+from ulm_archive import open_lexelt_from, get_lexelt_size, get_lexelt_digest, get_file_digest, LEXELT_DIGEST_SIZE
 
+SUMMARY_FILENAME = 'training_summary.tsv'
+# One line per trained lemma.pos with the digests of its training data, the feature config and the
+# SVM parameters, the models of the lines that match the current ones are not trained again with --incremental
+MANIFEST_FILENAME = 'training_manifest.tsv'
+# Every lemma.pos is trained in the folder <model_folder>/.training.<lemma_pos> and its files are renamed
+# to the model folder when the training is done, so the model folder never has half written models
+TEMP_FOLDER_PREFIX = '.training.'
 
-def train_classifiers(path_to_bin_files, file_lemmas,model_folder, config_file):
-    if os.path.exists(model_folder):
+
+def get_params_digest(backend):
+    params = get_backend(backend).get_training_params()
+    return hashlib.blake2b(repr(sorted(params.items())).encode('utf-8'), digest_size=LEXELT_DIGEST_SIZE).hexdigest()
+
+
+def move_model_files(temp_folder, model_folder):
+    # The model file is renamed the last one, a model file always has its indexes in the folder
+    for filename in sorted(os.listdir(temp_folder), key=lambda filename: filename.endswith(MODEL_FILENAME)):
+        os.replace(os.path.join(temp_folder, filename), os.path.join(model_folder, filename))
+    os.rmdir(temp_folder)
+
+
+def remove_temp_folders(model_folder):
+    # Left by an interrupted run or by the lemma.pos that failed
+    for filename in os.listdir(model_folder):
+        if filename.startswith(TEMP_FOLDER_PREFIX):
+            shutil.rmtree(os.path.join(model_folder, filename))
+
+
+def load_manifest(manifest_filename):
+    # {lemma_pos: (fingerprint, instances)}, the fingerprint is the tuple (data, config, params digests)
+    entry_for_lemma_pos = {}
+    if not os.path.exists(manifest_filename):
+        return entry_for_lemma_pos
+    fd = open(manifest_filename)
+    for line in fd:
+        fields = line.rstrip('\n').split('\t')
+        # The header and the last line if it was cut by an interrupted run
+        if not line.endswith('\n') or len(fields) != 5 or not fields[4].isdigit():
+            continue
+        entry_for_lemma_pos[fields[0]] = (tuple(fields[1:4]), int(fields[4]))
+    fd.close()
+    return entry_for_lemma_pos
+
+
+def write_manifest_entry(fd, lemma_pos, fingerprint, instances):
+    fd.write('%s\t%s\t%s\t%s\t%d\n' % ((lemma_pos,) + tuple(fingerprint) + (instances,)))
+
+
+def save_manifest(entry_for_lemma_pos, manifest_filename):
+    fd = open(manifest_filename + '.tmp', 'w')
+    fd.write('lemma_pos\tdata_digest\tconfig_digest\tparams_digest\tinstances\n')
+    for lemma_pos, (fingerprint, instances) in sorted(entry_for_lemma_pos.items()):
+        write_manifest_entry(fd, lemma_pos, fingerprint, instances)
+    fd.close()
+    os.replace(manifest_filename + '.tmp', manifest_filename)
+
+
+def is_up_to_date(entry, fingerprint, model_folder, lemma_pos):
+    if entry is None or entry[0] != fingerprint:
+        return False
+    return os.path.exists(os.path.join(model_folder, '%s.%s' % (lemma_pos.lower(), MODEL_FILENAME)))
+
+
+def remove_model_files(model_folder, lemma_pos):
+    # Removes the model of the lemma.pos (the model file first, as move_model_files renames it the last one),
+    # returns True if there was a model
+    had_model = False
+    for suffix in (MODEL_FILENAME, MODEL_FILENAME + '.log', INDEX__FILENAME, INDEX_CLASS_FILENAME, TRAINING_BASE_FILENAME):
+        filename = os.path.join(model_folder, '%s.%s' % (lemma_pos.lower(), suffix))
+        if os.path.exists(filename):
+            os.remove(filename)
+            had_model = had_model or suffix == MODEL_FILENAME
+    return had_model
+
+
+def train_one_lemma(task):
+    # Runs in the worker processes, returns the summary for one lemma.pos
+    lemma_pos, path_to_bin_files, config_file, model_folder, backend, feature_cache, data_digest = task
+    summary = {'lemma_pos': lemma_pos, 'instances': 0, 'exit_code': None, 'time': 0.0, 'error': None, 'up_to_date': False, 'old_model_removed': False}
+    start_time = time.time()
+    print('Training classifier for %s' % lemma_pos)
+    print('\tTraining data: %s' % path_to_bin_files)
+    try:
+        lexelt = open_lexelt_from(path_to_bin_files, lemma_pos)
+    except Exception as e:
+        # A lexelt file that can not be read is a failed lemma.pos, the other ones are still trained
+        summary['exit_code'] = -1
+        summary['error'] = 'Can not read the lexelt: %s: %s' % (type(e).__name__, e)
+        lexelt = None
+    if lexelt is not None:
+        my_classifier = SVMClassifier(backend, feature_cache=feature_cache)
+        temp_folder = os.path.join(model_folder, TEMP_FOLDER_PREFIX + lemma_pos)
+        try:
+            summary['exit_code'] = my_classifier.train(lexelt,config_file,temp_folder,lexelt_digest=data_digest)
+            if summary['exit_code'] == 0:
+                move_model_files(temp_folder, model_folder)
+        except subprocess.CalledProcessError as e:
+            summary['exit_code'] = e.returncode
+            summary['error'] = str(e)
+        except Exception as e:
+            summary['exit_code'] = -1
+            summary['error'] = '%s: %s' % (type(e).__name__, e)
+        summary['instances'] = my_classifier.num_training_instances
+    elif summary['error'] is None:
+        print('\tThere is no bin file for %s, nothing trained' % lemma_pos)
+    summary['time'] = time.time() - start_time
+    sys.stdout.flush()
+    return summary
+
+
+def train_classifiers(path_to_bin_files, file_lemmas,model_folder, config_file, jobs=1, backend=None, incremental=False, feature_cache=None):
+    # With incremental the model folder is kept and only the lemma.pos whose training data, feature config
+    # or SVM parameters changed since they were trained (or that were not trained) are trained again
+    # feature_cache is the folder of the cache of extracted features shared by all the trainings (see python_mods/feature_cache.py)
+    if os.path.exists(model_folder) and not incremental:
         shutil.rmtree(model_folder)
-    os.mkdir(model_folder)
-    
+    if not os.path.exists(model_folder):
+        os.mkdir(model_folder)
+    remove_temp_folders(model_folder)
+
+    #Save the selected feature file, before the models that use it
+    this_feature_filename = os.path.join(model_folder,FEATURE_FILENAME)
+    shutil.copy(config_file, this_feature_filename + '.tmp')
+    os.replace(this_feature_filename + '.tmp', this_feature_filename)
+
+    manifest_filename = os.path.join(model_folder,MANIFEST_FILENAME)
+    entry_for_lemma_pos = load_manifest(manifest_filename)
+    config_digest = get_file_digest(config_file)
+    params_digest = get_params_digest(backend)
+
+    tasks = []
+    summary_for_lemma_pos = {}
+    fingerprint_for_lemma_pos = {}
+    removed_old_models = set()
     fd = open(file_lemmas)
     for line in fd:
         lemma_pos = line.strip()
-        print('Training classifier for %s' % lemma_pos)
-        bin_file = '%s/%s.bin' % (path_to_bin_files,lemma_pos)
-        print('\tBinary file: %s' % bin_file)
-        if os.path.exists(bin_file):
-            my_classifier = SVMClassifier()
-            my_classifier.train(bin_file,config_file,model_folder)
+        if len(lemma_pos) == 0:
+            continue
+        data_digest = get_lexelt_digest(path_to_bin_files, lemma_pos)
+        fingerprint = (data_digest or '-', config_digest, params_digest)
+        fingerprint_for_lemma_pos[lemma_pos] = fingerprint
+        entry = entry_for_lemma_pos.get(lemma_pos)
+        if is_up_to_date(entry, fingerprint, model_folder, lemma_pos):
+            summary_for_lemma_pos[lemma_pos] = {'lemma_pos': lemma_pos, 'instances': entry[1], 'exit_code': 0, 'time': 0.0, 'error': None, 'up_to_date': True, 'old_model_removed': False}
         else:
-            print('\tThere is no bin file for %s, nothing trained' % lemma_pos)
+            entry_for_lemma_pos.pop(lemma_pos, None)
+            # The model trained with the old data, config or parameters is removed before training, so if the
+            # training fails or the lexelt does not exist anymore the lemma.pos has no model instead of a stale one
+            if remove_model_files(model_folder, lemma_pos):
+                removed_old_models.add(lemma_pos)
+            tasks.append((lemma_pos, path_to_bin_files, config_file, model_folder, backend, feature_cache, data_digest))
     fd.close()
-    
-    #Save the selected feature file
-    this_feature_filename = os.path.join(model_folder,FEATURE_FILENAME)
-    shutil.copy(config_file, this_feature_filename) 
-    
+    # The lemma.pos that are trained again are removed from the manifest before starting, so if the run is
+    # interrupted they are still out of date in the next one
+    save_manifest(entry_for_lemma_pos, manifest_filename)
+    if incremental:
+        print('%d lemma.pos up to date, %d to train' % (len(summary_for_lemma_pos), len(tasks)))
+
+    # The biggest lexelts first, so one long item does not run alone at the end
+    if jobs > 1:
+        tasks.sort(key=lambda task: -get_lexelt_size(path_to_bin_files, task[0]))
+
+    if jobs > 1:
+        pool = Pool(jobs)
+        results = pool.imap_unordered(train_one_lemma, tasks, chunksize=1)
+    else:
+        pool = None
+        results = map(train_one_lemma, tasks)
+    # Every trained lemma.pos is added to the manifest as soon as its model is in the model folder
+    fd_manifest = open(manifest_filename, 'a')
+    for num_done, summary in enumerate(results, 1):
+        lemma_pos = summary['lemma_pos']
+        summary['old_model_removed'] = lemma_pos in removed_old_models
+        summary_for_lemma_pos[lemma_pos] = summary
+        print('[%d/%d] %s: %d instances, exit code %s, %.1f seconds' % (num_done, len(tasks), lemma_pos, summary['instances'], summary['exit_code'], summary['time']))
+        if summary['error'] is not None:
+            print('\tError: %s' % summary['error'], file=sys.stderr)
+        if summary['exit_code'] != 0 and summary['old_model_removed']:
+            print('\tThe old model of %s was removed, it has no model now' % lemma_pos, file=sys.stderr)
+        if summary['exit_code'] == 0:
+            entry_for_lemma_pos[lemma_pos] = (fingerprint_for_lemma_pos[lemma_pos], summary['instances'])
+            write_manifest_entry(fd_manifest, lemma_pos, fingerprint_for_lemma_pos[lemma_pos], summary['instances'])
+            fd_manifest.flush()
+    fd_manifest.close()
+    if pool is not None:
+        pool.close()
+        pool.join()
+
+    save_manifest(entry_for_lemma_pos, manifest_filename)
+    save_summary(summary_for_lemma_pos, os.path.join(model_folder,SUMMARY_FILENAME))
+    return summary_for_lemma_pos
+
+
+def save_summary(summary_for_lemma_pos, summary_filename):
+    fd = open(summary_filename,'w')
+    fd.write('lemma_pos\tinstances\texit_code\tseconds\told_model_removed\n')
+    for lemma_pos, summary in sorted(summary_for_lemma_pos.items()):
+        # old_model_removed is 1 when the previous model was removed and no new one could be trained
+        old_model_removed = summary['old_model_removed'] and summary['exit_code'] != 0
+        fd.write('%s\t%d\t%s\t%.2f\t%d\n' % (lemma_pos, summary['instances'], summary['exit_code'], summary['time'], old_model_removed))
+    fd.close()
+
 
 if __name__ == '__main__':
-    file_with_lemma_pos = 'sem2013.lemma_pos.list'
-    config_file = 'feature_files/file_3.xml'
-    path_to_bin_files='data/semcor30_ulm/'
+    parser = argparse.ArgumentParser(description='Trains one classifier for every lemma.pos in the list')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-l', dest='lemma_list', default='sem2013.lemma_pos.list', help='File with one lemma.pos per line')
+    parser.add_argument('-c', dest='config_file', default='feature_files/file_3.xml', help='XML feature definition file')
+    parser.add_argument('-i', dest='path_to_bin_files', default='data/semcor30_ulm/', help='Folder with the training data in ULM format or ULM archive')
     #path_to_bin_files='./data/semcor30_pwgc_ulm'
     #path_to_bin_files='/home/rbevia/wsd_lfs/data/experiments/Bps'
-    
-    model_folder=path_to_bin_files+'/models'
-    
-    
-    train_classifiers(path_to_bin_files, file_with_lemma_pos,model_folder,config_file)
-    print('Models created in %s' % model_folder)
\ No newline at end of file
+    parser.add_argument('-o', dest='model_folder', default=None, help='Output folder for the models (default: <input folder>/models)')
+    parser.add_argument('-j', '--jobs', dest='jobs', type=int, default=1, help='Number of lemmas trained in parallel')
+    parser.add_argument('-b', '--backend', dest='backend', default=None, help='SVM backend (svmlight or linear)')
+    parser.add_argument('--incremental', dest='incremental', action='store_true', help='Keep the model folder and only train the lemma.pos whose training data, feature file or SVM parameters changed (see %s in the model folder)' % MANIFEST_FILENAME)
+    parser.add_argument('--feature-cache', dest='feature_cache', default=None, help='Folder of the cache of extracted features, shared by the runs with different feature files or SVM parameters')
+    args = parser.parse_args()
+
+    model_folder = args.model_folder
+    if model_folder is None:
+        model_folder = args.path_to_bin_files+'/models'
+
+    summary_for_lemma_pos = train_classifiers(args.path_to_bin_files, args.lemma_list, model_folder, args.config_file, jobs=args.jobs, backend=args.backend, incremental=args.incremental, feature_cache=args.feature_cache)
+    num_failed = len([summary for summary in summary_for_lemma_pos.values() if summary['exit_code'] not in (0, None)])
+    num_missing = len([summary for summary in summary_for_lemma_pos.values() if summary['exit_code'] is None])
+    num_up_to_date = len([summary for summary in summary_for_lemma_pos.values() if summary['up_to_date']])
+    num_removed = len([summary for summary in summary_for_lemma_pos.values() if summary['old_model_removed'] and summary['exit_code'] != 0])
+    print('Trained: %d  Up to date: %d  Failed: %d  Without bin file: %d' % (len(summary_for_lemma_pos)-num_failed-num_missing-num_up_to_date, num_up_to_date, num_failed, num_missing))
+    if num_removed != 0:
+        print('Old models removed without a new one (failed or without bin file): %d' % num_removed)
+    print('Summary of the training in %s' % os.path.join(model_folder,SUMMARY_FILENAME))
+    print('Models created in %s' % model_folder)
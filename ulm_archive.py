@@ -0,0 +1,229 @@
+#!/usr/bin/env python
+
+'''
+ULM archive: all the lexelts of a ULM folder packed in one data file plus an
+index, so the tools open two files instead of one file per lemma.pos.
+
+  <archive>        'ULMA' | padding | lexelt | padding | lexelt ...
+  <archive>.idx    one line per lexelt: item_key, offset, length, instances
+
+Every lexelt is stored in ULM v2 format (see ulm_v2.py) at an 8-byte aligned
+offset, and the item_key is the one of Clexelt.get_item_key. The data file is
+mapped with mmap, so only the pages of the lexelts that are read are loaded.
+'''
+
+from __future__ import print_function
+
+import hashlib
+import mmap
+import os
+
+from ulm_v2 import LexeltReader, align, write_lexelt_to_fd, load_lexelt, open_lexelt_file, \
+    get_lexelt_filename, list_lexelt_files, LEXELT_DIGEST_SIZE
+
+ARCHIVE_MAGIC = b'ULMA'
+ARCHIVE_EXTENSION = '.ulma'
+INDEX_EXTENSION = '.idx'
+
+
+class ArchiveWriter:
+    def __init__(self, filename):
+        self.filename = filename
+        self.fd = open(filename, 'wb')
+        self.fd.write(ARCHIVE_MAGIC)
+        self.entries = []
+        self.item_keys = set()
+
+    def __start_entry(self, item_key):
+        if item_key in self.item_keys:
+            raise ValueError('The lexelt %s is already in the archive %s' % (item_key, self.filename))
+        self.item_keys.add(item_key)
+        self.fd.write(b'\0' * (align(self.fd.tell()) - self.fd.tell()))
+        return self.fd.tell()
+
+    def add_lexelt(self, lexelt):
+        item_key = lexelt.get_item_key()
+        offset = self.__start_entry(item_key)
+        length = write_lexelt_to_fd(lexelt, self.fd)
+        self.entries.append((item_key, offset, length, len(lexelt)))
+
+    def add_ulm_v2_file(self, filename):
+        # Copies the ULM v2 file as it is, without reading the instances
+        reader = LexeltReader(filename)
+        item_key = reader.get_item_key()
+        num_instances = len(reader)
+        del reader
+        offset = self.__start_entry(item_key)
+        fd_in = open(filename, 'rb')
+        data = fd_in.read()
+        fd_in.close()
+        self.fd.write(data)
+        self.entries.append((item_key, offset, len(data), num_instances))
+
+    def close(self):
+        self.fd.close()
+        fd_index = open(self.filename + INDEX_EXTENSION, 'w')
+        for item_key, offset, length, num_instances in self.entries:
+            fd_index.write('%s\t%d\t%d\t%d\n' % (item_key, offset, length, num_instances))
+        fd_index.close()
+
+
+class ArchiveReader:
+    '''
+    Reads the lexelts of an archive by item_key, in the order of the archive,
+    or a subset of them, without reading the others
+    '''
+    def __init__(self, filename):
+        self.filename = filename
+        self.entry_for_item_key = {}
+        self.item_keys = []
+        fd_index = open(filename + INDEX_EXTENSION)
+        for line in fd_index:
+            fields = line.rstrip('\n').split('\t')
+            if len(fields) != 4:
+                continue
+            item_key = fields[0]
+            self.entry_for_item_key[item_key] = (int(fields[1]), int(fields[2]), int(fields[3]))
+            self.item_keys.append(item_key)
+        fd_index.close()
+        fd = open(filename, 'rb')
+        try:
+            if fd.read(len(ARCHIVE_MAGIC)) != ARCHIVE_MAGIC:
+                raise ValueError('%s is not a ULM archive' % filename)
+            self.mmap = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+        finally:
+            fd.close()
+
+    def get_item_keys(self):
+        return list(self.item_keys)
+
+    def __len__(self):
+        return len(self.item_keys)
+
+    def __contains__(self, item_key):
+        return item_key in self.entry_for_item_key
+
+    def get_size(self, item_key):
+        return self.entry_for_item_key[item_key][1]
+
+    def get_num_instances(self, item_key):
+        return self.entry_for_item_key[item_key][2]
+
+    def get_digest(self, item_key):
+        # Hex digest of the bytes of one lexelt, without copying them
+        offset, length, num_instances = self.entry_for_item_key[item_key]
+        data = memoryview(self.mmap)[offset:offset+length]
+        try:
+            return hashlib.blake2b(data, digest_size=LEXELT_DIGEST_SIZE).hexdigest()
+        finally:
+            data.release()
+
+    def open_lexelt(self, item_key):
+        # LexeltReader of one lexelt, raises KeyError if it is not in the archive
+        offset, length, num_instances = self.entry_for_item_key[item_key]
+        return LexeltReader('%s:%s' % (self.filename, item_key), mapped=self.mmap, offset=offset, length=length)
+
+    def load_lexelt(self, item_key):
+        return self.open_lexelt(item_key).to_lexelt()
+
+    def iter_lexelts(self, item_keys=None):
+        # LexeltReader objects of all the lexelts or of the ones in item_keys, in the order of the archive
+        # (the data file is read sequentially). The item keys that are not in the archive are skipped
+        if item_keys is None:
+            item_keys = self.item_keys
+        else:
+            item_keys = sorted(set(item_keys) & set(self.entry_for_item_key), key=lambda item_key: self.entry_for_item_key[item_key][0])
+        for item_key in item_keys:
+            yield self.open_lexelt(item_key)
+
+    def __iter__(self):
+        return self.iter_lexelts()
+
+
+def open_archive(filename):
+    return ArchiveReader(filename)
+
+
+def is_archive(path):
+    if not os.path.isfile(path) or not os.path.exists(path + INDEX_EXTENSION):
+        return False
+    fd = open(path, 'rb')
+    magic = fd.read(len(ARCHIVE_MAGIC))
+    fd.close()
+    return magic == ARCHIVE_MAGIC
+
+
+def iter_lexelts(path, item_keys=None):
+    # Clexelt objects of a ULM folder (.bin or .ulm2 files) or of a ULM archive, all of them
+    # or the ones in item_keys
+    if is_archive(path):
+        for reader in open_archive(path).iter_lexelts(item_keys):
+            yield reader.to_lexelt()
+    else:
+        if item_keys is None:
+            list_files = list_lexelt_files(path)
+        else:
+            list_files = [get_lexelt_filename(path, item_key) for item_key in item_keys]
+        for filename in list_files:
+            if os.path.exists(filename):
+                yield load_lexelt(filename)
+
+
+# Archives already opened in this process, the workers of train_lemmas.py open many lexelts of the same one
+opened_archives = {}
+
+def get_opened_archive(path):
+    if path not in opened_archives:
+        opened_archives[path] = open_archive(path)
+    return opened_archives[path]
+
+
+def open_lexelt_from(path, item_key):
+    # The lexelt item_key of a folder or an archive: a LexeltReader for ULM v2 and archives,
+    # a Clexelt for .bin files and None if it does not exist
+    if is_archive(path):
+        archive = get_opened_archive(path)
+        if item_key not in archive:
+            return None
+        return archive.open_lexelt(item_key)
+    filename = get_lexelt_filename(path, item_key)
+    if not os.path.exists(filename):
+        return None
+    return open_lexelt_file(filename)
+
+
+def get_lexelt_size(path, item_key):
+    # Bytes used by the lexelt item_key in a folder or an archive (0 if it does not exist)
+    if is_archive(path):
+        archive = get_opened_archive(path)
+        if item_key not in archive:
+            return 0
+        return archive.get_size(item_key)
+    filename = get_lexelt_filename(path, item_key)
+    if not os.path.exists(filename):
+        return 0
+    return os.path.getsize(filename)
+
+
+def get_file_digest(filename):
+    # Hex digest of the bytes of a file, read in blocks
+    hasher = hashlib.blake2b(digest_size=LEXELT_DIGEST_SIZE)
+    fd = open(filename, 'rb')
+    for block in iter(lambda: fd.read(1 << 20), b''):
+        hasher.update(block)
+    fd.close()
+    return hasher.hexdigest()
+
+
+def get_lexelt_digest(path, item_key):
+    # Digest of the bytes of the lexelt item_key in a folder or an archive (None if it does not exist),
+    # it changes whenever the lexelt file is rebuilt with different instances
+    if is_archive(path):
+        archive = get_opened_archive(path)
+        if item_key not in archive:
+            return None
+        return archive.get_digest(item_key)
+    filename = get_lexelt_filename(path, item_key)
+    if not os.path.exists(filename):
+        return None
+    return get_file_digest(filename)
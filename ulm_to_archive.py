@@ -0,0 +1,47 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from ulm_v2 import list_lexelt_files, load_lexelt, is_ulm_v2_file
+from ulm_archive import ArchiveWriter, open_archive, INDEX_EXTENSION
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Packs a folder in ULM format (.bin or .ulm2 files) into one ULM archive with an index by lemma.pos')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-i', dest='input_folder', required=True, help='Folder with the .bin or .ulm2 files')
+    parser.add_argument('-o', dest='output', required=True, help='Output archive (the index is created in <output>%s)' % INDEX_EXTENSION)
+    parser.add_argument('--check', dest='check', action='store_true', help='Read every lexelt of the archive and compare its instances with the original ones')
+    args = parser.parse_args()
+
+    start = time.time()
+    list_files = list_lexelt_files(args.input_folder)
+    writer = ArchiveWriter(args.output)
+    total_instances = 0
+    for lexelt_file in list_files:
+        if is_ulm_v2_file(lexelt_file):
+            writer.add_ulm_v2_file(lexelt_file)
+        else:
+            writer.add_lexelt(load_lexelt(lexelt_file))
+        item_key, offset, length, num_instances = writer.entries[-1]
+        total_instances += num_instances
+        print('\tLexical item: %s (%d instances)' % (item_key, num_instances), file=sys.stderr)
+    writer.close()
+
+    if args.check:
+        archive = open_archive(args.output)
+        for lexelt_file in list_files:
+            lexelt = load_lexelt(lexelt_file)
+            for original_instance, this_instance in zip(lexelt, archive.open_lexelt(lexelt.get_item_key())):
+                if original_instance.get_id() != this_instance.get_id() or original_instance.get_content_digest() != this_instance.get_content_digest():
+                    print('ERROR: instance %s of %s is different in the archive' % (original_instance.get_id(), lexelt.get_item_key()), file=sys.stderr)
+                    sys.exit(1)
+
+    print('Total number of lemma.pos (unique): %d' % len(list_files))
+    print('Total number of instances: %d' % total_instances)
+    print('Archive: %s (%.1f MB), index: %s (%.1f seconds)' % (args.output, os.path.getsize(args.output) / (1024.0 * 1024.0), args.output + INDEX_EXTENSION, time.time() - start))
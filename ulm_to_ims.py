@@ -8,11 +8,13 @@ import os
 import glob
 import pickle
 
+from ulm_archive import iter_lexelts
+
 
 if __name__ == '__main__':
     parser = argparse.ArgumentParser(description='Converts  our intermediate ULM format to IMS format (xml and key)')
     parser.add_argument('-v', action='version', version = '1.0')
-    parser.add_argument('-i', dest='input_folder', required=True, help='Path to pickled object files')
+    parser.add_argument('-i', dest='input_folder', required=True, help='Folder with the files in ULM format (.bin or .ulm2) or ULM archive')
     parser.add_argument('-o', dest='output', required=True, help='Output folder')
     
     args = parser.parse_args()
@@ -25,10 +27,8 @@ if __name__ == '__main__':
     total_instances = 0
     total_lemmas = 0
 
-    for bin_file in glob.glob(os.path.join(args.input_folder,'*.bin')):
+    for lexelt in iter_lexelts(args.input_folder):
         total_lemmas += 1
-        fd_in = open(bin_file,'rb')
-        lexelt = pickle.load(fd_in)
         total_instances += len(lexelt)
         
         item_key = lexelt.get_item_key()
@@ -43,7 +43,6 @@ if __name__ == '__main__':
         key_filename = os.path.join(args.output,item_key+'.train.key')
         lexelt.save_key_to_file(key_filename)
             
-        fd_in.close()
     fd_list.close()
     print('List of words in %s' % fd_list.name)
     print('Total number of lemma.pos (unique): %d' % total_lemmas)
@@ -0,0 +1,46 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import glob
+import os
+import sys
+import time
+
+from ulm_v2 import write_lexelt, load_lexelt, open_lexelt, ULM_V2_EXTENSION
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Converts a folder in ULM format (pickled .bin files) to the ULM v2 columnar format')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-i', dest='input_folder', required=True, help='Folder with the .bin files')
+    parser.add_argument('-o', dest='output', required=True, help='Output folder')
+    parser.add_argument('--check', dest='check', action='store_true', help='Read every converted file and compare its instances with the original ones')
+    args = parser.parse_args()
+
+    os.mkdir(args.output)
+    start = time.time()
+    total_lemmas = 0
+    total_instances = 0
+    size_in = size_out = 0
+    for bin_file in sorted(glob.glob(os.path.join(args.input_folder,'*.bin'))):
+        lexelt = load_lexelt(bin_file)
+        item_key = os.path.splitext(os.path.basename(bin_file))[0]
+        output_file = os.path.join(args.output, item_key + ULM_V2_EXTENSION)
+        write_lexelt(lexelt, output_file)
+        print('\tLexical item: %s (%d instances)' % (item_key, len(lexelt)), file=sys.stderr)
+
+        if args.check:
+            for original_instance, this_instance in zip(lexelt, open_lexelt(output_file)):
+                if original_instance.get_id() != this_instance.get_id() or original_instance.get_content_digest() != this_instance.get_content_digest():
+                    print('ERROR: instance %s of %s is different after the conversion' % (original_instance.get_id(), item_key), file=sys.stderr)
+                    sys.exit(1)
+
+        total_lemmas += 1
+        total_instances += len(lexelt)
+        size_in += os.path.getsize(bin_file)
+        size_out += os.path.getsize(output_file)
+    print('Total number of lemma.pos (unique): %d' % total_lemmas)
+    print('Total number of instances: %d' % total_instances)
+    print('Size: %.1f MB in .bin files, %.1f MB in ULM v2 files (%.1f seconds)' % (size_in / (1024.0 * 1024.0), size_out / (1024.0 * 1024.0), time.time() - start))
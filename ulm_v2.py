@@ -0,0 +1,421 @@
+#!/usr/bin/env python
+
+'''
+ULM v2: columnar binary storage of one Clexelt, read with mmap without
+unpickling any object. The file has a small header and flat arrays:
+
+  'ULM2' | uint32 length of the header | header (JSON) | arrays (8-byte aligned)
+
+The header has the lemma, pos, the possible WordNet senses and, for every
+array, its offset, typecode (as in the array module) and number of items.
+All the strings (token ids, texts, lemmas, sensekeys...) are in one pool
+(string_offsets, string_data) and the other arrays refer to them by number,
+-1 is None. The tokens are stored by document and sentence, as in Cdocument,
+and every instance has its document, range of sentences and head indexes.
+The lists of every instance (heads, sensekeys...) are stored as
+<name>_offsets (one per instance plus one) and <name> with the values.
+
+open_lexelt returns a LexeltReader, which creates the Cinstance objects on
+demand; the tokens of a document are read from the mapped columns the first
+time they are used. Iterating a LexeltReader keeps only the current document,
+so a lexelt can be streamed in bounded memory. load_lexelt opens both ULM v2
+files and the pickled .bin files.
+'''
+
+from __future__ import print_function
+
+import hashlib
+import json
+import mmap
+import os
+import pickle
+import struct
+import sys
+from array import array
+
+from my_data_classes import Ctoken, Cdocument, Cinstance, Clexelt, Csense, CONTENT_DIGEST_SIZE, get_text_digest
+
+MAGIC = b'ULM2'
+VERSION = 2
+# Version 1 stored existing_instances as strings of the pool, they are converted to digests when read
+SUPPORTED_VERSIONS = (1, 2)
+ULM_V2_EXTENSION = '.ulm2'
+PICKLE_EXTENSION = '.bin'
+ALIGNMENT = 8
+LEXELT_DIGEST_SIZE = 16                 # Bytes of the blake2b digests of the lexelt files (get_digest)
+
+# Attributes of Cinstance with sets of strings
+STRING_SETS = ['lexkeys', 'cosensekeys', 'mono_cosensekeys', 'cohypo_sensekeys', 'mono_cohypo_sensekeys']
+
+
+class StringPool:
+    def __init__(self):
+        self.id_for_string = {}
+        self.offsets = array('q', [0])
+        self.data = bytearray()
+
+    def get_id(self, this_string):
+        if this_string is None:
+            return -1
+        string_id = self.id_for_string.get(this_string)
+        if string_id is None:
+            string_id = len(self.id_for_string)
+            self.id_for_string[this_string] = string_id
+            self.data.extend(str(this_string).encode('utf-8'))
+            self.offsets.append(len(self.data))
+        return string_id
+
+
+def write_lexelt_to_fd(lexelt, fd):
+    # Writes the lexelt at the current position of fd, returns the number of bytes written
+    strings = StringPool()
+    get_id = strings.get_id
+    arrays = {}
+    for name, typecode in [('document_ids', 'i'),
+                           ('token_ids', 'i'), ('token_texts', 'i'), ('token_lemmas', 'i'), ('token_pos', 'i'),
+                           ('instance_ids', 'i'), ('instance_docsrc', 'i'), ('instance_strategy', 'i'), ('instance_lemma', 'i'),
+                           ('instance_pos', 'i'), ('instance_document', 'i'), ('instance_first_sentence', 'i'),
+                           ('instance_last_sentence', 'i'), ('instance_target_sentence', 'i'), ('instance_sense_rank', 'i'),
+                           ('instance_annotation_type', 'i'), ('instance_is_mfs', 'b'), ('instance_is_lfs', 'b'),
+                           ('has_relative_sentence', 'b'), ('index_head', 'i'), ('confidence_keys', 'i'), ('confidence_values', 'd'),
+                           ('relative_sentence_tokens', 'i'), ('relative_sentence_positions', 'i')] + [(name, 'i') for name in STRING_SETS]:
+        arrays[name] = array(typecode)
+    for name in ['document_sentence', 'sentence_token', 'index_head', 'confidence', 'relative_sentence'] + STRING_SETS:
+        arrays[name+'_offsets'] = array('i', [0])
+
+    def add_list(name, values):
+        arrays[name].extend(values)
+        arrays[name+'_offsets'].append(len(arrays[name]))
+
+    number_for_document = {}
+    for this_instance in lexelt.get_instances_to_save():
+        this_document = this_instance.get_document()
+        if this_document is None:
+            this_document = Cdocument(this_instance.docsrc)
+            this_document.add_sentence([])
+        if id(this_document) not in number_for_document:
+            number_for_document[id(this_document)] = len(number_for_document)
+            arrays['document_ids'].append(get_id(this_document.get_id()))
+            for num_sentence in range(this_document.get_num_sentences()):
+                for token in this_document.get_sentence(num_sentence):
+                    arrays['token_ids'].append(get_id(token.token_id))
+                    arrays['token_texts'].append(get_id(token.text))
+                    arrays['token_lemmas'].append(get_id(token.lemma))
+                    arrays['token_pos'].append(get_id(token.pos))
+                arrays['sentence_token_offsets'].append(len(arrays['token_ids']))
+            arrays['document_sentence_offsets'].append(len(arrays['sentence_token_offsets'])-1)
+
+        arrays['instance_ids'].append(get_id(this_instance.id))
+        arrays['instance_docsrc'].append(get_id(this_instance.docsrc))
+        arrays['instance_strategy'].append(get_id(this_instance.strategy))
+        arrays['instance_lemma'].append(get_id(this_instance.lemma))
+        arrays['instance_pos'].append(get_id(this_instance.pos))
+        arrays['instance_document'].append(number_for_document[id(this_document)])
+        arrays['instance_first_sentence'].append(this_instance.first_sentence)
+        arrays['instance_last_sentence'].append(this_instance.last_sentence)
+        arrays['instance_target_sentence'].append(this_instance.target_sentence)
+        arrays['instance_sense_rank'].append(-1 if this_instance.sense_rank is None else this_instance.sense_rank)
+        arrays['instance_annotation_type'].append(get_id(this_instance.annotation_type))
+        arrays['instance_is_mfs'].append(1 if this_instance.is_mfs else 0)
+        arrays['instance_is_lfs'].append(1 if this_instance.is_lfs else 0)
+        add_list('index_head', this_instance.index_head)
+        for name in STRING_SETS:
+            add_list(name, [get_id(lexkey) for lexkey in sorted(getattr(this_instance, name))])
+        confidence_for_senses = sorted(this_instance.confidence_for_senses.items())
+        arrays['confidence_keys'].extend(get_id(lexkey) for lexkey, value in confidence_for_senses)
+        arrays['confidence_values'].extend(float(value) for lexkey, value in confidence_for_senses)
+        arrays['confidence_offsets'].append(len(arrays['confidence_keys']))
+        # Only for the instances with their own relative sentence positions (not taken from the document)
+        relative_positions = this_instance.relative_sentence_position_for_token_id
+        arrays['has_relative_sentence'].append(0 if relative_positions is None else 1)
+        if relative_positions is None:
+            relative_positions = {}
+        arrays['relative_sentence_tokens'].extend(get_id(token_id) for token_id in relative_positions)
+        arrays['relative_sentence_positions'].extend(relative_positions.values())
+        arrays['relative_sentence_offsets'].append(len(arrays['relative_sentence_tokens']))
+
+    # The digests of Clexelt.existing_instances, CONTENT_DIGEST_SIZE bytes each
+    arrays['existing_instances'] = array('B', b''.join(sorted(lexelt.existing_instances)))
+    arrays['string_offsets'] = strings.offsets
+    arrays['string_data'] = array('B', bytes(strings.data))
+    header = {'version': VERSION,
+              'byteorder': sys.byteorder,
+              'lemma': lexelt.get_lemma(),
+              'pos': lexelt.get_pos(),
+              'num_instances': len(lexelt),
+              'num_documents': len(arrays['document_ids']),
+              'senses': [[sense.get_lexkey(), sense.get_num_sense(), sense.get_synset_offset()] for sense in lexelt.get_possible_senses()],
+              'arrays': {}}
+
+    # The offsets depend on the length of the header, which depends on the offsets
+    header_length = 0
+    while True:
+        position = align(len(MAGIC) + 4 + header_length)
+        for name in sorted(arrays):
+            header['arrays'][name] = [position, arrays[name].typecode, len(arrays[name])]
+            position = align(position + len(arrays[name]) * arrays[name].itemsize)
+        header_bytes = json.dumps(header, sort_keys=True).encode('utf-8')
+        if len(header_bytes) <= header_length:
+            break
+        header_length = len(header_bytes) + 64
+    header_bytes = header_bytes + b' ' * (header_length - len(header_bytes))
+
+    # The offsets are relative to the start of the lexelt, it can be written inside other files
+    start = fd.tell()
+    fd.write(MAGIC)
+    fd.write(struct.pack('<I', header_length))
+    fd.write(header_bytes)
+    for name in sorted(arrays):
+        offset = header['arrays'][name][0]
+        fd.write(b'\0' * (offset - (fd.tell() - start)))
+        arrays[name].tofile(fd)
+    return fd.tell() - start
+
+
+def write_lexelt(lexelt, filename):
+    fd = open(filename, 'wb')
+    write_lexelt_to_fd(lexelt, fd)
+    fd.close()
+
+
+def align(position):
+    return (position + ALIGNMENT - 1) // ALIGNMENT * ALIGNMENT
+
+
+class MappedDocument(Cdocument):
+    '''
+    Cdocument read from the columns of the mapped file. The tokens are read the
+    first time that tokens or sentence_for_token_id are used, so the documents
+    that are not used are never read. When it is pickled it is saved as a
+    normal Cdocument
+    '''
+    def __init__(self, reader, num_document):
+        self.reader = reader
+        self.id = reader.get_string(reader.document_ids[num_document])
+        first_sentence = reader.document_sentence_offsets[num_document]
+        last_sentence = reader.document_sentence_offsets[num_document+1]
+        self.start = reader.sentence_token_offsets[first_sentence]
+        self.end = reader.sentence_token_offsets[last_sentence]
+        self.sentence_offsets = [offset - self.start for offset in reader.sentence_token_offsets[first_sentence:last_sentence+1]]
+
+    def __getattr__(self, name):
+        # Only called while the attribute does not exist yet
+        if name in ('tokens', 'sentence_for_token_id') and 'reader' in self.__dict__:
+            self.__load_tokens()
+            return self.__dict__[name]
+        raise AttributeError(name)
+
+    def __load_tokens(self):
+        reader = self.reader
+        get_string = reader.get_string
+        get_shared_string = reader.get_shared_string
+        start = self.start
+        end = self.end
+        tokens = []
+        for token_id, text, lemma, pos in zip(reader.token_ids[start:end], reader.token_texts[start:end],
+                                              reader.token_lemmas[start:end], reader.token_pos[start:end]):
+            token = Ctoken(get_string(token_id))
+            token.text = get_string(text)
+            token.lemma = get_shared_string(lemma)
+            token.pos = get_shared_string(pos)
+            tokens.append(token)
+        sentence_for_token_id = {}
+        for num_sentence in range(len(self.sentence_offsets) - 1):
+            for token in tokens[self.sentence_offsets[num_sentence]:self.sentence_offsets[num_sentence+1]]:
+                sentence_for_token_id[token.token_id] = num_sentence
+        self.tokens = tokens
+        self.sentence_for_token_id = sentence_for_token_id
+        del self.reader
+
+    def add_sentence(self, list_tokens):
+        raise TypeError('The documents read from a ULM v2 file can not be modified')
+
+    def __reduce__(self):
+        state = {'id': self.id, 'tokens': self.tokens, 'sentence_offsets': self.sentence_offsets,
+                 'sentence_for_token_id': self.sentence_for_token_id}
+        return (Cdocument, (self.id,), state)
+
+
+class LexeltReader:
+    '''
+    Reads one ULM v2 file. The instances are created on demand, one by one
+    (get_instance, iteration) and without loading the rest of the file
+    '''
+    def __init__(self, filename, mapped=None, offset=0, length=None):
+        # mapped, offset and length are used to read a lexelt stored inside a bigger mapped file
+        self.filename = filename
+        if mapped is None:
+            fd = open(filename, 'rb')
+            try:
+                mapped = mmap.mmap(fd.fileno(), 0, access=mmap.ACCESS_READ)
+            finally:
+                fd.close()
+        self.mmap = mapped
+        if length is None:
+            length = len(mapped) - offset
+        self.buffer = memoryview(mapped)[offset:offset+length]
+        if self.buffer[:len(MAGIC)] != MAGIC:
+            raise ValueError('%s is not a ULM v2 file' % filename)
+        header_length = struct.unpack('<I', self.buffer[len(MAGIC):len(MAGIC)+4])[0]
+        self.header = json.loads(bytes(self.buffer[len(MAGIC)+4:len(MAGIC)+4+header_length]).decode('utf-8'))
+        if self.header['version'] not in SUPPORTED_VERSIONS:
+            raise ValueError('Version %s of ULM v2 file %s not supported' % (self.header['version'], filename))
+        if self.header['byteorder'] != sys.byteorder:
+            raise ValueError('The ULM v2 file %s was created in a %s-endian machine' % (filename, self.header['byteorder']))
+        for name, (offset, typecode, length) in self.header['arrays'].items():
+            itemsize = array(typecode).itemsize
+            setattr(self, name, self.buffer[offset:offset + length * itemsize].cast(typecode))
+        self.strings = {}           # Only the strings of get_shared_string
+        self.documents = {}
+
+    def get_string(self, string_id):
+        # Decoded every time, for the strings that are (almost) unique: token and instance ids, token texts
+        if string_id == -1:
+            return None
+        return bytes(self.string_data[self.string_offsets[string_id]:self.string_offsets[string_id+1]]).decode('utf-8')
+
+    def get_shared_string(self, string_id):
+        # Decoded once, for the small vocabularies repeated in many tokens and instances (lemmas, pos, sense
+        # keys...), so their strings are shared. The memory does not grow with the tokens that are read
+        this_string = self.strings.get(string_id)
+        if this_string is None and string_id != -1:
+            this_string = self.get_string(string_id)
+            self.strings[string_id] = this_string
+        return this_string
+
+    def get_lemma(self):
+        return self.header['lemma']
+
+    def get_pos(self):
+        return self.header['pos']
+
+    def get_item_key(self):
+        return '%s.%s' % (self.get_lemma(), self.get_pos()[0].lower())
+
+    def get_digest(self):
+        # Hex digest of the bytes of the lexelt, the same for the .ulm2 file and for its copy in an archive
+        return hashlib.blake2b(self.buffer, digest_size=LEXELT_DIGEST_SIZE).hexdigest()
+
+    def __len__(self):
+        return self.header['num_instances']
+
+    def get_document(self, num_document):
+        this_document = self.documents.get(num_document)
+        if this_document is None:
+            this_document = MappedDocument(self, num_document)
+            self.documents[num_document] = this_document
+        return this_document
+
+    def __get_list(self, name, num_instance):
+        offsets = getattr(self, name+'_offsets')
+        return getattr(self, name)[offsets[num_instance]:offsets[num_instance+1]]
+
+    def get_instance(self, num_instance, document=None):
+        # document is the MappedDocument of the instance if the caller already has it
+        get_string = self.get_string
+        get_shared_string = self.get_shared_string
+        new_instance = Cinstance()
+        new_instance.id = get_string(self.instance_ids[num_instance])
+        new_instance.docsrc = get_shared_string(self.instance_docsrc[num_instance])
+        new_instance.strategy = get_shared_string(self.instance_strategy[num_instance])
+        new_instance.set_lemma(get_shared_string(self.instance_lemma[num_instance]))
+        new_instance.set_pos(get_shared_string(self.instance_pos[num_instance]))
+        if document is None:
+            document = self.get_document(self.instance_document[num_instance])
+        new_instance.document = document
+        new_instance.first_sentence = self.instance_first_sentence[num_instance]
+        new_instance.last_sentence = self.instance_last_sentence[num_instance]
+        new_instance.target_sentence = self.instance_target_sentence[num_instance]
+        new_instance.index_head = self.__get_list('index_head', num_instance).tolist()
+        sense_rank = self.instance_sense_rank[num_instance]
+        new_instance.sense_rank = None if sense_rank == -1 else sense_rank
+        new_instance.annotation_type = get_shared_string(self.instance_annotation_type[num_instance])
+        new_instance.is_mfs = self.instance_is_mfs[num_instance] == 1
+        new_instance.is_lfs = self.instance_is_lfs[num_instance] == 1
+        for name in STRING_SETS:
+            list_ids = self.__get_list(name, num_instance)
+            if len(list_ids) != 0:
+                setattr(new_instance, name, set(get_shared_string(string_id) for string_id in list_ids))
+        start, end = self.confidence_offsets[num_instance], self.confidence_offsets[num_instance+1]
+        if end != start:
+            new_instance.confidence_for_senses = {get_shared_string(string_id): value for string_id, value in zip(self.confidence_keys[start:end], self.confidence_values[start:end])}
+        if self.has_relative_sentence[num_instance] == 1:
+            start, end = self.relative_sentence_offsets[num_instance], self.relative_sentence_offsets[num_instance+1]
+            new_instance.relative_sentence_position_for_token_id = {get_string(string_id): position for string_id, position in zip(self.relative_sentence_tokens[start:end], self.relative_sentence_positions[start:end])}
+        return new_instance
+
+    def __iter__(self):
+        # The documents are not cached here, only the one of the previous instance is reused (the
+        # instances of a document are consecutive), so the memory used does not grow with the lexelt
+        num_last_document = None
+        for num_instance in range(len(self)):
+            num_document = self.instance_document[num_instance]
+            if num_document != num_last_document:
+                num_last_document = num_document
+                last_document = self.documents.get(num_document)
+                if last_document is None:
+                    last_document = MappedDocument(self, num_document)
+            yield self.get_instance(num_instance, last_document)
+
+    def get_possible_senses(self):
+        for lexkey, num_sense, synset_offset in self.header['senses']:
+            yield Csense(lexkey=lexkey, num_sense=num_sense, synset_offset=synset_offset)
+
+    def to_lexelt(self):
+        # Clexelt with all the instances, their tokens are still read from the mapped file
+        lexelt = Clexelt(self.get_lemma(), self.get_pos())
+        for this_sense in self.get_possible_senses():
+            lexelt.wn_possible_senses[this_sense.get_lexkey()] = this_sense
+        lexelt.instances = [self.get_instance(num_instance) for num_instance in range(len(self))]
+        if self.header['version'] == 1:
+            lexelt.existing_instances = set(get_text_digest(self.get_string(string_id)) for string_id in self.existing_instances)
+        else:
+            digests = bytes(self.existing_instances)
+            lexelt.existing_instances = set(digests[start:start+CONTENT_DIGEST_SIZE] for start in range(0, len(digests), CONTENT_DIGEST_SIZE))
+        return lexelt
+
+
+def open_lexelt(filename):
+    return LexeltReader(filename)
+
+
+def is_ulm_v2_file(filename):
+    fd = open(filename, 'rb')
+    magic = fd.read(len(MAGIC))
+    fd.close()
+    return magic == MAGIC
+
+
+def load_lexelt(filename):
+    # Clexelt from a ULM v2 file or from a pickled .bin file
+    if is_ulm_v2_file(filename):
+        return open_lexelt(filename).to_lexelt()
+    fd = open(filename, 'rb')
+    lexelt = pickle.load(fd)
+    fd.close()
+    return lexelt
+
+
+def open_lexelt_file(filename):
+    # LexeltReader for a ULM v2 file (instances read on demand), Clexelt for a pickled .bin file
+    if is_ulm_v2_file(filename):
+        return open_lexelt(filename)
+    return load_lexelt(filename)
+
+
+def get_lexelt_filename(folder, item_key):
+    # The ULM v2 file of the item if it exists, otherwise the .bin file
+    v2_filename = os.path.join(folder, item_key + ULM_V2_EXTENSION)
+    if os.path.exists(v2_filename):
+        return v2_filename
+    return os.path.join(folder, item_key + PICKLE_EXTENSION)
+
+
+def list_lexelt_files(folder):
+    # All the lexelt files of the folder, the ULM v2 one when there are both for an item
+    filename_for_item = {}
+    for filename in sorted(os.listdir(folder)):
+        item_key, extension = os.path.splitext(filename)
+        if extension == ULM_V2_EXTENSION or (extension == PICKLE_EXTENSION and item_key not in filename_for_item):
+            filename_for_item[item_key] = os.path.join(folder, filename)
+    return [filename_for_item[item_key] for item_key in sorted(filename_for_item)]
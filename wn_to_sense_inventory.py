@@ -0,0 +1,49 @@
+#!/usr/bin/env python
+
+from __future__ import print_function
+
+import argparse
+import os
+import sys
+import time
+
+from nltk.corpus import WordNetCorpusReader
+
+from sense_inventory import write_sense_inventory, SenseInventory, WordNetSenseInventory, SENSE_INVENTORY_EXTENSION
+from sensekey_utils import get_co_sensekeys, get_cohypo_sensekeys, hyponym_sensekeys
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Creates the sense inventory file (senses and monosemy of every lemma.pos and relations of the synsets) of a WordNet dict folder')
+    parser.add_argument('-v', action='version', version = '1.0')
+    parser.add_argument('-wn', dest='path_to_wn', required=True, help='Path to the wordnet dict folder')
+    parser.add_argument('-o', dest='output', required=True, help='Output file (usually with extension %s)' % SENSE_INVENTORY_EXTENSION)
+    parser.add_argument('--check', dest='check', action='store_true', help='Compare every lemma.pos and synset of the file with the NLTK reader')
+    args = parser.parse_args()
+
+    start = time.time()
+    my_wn_reader = WordNetCorpusReader(args.path_to_wn, None)
+    num_items = write_sense_inventory(my_wn_reader, args.output)
+
+    if args.check:
+        inventory = SenseInventory(args.output)
+        wn_inventory = WordNetSenseInventory(my_wn_reader)
+        for num_item in range(len(inventory)):
+            lemma, pos = inventory.get_string(inventory.item_keys[num_item]).rsplit('.', 1)
+            if inventory.get_senses(lemma, pos) != wn_inventory.get_senses(lemma, pos) or inventory.is_monosemous(lemma, pos) != wn_inventory.is_monosemous(lemma, pos):
+                print('ERROR: the senses of %s.%s are different in the sense inventory' % (lemma, pos), file=sys.stderr)
+                sys.exit(1)
+        # The relations, compared with the functions of sensekey_utils on the NLTK synsets
+        for synset in my_wn_reader.all_synsets():
+            num_synset = inventory.find_synset(synset.pos(), synset.offset())
+            main_sensekey = synset.lemmas()[0].key()
+            if inventory.get_co_sensekeys(num_synset, main_sensekey) != get_co_sensekeys(synset, main_sensekey) or \
+               inventory.get_cohypo_sensekeys(num_synset) != get_cohypo_sensekeys(synset) or \
+               inventory.get_hyponym_sensekeys(num_synset) != hyponym_sensekeys(synset) or \
+               inventory.get_hyponym_sensekeys(num_synset, max_depth_from_synset=1) != hyponym_sensekeys(synset, max_depth_from_synset=1) or \
+               inventory.get_hyponym_sensekeys(num_synset, depth_synset=5) != hyponym_sensekeys(synset, depth_synset=5):
+                print('ERROR: the relations of %s are different in the sense inventory' % synset.name(), file=sys.stderr)
+                sys.exit(1)
+
+    print('Total number of lemma.pos: %d' % num_items)
+    print('Sense inventory: %s (%.1f MB, %.1f seconds)' % (args.output, os.path.getsize(args.output) / (1024.0 * 1024.0), time.time() - start))